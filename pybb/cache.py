@@ -0,0 +1,142 @@
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.signals import request_finished, request_started
+
+from pybb import defaults
+
+
+_versioned_caches = []
+
+
+class VersionedCache(object):
+    """
+    Memoize the result of ``func`` in the current process, keyed by a
+    generation counter stored in the shared cache.
+
+    ``cache_clear()`` bumps the generation so that every process recomputes
+    the value on its next call. The generation is read once per request, the
+    other calls of the request are answered from the local memo.
+
+    When ``shared`` is set the value itself is also stored in the shared cache
+    for its generation, so that it is computed by a single process.
+    """
+    prefix = 'pybb:generation'
+
+    def __init__(self, name, func, cache_alias=None, shared=False):
+        self.name = name
+        self.func = func
+        self.cache_alias = cache_alias
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = None
+        self._value = None
+
+        self.__doc__ = func.__doc__
+
+        _versioned_caches.append(self)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias or defaults.PYBB_CACHE]
+
+    def get_key(self):
+        return '%s:%s' % (self.prefix, self.name)
+
+    def get_value_key(self, generation):
+        return 'pybb:versioned:%s:%s' % (self.name, generation)
+
+    def get_initial_generation(self):
+        # an evicted counter must not restart at a generation already memoized
+        return int(time.time() * 1000)
+
+    def get_generation(self):
+        key = self.get_key()
+
+        self.cache.add(key, self.get_initial_generation(), timeout=None)
+
+        return self.cache.get(key) or 1
+
+    def __call__(self):
+        generation = getattr(self._local, 'generation', None)
+
+        if generation is None:
+            generation = self.get_generation()
+
+            if getattr(self._local, 'in_request', False):
+                self._local.generation = generation
+
+        with self._lock:
+            if self._generation != generation:
+                self._value, self._generation = self.compute(generation), generation
+
+            return self._value
+
+    def compute(self, generation):
+        if not self.shared:
+            return self.func()
+
+        key = self.get_value_key(generation)
+
+        value = self.cache.get(key)
+
+        if value is None:
+            value = self.func()
+
+            self.cache.set(key, value)
+
+        return value
+
+    def cache_clear(self):
+        key = self.get_key()
+
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            if not self.cache.add(key, self.get_initial_generation(), timeout=None):
+                self.cache.incr(key)
+
+        with self._lock:
+            self._value, self._generation = None, None
+
+        self._local.generation = None
+
+    def start_request(self):
+        self._local.in_request = True
+        self._local.generation = None
+
+    def finish_request(self):
+        self._local.in_request = False
+        self._local.generation = None
+
+
+def versioned_cache(name, cache_alias=None, shared=False):
+    """
+    Decorator memoizing a function without arguments until ``cache_clear()``
+    is called on it in any process::
+
+        @versioned_cache('moderators')
+        def get_moderator_ids_by_forum():
+            ...
+    """
+    def decorator(func):
+        return VersionedCache(name, func, cache_alias=cache_alias, shared=shared)
+
+    return decorator
+
+
+def start_request(**kwargs):
+    for versioned in _versioned_caches:
+        versioned.start_request()
+
+
+def finish_request(**kwargs):
+    for versioned in _versioned_caches:
+        versioned.finish_request()
+
+
+request_started.connect(start_request, dispatch_uid='pybb_versioned_cache_start_request')
+request_finished.connect(finish_request, dispatch_uid='pybb_versioned_cache_finish_request')
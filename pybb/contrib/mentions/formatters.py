@@ -15,8 +15,11 @@ def mention(tag_name, value, options, parent, context):
     user_id = options['mention']
 
     try:
-        user = User.objects.get(pk=user_id)
-    except (User.DoesNotExist, ValueError):
+        if 'mentioned_users' in context:
+            user = context['mentioned_users'][int(user_id)]
+        else:
+            user = User.objects.get(pk=user_id)
+    except (User.DoesNotExist, KeyError, ValueError):
         return settings.PYBB_MENTIONS_MENTION_FORMAT_WITHOUT_USER % {
             'username': value
         }
@@ -28,3 +31,23 @@ def mention(tag_name, value, options, parent, context):
             'user_url': settings.PYBB_MENTIONS_USER_URL(user),
             'username': value
         }
+
+
+def prefetch_mentions(options_list):
+    """
+    Fetch the users of every mention tag of a message with one query
+    """
+    user_ids = set()
+
+    for options in options_list:
+        try:
+            user_ids.add(int(options['mention']))
+        except (KeyError, ValueError):
+            pass
+
+    return {
+        'mentioned_users': get_user_model().objects.in_bulk(user_ids) if user_ids else {}
+    }
+
+
+mention.prefetch = prefetch_mentions
@@ -1,5 +1,9 @@
 import re
 
+from collections import OrderedDict
+
+from django.db.models import Q
+
 from pybb.processors import BaseProcessor
 from pybb.compat import get_user_model
 
@@ -8,40 +12,70 @@ from . import settings
 
 class MentionProcessor(BaseProcessor):
     username_re = r'@([\w\-]+)'
-    format = '@%(username)s'
     tag = '[mention=%(user_id)s]%(username)s[/mention]'
     model = get_user_model()
 
+    @classmethod
+    def get_fingerprint(cls):
+        return (settings.PYBB_MENTIONS_MAX_PER_POST, )
+
     def get_user_url(self, user):
         return settings.PYBB_MENTIONS_USER_URL(user)
 
     def get_users(self, username_list):
-        return self.model.objects.filter(username__in=username_list).values_list('username', 'id')
+        candidates = set(username_list) | set(username.lower() for username in username_list)
 
-    def _format(self, user, body):
-        username, user_id = user
+        users = list(self.model.objects.filter(username__in=candidates).values_list('username', 'id'))
 
-        format = self.format % {
-            'username': username
-        }
+        found = set(username.lower() for username, user_id in users)
+
+        # only the exact lookup can use the username index, resolve the misses case insensitively
+        query = Q()
+
+        for username in username_list:
+            if username.lower() not in found:
+                query |= Q(username__iexact=username)
+
+        if query:
+            users += list(self.model.objects.filter(query).values_list('username', 'id'))
+
+        return users
 
-        body = body.replace(format, self.tag % {
+    def _format(self, user):
+        username, user_id = user
+
+        return self.tag % {
             'user_id': user_id,
             'username': username
-        })
-
-        return body
+        }
 
     def render(self):
         body = self.body
 
-        username_list = [m.group(1) for m in re.finditer(self.username_re,
-                                                         body,
-                                                         re.MULTILINE)]
+        username_list = OrderedDict()
+
+        for m in re.finditer(self.username_re, body, re.MULTILINE):
+            if len(username_list) >= settings.PYBB_MENTIONS_MAX_PER_POST:
+                break
+
+            username_list.setdefault(m.group(1).lower(), m.group(1))
+
+        if not username_list:
+            return body
+
+        users = {}
+
+        for username, user_id in self.get_users(list(username_list.values())):
+            # an exact match wins over the other usernames differing by case
+            if username == username_list.get(username.lower()) or username.lower() not in users:
+                users[username.lower()] = (username, user_id)
+
+        def replace(m):
+            user = users.get(m.group(1).lower())
 
-        users = self.get_users(username_list)
+            if user is None:
+                return m.group(0)
 
-        for user in users:
-            body = self._format(user, body)
+            return self._format(user)
 
-        return body
+        return re.sub(self.username_re, replace, body, flags=re.MULTILINE)
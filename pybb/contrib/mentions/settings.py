@@ -11,3 +11,5 @@ PYBB_MENTIONS_MENTION_FORMAT_WITH_USER = getattr(settings,
 PYBB_MENTIONS_MENTION_FORMAT_WITHOUT_USER = getattr(settings,
                                                     'PYBB_MENTIONS_MENTION_FORMAT_WITHOUT_USER',
                                                     '@<span class="mention">%(username)s</span>')
+
+PYBB_MENTIONS_MAX_PER_POST = getattr(settings, 'PYBB_MENTIONS_MAX_PER_POST', 50)
@@ -62,7 +62,7 @@ class Profile(ModelBase):
         verbose_name_plural = _('Profiles')
 
     def save(self, *args, **kwargs):
-        self.signature = markup(self.signature, obj=self)
+        self.signature = markup(self.signature, obj=self, cache=True)
 
         super(Profile, self).save(*args, **kwargs)
 
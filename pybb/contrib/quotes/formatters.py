@@ -28,9 +28,13 @@ def quote(tag_name, value, options, parent, context):
         }
 
     try:
-        post = Post.objects.get(pk=post_id)
+        if 'quoted_posts' in context:
+            post = context['quoted_posts'][post_id]
+        else:
+            post = Post.objects.get(pk=post_id)
+
         user = post.user
-    except (Post.DoesNotExist, get_user_model().DoesNotExist):
+    except (Post.DoesNotExist, get_user_model().DoesNotExist, KeyError):
         return settings.PYBB_QUOTES_QUOTE_MINIMAL_FORMAT % {
             'message': value,
             'username': splits[0],
@@ -51,3 +55,26 @@ def quote(tag_name, value, options, parent, context):
         'username': username,
         'post_url': settings.PYBB_QUOTES_POST_URL(post)  # anonymous anchor url
     }
+
+
+def prefetch_quotes(options_list):
+    """
+    Fetch the posts of every quote tag of a message in one query, with the
+    user and the topic used by the quote format
+    """
+    post_ids = set()
+
+    for options in options_list:
+        try:
+            username, post_id = options['quote'].split(';')
+
+            post_ids.add(int(post_id))
+        except (KeyError, ValueError):
+            pass
+
+    return {
+        'quoted_posts': Post.objects.select_related('user', 'topic__forum').in_bulk(post_ids) if post_ids else {}
+    }
+
+
+quote.prefetch = prefetch_quotes
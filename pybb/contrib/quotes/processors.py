@@ -1,36 +1,52 @@
+import re
+
 from pybb.processors import BaseProcessor
 from . import settings
 
 
 class QuoteProcessor(BaseProcessor):
+    # an opening tag cannot contain another tag, so an unclosed "[quote"
+    # is only scanned up to the next bracket
+    tag_re = re.compile(r'\[quote(?:[=\s][^\[\]]*)?\]|\[/quote\]', re.IGNORECASE)
+
+    @classmethod
+    def get_fingerprint(cls):
+        return (settings.PYBB_QUOTES_MAX_DEPTH, )
+
     def render(self):
         """strip all quotes deeper than PYBB_QUOTES_MAX_DEPTH"""
         max_depth = settings.PYBB_QUOTES_MAX_DEPTH
         if max_depth < 0:
             # nothing to do
             return self.body
-        START_TAG = '[quote'
-        END_TAG = '[/quote]'
+
+        body = self.body
+        buf = []
         depth = 0
-        body = u""
         cursor = 0
-        while True:
-            start = self.body.find(START_TAG, cursor)
-            end = self.body.find(END_TAG, cursor)
-            if start == end:
-                body += self.body[cursor:]
-                break
-            if end < start or start == -1:
-                next_cursor = end + len(END_TAG)
+
+        for m in self.tag_re.finditer(body):
+            closing = m.group(0)[1] == '/'
+
+            if closing and depth == 0:
+                # closing tag without an opening one, keep it as text
+                continue
+
+            if depth <= max_depth:
+                buf.append(body[cursor:m.start()])
+
+            if closing:
                 if depth <= max_depth:
-                    body += self.body[cursor:next_cursor]
-                cursor = next_cursor
+                    buf.append(m.group(0))
                 depth -= 1
-            elif start < end:
-                if depth <= max_depth:
-                    body += self.body[cursor:start]
-                cursor = self.body.find(']', start) + 1
+            else:
                 depth += 1
                 if depth <= max_depth:
-                    body += self.body[start:cursor]
-        return body
+                    buf.append(m.group(0))
+
+            cursor = m.end()
+
+        if depth <= max_depth:
+            buf.append(body[cursor:])
+
+        return u''.join(buf)
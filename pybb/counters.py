@@ -0,0 +1,293 @@
+import atexit
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import F
+
+from pybb import defaults
+from pybb.util import load_class
+
+
+_local = threading.local()
+
+
+def get_dirty_forums():
+    """
+    Return the dirty forums of the current batch as a dict of
+    forum id -> whether its last post must be refreshed, None outside of a batch
+    """
+    return getattr(_local, 'dirty_forums', None)
+
+
+def mark_forum_dirty(forum, last_post=False):
+    """
+    Register ``forum`` for recomputation at the end of the current batch,
+    return False when there is no batch and the caller must recompute now
+    """
+    dirty_forums = get_dirty_forums()
+
+    if dirty_forums is None:
+        return False
+
+    dirty_forums[forum.pk] = dirty_forums.get(forum.pk, False) or last_post
+
+    return True
+
+
+def recompute_forums(dirty_forums):
+    """
+    Recompute each forum once, children before their parents,
+    so that a parent sums up counters which are already up to date
+    """
+    from pybb.models import Forum
+
+    if not dirty_forums:
+        return
+
+    forum_ids = set(dirty_forums)
+
+    for forum_ids_list in Forum.objects.filter(pk__in=dirty_forums).values_list('forum_ids', flat=True):
+        forum_ids.update(forum_ids_list or [])
+
+    forums = sorted(Forum.objects.filter(pk__in=forum_ids),
+                    key=lambda forum: len(forum.forum_ids or []),
+                    reverse=True)
+
+    for forum in forums:
+        if dirty_forums.get(forum.pk, False):
+            forum.update_last_post()
+
+        forum.compute(parents=False)
+
+
+@contextmanager
+def defer_forum_counters():
+    """
+    Coalesce forum counter recomputations in a single transaction, usable as
+    a context manager or a decorator::
+
+        with defer_forum_counters():
+            for topic in topics:
+                topic.mark_as_deleted()
+
+    Every forum touched inside the block is recomputed exactly once when the
+    outermost block exits, instead of walking the parent chain for each change.
+    """
+    if get_dirty_forums() is not None:
+        yield
+        return
+
+    _local.dirty_forums = {}
+
+    try:
+        with transaction.atomic():
+            yield
+
+            dirty_forums, _local.dirty_forums = _local.dirty_forums, None
+
+            recompute_forums(dirty_forums)
+    finally:
+        _local.dirty_forums = None
+
+
+def apply_view_deltas(deltas):
+    """
+    Add the buffered views to the topics, grouping the topics
+    by increment to issue one UPDATE per distinct value
+    """
+    from pybb.models import Topic
+
+    topic_ids_by_delta = defaultdict(list)
+
+    for topic_id, delta in deltas.items():
+        if delta:
+            topic_ids_by_delta[delta].append(topic_id)
+
+    for delta, topic_ids in topic_ids_by_delta.items():
+        Topic.objects.filter(pk__in=topic_ids).update(views=F('views') + delta)
+
+    return sum(len(topic_ids) for topic_ids in topic_ids_by_delta.values())
+
+
+class CacheViewCounter(object):
+    """
+    Accumulate topic views in the cache, shared by every process.
+
+    Increments are stored per generation, flush() opens a new generation and
+    writes the closed ones to the database. The generation it just closed is
+    only written by the next flush, leaving the writers which read it before
+    the time to register their increments.
+    """
+    prefix = 'pybb:views'
+
+    # backends which are not shared between processes
+    local_backends = (DummyCache, LocMemCache, FileBasedCache)
+
+    # generations scanned when the last flushed one has been evicted from the cache
+    max_generations = 10
+
+    # seconds before the lock of a flush which never released it expires
+    lock_timeout = 60 * 5
+
+    def __init__(self, cache_alias=None):
+        self.cache = caches[cache_alias or defaults.PYBB_VIEW_COUNTER_CACHE]
+
+    def is_available(self):
+        return not isinstance(self.cache, self.local_backends)
+
+    def get_key(self, *args):
+        return ':'.join([self.prefix] + [str(arg) for arg in args])
+
+    def get_generation(self):
+        key = self.get_key('generation')
+
+        self.cache.add(key, 1, timeout=None)
+
+        return self.cache.get(key) or 1
+
+    def get_flushed(self, generation):
+        flushed = self.cache.get(self.get_key('flushed'))
+
+        if flushed is None:
+            return max(generation - self.max_generations, 0)
+
+        return flushed
+
+    def _incr(self, key, delta=1):
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            if self.cache.add(key, delta, timeout=None):
+                return None
+
+            return self.cache.incr(key, delta)
+
+    def incr(self, topic_id, delta=1):
+        generation = self.get_generation()
+
+        if self._incr(self.get_key(generation, 'topic', topic_id), delta) is None:
+            # first view of the topic in this generation, register it for the flush
+            index = self._incr(self.get_key(generation, 'count')) or 1
+
+            self.cache.set(self.get_key(generation, 'index', index), topic_id, timeout=None)
+
+    def pending(self, topic_ids):
+        generation = self.get_generation()
+
+        keys = dict((self.get_key(pending, 'topic', topic_id), topic_id)
+                    for pending in range(self.get_flushed(generation) + 1, generation + 1)
+                    for topic_id in topic_ids)
+
+        result = dict((topic_id, 0) for topic_id in topic_ids)
+
+        for key, delta in self.cache.get_many(keys.keys()).items():
+            result[keys[key]] += delta
+
+        return result
+
+    def flush(self):
+        lock_key = self.get_key('lock')
+
+        # two concurrent flushes would both apply the same closed generations
+        if not self.cache.add(lock_key, 1, timeout=self.lock_timeout):
+            return 0
+
+        try:
+            return self._flush()
+        finally:
+            self.cache.delete(lock_key)
+
+    def _flush(self):
+        generation = self.get_generation()
+
+        self._incr(self.get_key('generation'))
+
+        flushed = self.get_flushed(generation)
+
+        # the generation just closed may still receive increments
+        last = generation - 1
+
+        count = 0
+
+        for closed in range(flushed + 1, last + 1):
+            index_keys = [self.get_key(closed, 'index', index)
+                          for index in range(1, (self.cache.get(self.get_key(closed, 'count')) or 0) + 1)]
+
+            topic_ids = set(self.cache.get_many(index_keys).values())
+
+            keys = dict((self.get_key(closed, 'topic', topic_id), topic_id) for topic_id in topic_ids)
+
+            deltas = dict((keys[key], delta) for key, delta in self.cache.get_many(keys.keys()).items())
+
+            count += apply_view_deltas(deltas)
+
+            self.cache.delete_many(list(keys.keys()) + index_keys + [self.get_key(closed, 'count')])
+
+        if last > flushed:
+            self.cache.set(self.get_key('flushed'), last, timeout=None)
+
+        return count
+
+
+class LocalViewCounter(object):
+    """
+    Accumulate topic views in the memory of the current process, used when
+    the cache is not shared between processes, flushed by the process itself
+    on an increment past the threshold or the interval, and at exit.
+
+    The views of a process killed before its exit handlers run are lost.
+    """
+
+    def __init__(self, threshold=None, interval=None):
+        self.threshold = threshold or defaults.PYBB_VIEW_COUNTER_FLUSH_THRESHOLD
+        self.interval = interval or defaults.PYBB_VIEW_COUNTER_FLUSH_INTERVAL
+
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(int)
+        self._flushed_at = time.time()
+
+    def is_available(self):
+        return True
+
+    def incr(self, topic_id, delta=1):
+        with self._lock:
+            self._deltas[topic_id] += delta
+
+            should_flush = (sum(self._deltas.values()) >= self.threshold or
+                            time.time() - self._flushed_at >= self.interval)
+
+        if should_flush:
+            self.flush()
+
+    def pending(self, topic_ids):
+        with self._lock:
+            return dict((topic_id, self._deltas.get(topic_id, 0)) for topic_id in topic_ids)
+
+    def flush(self):
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(int)
+            self._flushed_at = time.time()
+
+        return apply_view_deltas(deltas)
+
+
+@lru_cache()
+def get_view_counter():
+    counter = load_class(defaults.PYBB_VIEW_COUNTER_CLASS)()
+
+    if not counter.is_available():
+        counter = LocalViewCounter()
+
+        # nothing else flushes the views left by the last requests
+        atexit.register(counter.flush)
+
+    return counter
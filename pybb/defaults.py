@@ -37,10 +37,17 @@ PYBB_MARKUP_PREPROCESSORS = getattr(settings, 'PYBB_MARKUP_PREPROCESSORS', (
 ))
 PYBB_MARKUP_POSTPROCESSORS = getattr(settings, 'PYBB_MARKUP_POSTPROCESSORS', (
     'pybb.sanitizer.BleachProcessor',
+    'pybb.processors.ImageCaptureProcessor',
 ))
 
 PYBB_MARKUP = getattr(settings, 'PYBB_MARKUP', 'bbcode')
 PYBB_MARKUP_ENGINE = getattr(settings, 'PYBB_MARKUP_ENGINE', 'pybb.engines.bbcode.BBCodeMarkupEngine')
+PYBB_MARKUP_PIPELINE_HOOK = getattr(settings, 'PYBB_MARKUP_PIPELINE_HOOK', None)
+
+# point it to a cache with LRU eviction (memcached, redis with allkeys-lru, ...)
+PYBB_RENDER_CACHE = getattr(settings, 'PYBB_RENDER_CACHE', 'default')
+PYBB_RENDER_CACHE_TIMEOUT = getattr(settings, 'PYBB_RENDER_CACHE_TIMEOUT', 60 * 60 * 24 * 7)
+PYBB_RENDER_SCHEDULE_TIMEOUT = getattr(settings, 'PYBB_RENDER_SCHEDULE_TIMEOUT', 60)
 
 PYBB_BBCODE_MARKUP_SIMPLE_FORMATTERS = getattr(settings, 'PYBB_BBCODE_MARKUP_SIMPLE_FORMATTERS', ())
 PYBB_BBCODE_MARKUP_FORMATTERS = getattr(settings, 'PYBB_BBCODE_MARKUP_FORMATTERS', ())
@@ -164,8 +171,10 @@ PYBB_FORUM_MODEL = getattr(settings, 'PYBB_FORUM_MODEL', 'pybb.models.forum.Foru
 PYBB_TOPIC_MODEL = getattr(settings, 'PYBB_TOPIC_MODEL', 'pybb.models.topic.Topic')
 PYBB_POST_MODEL = getattr(settings, 'PYBB_POST_MODEL', 'pybb.models.post.Post')
 PYBB_ATTACHMENT_MODEL = getattr(settings, 'PYBB_ATTACHMENT_MODEL', 'pybb.models.attachment.Attachment')
+PYBB_TOPIC_PARTICIPANT_MODEL = getattr(settings, 'PYBB_TOPIC_PARTICIPANT_MODEL', 'pybb.models.topic.TopicParticipant')
 PYBB_TOPIC_READ_TRACKER_MODEL = getattr(settings, 'PYBB_TOPIC_READ_TRACKER_MODEL', 'pybb.models.tracker.TopicReadTracker')
 PYBB_FORUM_READ_TRACKER_MODEL = getattr(settings, 'PYBB_FORUM_READ_TRACKER_MODEL', 'pybb.models.tracker.ForumReadTracker')
+PYBB_FORUM_READ_MARK_MODEL = getattr(settings, 'PYBB_FORUM_READ_MARK_MODEL', 'pybb.models.tracker.ForumReadMark')
 PYBB_POLL_ANSWER_MODEL = getattr(settings, 'PYBB_POLL_ANSWER_MODEL', 'pybb.models.poll.PollAnswer')
 PYBB_POLL_ANSWER_USER_MODEL = getattr(settings, 'PYBB_POLL_ANSWER_USER_MODEL', 'pybb.models.poll.PollAnswerUser')
 PYBB_LOG_MODERATION_MODEL = getattr(settings, 'PYBB_LOG_MODERATION_MODEL', 'pybb.models.moderation.LogModeration')
@@ -218,3 +227,15 @@ PYBB_FILE_SHARD_DEPTH = getattr(settings, 'PYBB_FILE_SHARD_DEPTH', 2)
 PYBB_STORAGE_CLASS = getattr(settings, 'PYBB_STORAGE_CLASS', settings.DEFAULT_FILE_STORAGE)
 
 PYBB_FORBIDDEN_SLUGS = getattr(settings, 'PYBB_FORBIDDEN_SLUGS', ['subscriptions'])
+
+PYBB_CACHE = getattr(settings, 'PYBB_CACHE', 'default')
+
+PYBB_FORUM_MOVE_CHUNK_SIZE = getattr(settings, 'PYBB_FORUM_MOVE_CHUNK_SIZE', None)
+PYBB_FORUM_IDS_REPAIR_DELAY = getattr(settings, 'PYBB_FORUM_IDS_REPAIR_DELAY', 60)
+
+PYBB_READ_TRACKER_CLASS = getattr(settings, 'PYBB_READ_TRACKER_CLASS', 'pybb.trackers.ModelReadTracker')
+
+PYBB_VIEW_COUNTER_CLASS = getattr(settings, 'PYBB_VIEW_COUNTER_CLASS', 'pybb.counters.CacheViewCounter')
+PYBB_VIEW_COUNTER_CACHE = getattr(settings, 'PYBB_VIEW_COUNTER_CACHE', 'default')
+PYBB_VIEW_COUNTER_FLUSH_THRESHOLD = getattr(settings, 'PYBB_VIEW_COUNTER_FLUSH_THRESHOLD', 100)
+PYBB_VIEW_COUNTER_FLUSH_INTERVAL = getattr(settings, 'PYBB_VIEW_COUNTER_FLUSH_INTERVAL', 60)
@@ -0,0 +1,36 @@
+import threading
+
+from functools import lru_cache
+
+from pybb import defaults
+from pybb.util import load_class
+
+
+_engines = {}
+_lock = threading.Lock()
+
+
+@lru_cache()
+def get_engine_class(path):
+    return load_class(path)
+
+
+def get_markup_engine(path=None):
+    """
+    Return the markup engine of ``path``, built once per process and per
+    settings fingerprint then shared by every render
+    """
+    engine_class = get_engine_class(path or defaults.PYBB_MARKUP_ENGINE)
+
+    key = (engine_class, engine_class.get_fingerprint())
+
+    engine = _engines.get(key)
+
+    if engine is None:
+        with _lock:
+            engine = _engines.get(key)
+
+            if engine is None:
+                engine = _engines[key] = engine_class(None)
+
+    return engine
@@ -1,8 +1,23 @@
 class BaseMarkupEngine(object):
-    def __init__(self, message, obj=None):
+    def __init__(self, message=None, obj=None):
         self.message = message
         self.obj = obj
 
+    @classmethod
+    def get_fingerprint(cls):
+        """
+        Return the settings the engine is built from, a new engine is built
+        by the registry when they change
+        """
+        return ()
+
+    def render_message(self, message, obj=None, context=None):
+        """
+        Render ``message`` for ``obj``, engines shared by the registry
+        override it to render without keeping any state on the instance
+        """
+        return self.__class__(message, obj=obj).render(context)
+
 
 class BaseQuoteEngine(object):
     def __init__(self, post, username):
@@ -32,37 +32,112 @@ class BBCodeMarkupEngine(BaseMarkupEngine):
         'escape_html': False
     }
 
+    _parsers = {}
+    _prefetchers = {}
+
     def __init__(self, *args, **kwargs):
         super(BBCodeMarkupEngine, self).__init__(*args, **kwargs)
 
-        self.parser = bbcode.Parser(**self.defaults_kwargs)
+        self.parser = self.get_parser()
+        self.prefetchers = self.get_prefetchers()
+
+    @classmethod
+    def get_fingerprint(cls):
+        return (repr(defaults.PYBB_BBCODE_MARKUP_SIMPLE_FORMATTERS),
+                repr(defaults.PYBB_BBCODE_MARKUP_FORMATTERS))
+
+    @classmethod
+    def get_parser(cls):
+        """
+        Return the parser and its formatter table, built once per class and
+        settings fingerprint, formatting is thread safe so it is shared
+        """
+        key = (cls, cls.get_fingerprint())
+
+        parser = cls._parsers.get(key)
+
+        if parser is None:
+            parser = bbcode.Parser(**cls.defaults_kwargs)
+
+            cls._prefetchers[key] = cls.init_formatters(parser)
+            cls._parsers[key] = parser
 
-        self.init_formatters()
+        return parser
 
-    def init_formatters(self):
-        simple_formatters = list(self.simple_formatters.items()) + list(defaults.PYBB_BBCODE_MARKUP_SIMPLE_FORMATTERS)
+    @classmethod
+    def get_prefetchers(cls):
+        """
+        Return the prefetch functions of the formatters by tag name
+        """
+        cls.get_parser()
+
+        return cls._prefetchers[(cls, cls.get_fingerprint())]
+
+    @classmethod
+    def init_formatters(cls, parser):
+        """
+        Register the formatters on ``parser``, return the ``prefetch`` function
+        of the formatters which have one by tag name
+        """
+        simple_formatters = list(cls.simple_formatters.items()) + list(defaults.PYBB_BBCODE_MARKUP_SIMPLE_FORMATTERS)
 
         for tag_name, (format_str, context) in simple_formatters:
             if context:
-                self.parser.add_simple_formatter(tag_name, format_str, **context)
+                parser.add_simple_formatter(tag_name, format_str, **context)
             else:
-                self.parser.add_simple_formatter(tag_name, format_str)
+                parser.add_simple_formatter(tag_name, format_str)
+
+        formatters = list(cls.formatters.items()) + list(defaults.PYBB_BBCODE_MARKUP_FORMATTERS)
 
-        formatters = list(self.formatters.items()) + list(defaults.PYBB_BBCODE_MARKUP_FORMATTERS)
+        prefetchers = {}
 
         for tag_name, (formatter_name, context) in formatters:
+            formatter = load_class(formatter_name)
+
             if context:
-                self.parser.add_formatter(tag_name, load_class(formatter_name), **context)
+                parser.add_formatter(tag_name, formatter, **context)
             else:
-                self.parser.add_formatter(tag_name, load_class(formatter_name))
+                parser.add_formatter(tag_name, formatter)
 
-    def render(self, context=None):
-        if not context:
-            context = {}
+            prefetch = getattr(formatter, 'prefetch', None)
 
-        context['obj'] = self.obj
+            if prefetch is not None:
+                prefetchers[tag_name] = prefetch
+            else:
+                prefetchers.pop(tag_name, None)
+
+        return prefetchers
+
+    def prefetch(self, message):
+        """
+        Scan the tags of ``message`` once and let each formatter load the
+        objects referenced by all its tags in a single query, the result
+        is passed to the formatters through the context
+        """
+        if not self.prefetchers or '[' not in message:
+            return {}
+
+        options_by_tag = {}
+
+        for token_type, tag_name, options, text in self.parser.tokenize(message):
+            if token_type == self.parser.TOKEN_TAG_START and tag_name in self.prefetchers:
+                options_by_tag.setdefault(tag_name, []).append(options)
+
+        context = {}
 
-        return self.parser.format(self.message, **context)
+        for tag_name, options_list in options_by_tag.items():
+            context.update(self.prefetchers[tag_name](options_list))
+
+        return context
+
+    def render_message(self, message, obj=None, context=None):
+        full_context = self.prefetch(message)
+        full_context.update(context or {}, obj=obj)
+
+        return self.parser.format(message, **full_context)
+
+    def render(self, context=None):
+        return self.render_message(self.message, obj=self.obj, context=context)
 
 
 class BBCodeQuoteEngine(BaseQuoteEngine):
@@ -5,6 +5,10 @@ from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext as _
 from django.utils.encoding import iri_to_uri
 
+from html import unescape
+
+from pybb.processors import capture_image
+
 
 FONT_SIZES = {
     '1': '0.77em',
@@ -56,6 +60,9 @@ def url(tag_name, value, options, parent, context):
 def img(tag_name, value, options, parent, context):
     str_src = iri_to_uri(value)
 
+    if str_src:
+        capture_image(context, unescape(str_src))
+
     attrs = ['%s="%s"' % (attr, options[attr])
              for attr in ('title', 'class', 'alt',) if attr in options]
 
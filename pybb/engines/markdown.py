@@ -1,4 +1,7 @@
 from __future__ import absolute_import
+
+import threading
+
 from markdown import Markdown
 
 from pybb.engines.base import BaseMarkupEngine, BaseQuoteEngine
@@ -6,14 +9,63 @@ from pybb.engines.base import BaseMarkupEngine, BaseQuoteEngine
 
 class MarkdownMarkupEngine(BaseMarkupEngine):
     engine = Markdown
-    params = {
-        'safe_mode': 'escape'
-    }
+    params = {}
 
-    def render(self):
-        return self.engine(**self.params).convert(str)
+    # raw HTML is escaped instead of passed through, it replaces
+    # the safe_mode parameter removed in Markdown 3
+    escape_html = True
+
+    _local = threading.local()
+
+    @classmethod
+    def get_fingerprint(cls):
+        return (repr(cls.params), cls.escape_html)
+
+    @classmethod
+    def build_markdown(cls):
+        md = cls.engine(**cls.params)
+
+        if cls.escape_html:
+            md.preprocessors.deregister('html_block')
+            md.inlinePatterns.deregister('html')
+
+        return md
+
+    @classmethod
+    def get_markdown(cls):
+        """
+        Return the Markdown instance of the current thread, built once per
+        thread and settings fingerprint, Markdown instances are not thread safe
+        """
+        instances = getattr(cls._local, 'instances', None)
+
+        if instances is None:
+            instances = cls._local.instances = {}
 
+        key = (cls, cls.get_fingerprint())
 
-class MarkdownQuoteEengine(BaseQuoteEngine):
+        md = instances.get(key)
+
+        if md is None:
+            md = instances[key] = cls.build_markdown()
+
+        return md
+
+    def render_message(self, message, obj=None, context=None):
+        return self.get_markdown().reset().convert(message or '')
+
+    def render(self, context=None):
+        return self.render_message(self.message, obj=self.obj, context=context)
+
+
+class MarkdownQuoteEngine(BaseQuoteEngine):
     def render(self):
-        return '>' + self.post.body.replace('\n', '\n>').replace('\r', '\n>') + '\n'
+        lines = (self.post.body or '').splitlines()
+
+        # the blank line ends the blockquote before the answer
+        return '> **%s**:\n>\n%s\n\n' % (self.username,
+                                          '\n'.join(('> %s' % line).rstrip() for line in lines))
+
+
+# backwards compatibility with the misspelled name
+MarkdownQuoteEengine = MarkdownQuoteEngine
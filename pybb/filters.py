@@ -1,4 +1,5 @@
 from pybb import defaults
+from pybb.permissions import has_perm
 
 
 class BaseFilter(object):
@@ -12,7 +13,7 @@ class PrePostCreateFilter(object):
         self.forum = forum
 
     def is_allowed(self, user):
-        if defaults.PYBB_AUTO_USER_PERMISSIONS and not user.has_perm('pybb.add_post'):
+        if defaults.PYBB_AUTO_USER_PERMISSIONS and not has_perm(user, 'pybb.add_post'):
             return False
 
         if defaults.PYBB_ENABLE_ANONYMOUS_POST and not user.is_authenticated:
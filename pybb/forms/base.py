@@ -13,6 +13,7 @@ from django.forms.formsets import BaseFormSet
 from pybb.models import (Topic, Post, Attachment, TopicRedirection,
                          PollAnswer, Forum, Poll)
 from pybb.compat import get_user_model
+from pybb.counters import defer_forum_counters
 from pybb.proxies import UserObjectPermission
 from pybb import defaults
 from pybb.util import tznow, load_class
@@ -437,8 +438,15 @@ class PostsMoveExistingTopicForm(forms.Form):
     def save(self):
         topic = self.cleaned_data['topic']
 
-        self.posts.update(topic=topic)
-        topic.update_counters()
+        topic_ids = set(self.posts.values_list('topic_id', flat=True))
+
+        with defer_forum_counters():
+            self.posts.update(topic=topic)
+            topic.update_counters()
+
+            # a bulk update does not go through Post.save, recount the emptied topics
+            for source in Topic.objects.filter(pk__in=topic_ids).exclude(pk=topic.pk):
+                source.update_counters()
 
         return topic
 
@@ -490,8 +498,15 @@ class PostsMoveNewTopicForm(forms.Form):
                                      name=cleaned_data['name'],
                                      user=self.user)
 
-        self.posts.update(topic=topic)
-        topic.update_counters()
+        topic_ids = set(self.posts.values_list('topic_id', flat=True))
+
+        with defer_forum_counters():
+            self.posts.update(topic=topic)
+            topic.update_counters()
+
+            # a bulk update does not go through Post.save, recount the emptied topics
+            for source in Topic.objects.filter(pk__in=topic_ids).exclude(pk=topic.pk):
+                source.update_counters()
 
         return topic
 
@@ -0,0 +1,38 @@
+import time
+
+from multiprocessing import Pool
+
+from django.db import connections
+
+
+def close_connections():
+    # every worker must open its own connection instead of sharing the parent one
+    connections.close_all()
+
+
+def map_chunks(function, chunks, workers=1):
+    """
+    Yield the results of ``function`` over ``chunks`` in completion order,
+    spread over ``workers`` processes when there is more than one
+    """
+    if workers <= 1:
+        for result in map(function, chunks):
+            yield result
+
+        return
+
+    close_connections()
+    pool = Pool(workers, initializer=close_connections)
+
+    try:
+        for result in pool.imap_unordered(function, chunks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_rate(count, started):
+    elapsed = time.time() - started
+
+    return count / elapsed if elapsed else count
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from pybb.counters import get_view_counter
+
+
+class Command(BaseCommand):
+    help = 'Write the buffered topic views to the database'
+
+    def handle(self, *args, **options):
+        count = get_view_counter().flush()
+
+        self.stdout.write('Successfully flushed views of %d topics\n' % count)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from pybb.models import Forum, Topic
+from pybb.models.mixins import repair_forum_ids
+
+
+class Command(BaseCommand):
+    help = 'Repair the forum_ids of forums and topics which disagree with their parent links'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            dest='chunk_size',
+                            default=10000,
+                            help='Number of topic ids repaired per transaction'),
+
+    def handle(self, *args, **options):
+        chunk_size = options.get('chunk_size')
+
+        with transaction.atomic():
+            count = repair_forum_ids(Forum)
+
+        self.stdout.write('Repaired %d forums\n' % count)
+
+        bounds = Topic.objects.aggregate(start=Min('id'), stop=Max('id'))
+
+        if bounds['start'] is None:
+            return
+
+        for start in range(bounds['start'], bounds['stop'] + 1, chunk_size):
+            stop = start + chunk_size
+
+            with transaction.atomic():
+                count = repair_forum_ids(Topic, start=start, stop=stop)
+
+            self.stdout.write('Repaired %d topics from %d to %d\n' % (count, start, stop - 1))
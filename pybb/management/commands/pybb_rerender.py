@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8
+from __future__ import unicode_literals
+
+import difflib
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min, Q
+from django.utils.dateparse import parse_date
+
+from pybb.management.commands import get_rate, map_chunks
+from pybb.models import Post
+from pybb.processors import get_pipeline
+
+
+def get_queryset(filters):
+    queryset = Post.objects.all()
+
+    if filters.get('forum'):
+        queryset = queryset.filter(topic__forum_ids__contains=[filters['forum']])
+
+    if filters.get('since'):
+        queryset = queryset.filter(created__date__gte=filters['since'])
+
+    if filters.get('until'):
+        queryset = queryset.filter(created__date__lte=filters['until'])
+
+    if filters.get('only_null'):
+        queryset = queryset.filter(body_html__isnull=True)
+
+    if filters.get('stale'):
+        queryset = queryset.filter(Q(markup_version__isnull=True) | ~Q(markup_version=get_pipeline().version))
+
+    return queryset
+
+
+def rerender_chunk(args):
+    start, stop, filters, dry_run = args
+
+    post_ids = list(get_queryset(filters)
+                    .filter(pk__gte=start, pk__lt=stop)
+                    .values_list('pk', flat=True)
+                    .iterator())
+
+    changed = Post.objects.rerender(post_ids, commit=not dry_run)
+
+    diffs = []
+
+    if dry_run:
+        for post, previous in changed:
+            diffs.append('\n'.join(difflib.unified_diff((previous or '').splitlines(),
+                                                        post.body_html.splitlines(),
+                                                        'post %d (stored)' % post.pk,
+                                                        'post %d (rendered)' % post.pk,
+                                                        lineterm='')))
+
+    return start, len(post_ids), len(changed), diffs
+
+
+class Command(BaseCommand):
+    help = 'Render again body_html and body_text of posts, e.g. after a formatter change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            dest='chunk_size',
+                            default=1000,
+                            help='Number of post ids rendered per chunk'),
+        parser.add_argument('--workers',
+                            type=int,
+                            dest='workers',
+                            default=1,
+                            help='Number of processes rendering chunks'),
+        parser.add_argument('--forum',
+                            type=int,
+                            dest='forum',
+                            default=None,
+                            help='Only render the posts of this forum and its sub forums'),
+        parser.add_argument('--since',
+                            dest='since',
+                            default=None,
+                            help='Only render the posts created since this date (YYYY-MM-DD)'),
+        parser.add_argument('--until',
+                            dest='until',
+                            default=None,
+                            help='Only render the posts created until this date (YYYY-MM-DD)'),
+        parser.add_argument('--only-null',
+                            action='store_true',
+                            dest='only_null',
+                            default=False,
+                            help='Only render the posts without body_html'),
+        parser.add_argument('--stale',
+                            action='store_true',
+                            dest='stale',
+                            default=False,
+                            help='Only render the posts rendered by another markup pipeline'),
+        parser.add_argument('--dry-run',
+                            action='store_true',
+                            dest='dry_run',
+                            default=False,
+                            help='Print the diff of the changed posts without saving them'),
+
+    def handle(self, *args, **options):
+        filters = dict((name, options.get(name)) for name in ('forum', 'only_null', 'stale'))
+
+        for name in ('since', 'until'):
+            if options.get(name):
+                filters[name] = parse_date(options[name])
+
+                if filters[name] is None:
+                    raise CommandError('Invalid date "%s" for --%s' % (options[name], name))
+
+        bounds = get_queryset(filters).aggregate(start=Min('pk'), stop=Max('pk'))
+
+        if bounds['start'] is None:
+            return
+
+        chunk_size, workers, dry_run = options.get('chunk_size'), options.get('workers'), options.get('dry_run')
+
+        chunks = [(start, start + chunk_size, filters, dry_run)
+                  for start in range(bounds['start'], bounds['stop'] + 1, chunk_size)]
+
+        done = posts = changed = 0
+        started = time.time()
+
+        for start, count, changed_count, diffs in map_chunks(rerender_chunk, chunks, workers):
+            done += 1
+            posts += count
+            changed += changed_count
+
+            for diff in diffs:
+                self.stdout.write(diff + '\n')
+
+            self.stdout.write('Rendered chunk %d/%d, %d posts, %d changed (%.0f posts/s)\n' % (
+                done, len(chunks), posts, changed, get_rate(posts, started)))
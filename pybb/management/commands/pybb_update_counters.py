@@ -1,14 +1,171 @@
 #!/usr/bin/env python
 # vim:fileencoding=utf-8
 from __future__ import unicode_literals
+
+import json
+import os
+import time
+
 from itertools import chain
 
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
 
-from pybb.models import Topic, Forum
+from pybb.management.commands import get_rate, map_chunks
+from pybb.management.commands.pybb_update_participants import rebuild_participants
+from pybb.models import Topic, Forum, Post
 from pybb.models.mixins import prefetch_parent_forums
 
 
+def get_names():
+    qn = connection.ops.quote_name
+
+    names = {
+        'topic': qn(Topic._meta.db_table),
+        'post': qn(Post._meta.db_table),
+        'forum': qn(Forum._meta.db_table),
+    }
+
+    for model, prefix in ((Topic, 'topic'), (Post, 'post'), (Forum, 'forum')):
+        for field in model._meta.concrete_fields:
+            names['%s_%s' % (prefix, field.name)] = qn(field.column)
+
+    return names
+
+
+TOPIC_CHUNK_SQL = """
+UPDATE {topic} SET
+    {topic_post_count} = s.post_count,
+    {topic_member_count} = s.member_count,
+    {topic_first_post} = COALESCE(s.first_post_id, {topic}.{topic_first_post}),
+    {topic_last_post} = COALESCE(s.last_post_id, {topic}.{topic_last_post}),
+    {topic_updated} = COALESCE(s.updated, {topic}.{topic_updated}),
+    {topic_on_moderation} = CASE
+        WHEN NOT s.has_moderation THEN %(clean)s
+        WHEN s.post_count = 0 OR s.first_on_moderation THEN %(in_moderation)s
+        ELSE %(has_posts_in_moderation)s
+    END
+FROM (
+    SELECT t.{topic_id} AS topic_id,
+           COUNT(p.{post_id}) FILTER (WHERE p.visible) AS post_count,
+           COUNT(DISTINCT p.{post_user}) FILTER (WHERE p.visible) AS member_count,
+           (ARRAY_AGG(p.{post_id} ORDER BY p.{post_created})
+               FILTER (WHERE p.{post_id} IS NOT NULL))[1] AS first_post_id,
+           (ARRAY_AGG(p.{post_on_moderation} ORDER BY p.{post_created})
+               FILTER (WHERE p.{post_id} IS NOT NULL))[1] AS first_on_moderation,
+           (ARRAY_AGG(p.{post_id} ORDER BY p.last_saved DESC NULLS LAST)
+               FILTER (WHERE p.visible))[1] AS last_post_id,
+           (ARRAY_AGG(COALESCE(p.{post_updated}, p.{post_created}) ORDER BY p.last_saved DESC NULLS LAST)
+               FILTER (WHERE p.visible))[1] AS updated,
+           COALESCE(BOOL_OR(p.{post_on_moderation} AND NOT p.{post_deleted}), FALSE) AS has_moderation
+    FROM {topic} t
+    LEFT JOIN (
+        SELECT *,
+               NOT {post_deleted} AND NOT {post_on_moderation} AS visible,
+               GREATEST({post_created}, {post_updated}) AS last_saved
+        FROM {post}
+    ) p ON p.{post_topic} = t.{topic_id}
+    WHERE t.{topic_id} >= %(start)s AND t.{topic_id} < %(stop)s
+    GROUP BY t.{topic_id}
+) s
+WHERE {topic}.{topic_id} = s.topic_id
+"""
+
+FORUM_COUNTERS_SQL = """
+UPDATE {forum} SET
+    {forum_topic_count} = COALESCE(s.topic_count, 0),
+    {forum_post_count} = COALESCE(s.post_count, 0),
+    {forum_member_count} = COALESCE(m.member_count, 0),
+    {forum_forum_count} = COALESCE(c.forum_count, 0)
+FROM {forum} f
+LEFT JOIN (
+    SELECT UNNEST({topic_forum_ids}) AS forum_id,
+           COUNT(*) AS topic_count,
+           SUM({topic_post_count}) AS post_count
+    FROM {topic}
+    WHERE NOT {topic_deleted} AND NOT {topic_redirect} AND {topic_on_moderation} != %(in_moderation)s
+    GROUP BY 1
+) s ON s.forum_id = f.{forum_id}
+LEFT JOIN (
+    SELECT UNNEST(t.{topic_forum_ids}) AS forum_id,
+           COUNT(DISTINCT p.{post_user}) AS member_count
+    FROM {post} p
+    INNER JOIN {topic} t ON t.{topic_id} = p.{post_topic}
+    WHERE NOT p.{post_deleted} AND NOT p.{post_on_moderation} AND NOT t.{topic_deleted} AND NOT t.{topic_redirect}
+    GROUP BY 1
+) m ON m.forum_id = f.{forum_id}
+LEFT JOIN (
+    SELECT UNNEST({forum_forum_ids}) AS forum_id, COUNT(*) AS forum_count
+    FROM {forum}
+    GROUP BY 1
+) c ON c.forum_id = f.{forum_id}
+WHERE {forum}.{forum_id} = f.{forum_id}
+"""
+
+# same choice as Forum.get_last_post: the last post of the latest updated topic,
+# unless it is a poll and the latest topic without poll has a more recent last post
+FORUM_LAST_POST_SQL = """
+UPDATE {forum} SET
+    {forum_last_post} = CASE WHEN o.created > s.created THEN o.last_post_id ELSE s.last_post_id END,
+    {forum_last_topic} = CASE WHEN o.created > s.created THEN o.topic_id ELSE s.topic_id END,
+    {forum_updated} = CASE WHEN o.created > s.created THEN o.created ELSE s.created END
+FROM (
+    SELECT DISTINCT ON (t.{topic_forum}) t.{topic_forum} AS forum_id,
+           t.{topic_id} AS topic_id,
+           t.{topic_poll} AS poll_id,
+           t.{topic_last_post} AS last_post_id,
+           p.{post_created} AS created
+    FROM {topic} t
+    LEFT JOIN {post} p ON p.{post_id} = t.{topic_last_post}
+    WHERE NOT t.{topic_deleted} AND NOT t.{topic_redirect} AND t.{topic_on_moderation} != %(in_moderation)s
+    ORDER BY t.{topic_forum}, t.{topic_updated} DESC NULLS LAST
+) s
+LEFT JOIN (
+    SELECT DISTINCT ON (t.{topic_forum}) t.{topic_forum} AS forum_id,
+           t.{topic_id} AS topic_id,
+           t.{topic_last_post} AS last_post_id,
+           p.{post_created} AS created
+    FROM {topic} t
+    INNER JOIN {post} p ON p.{post_id} = t.{topic_last_post}
+    WHERE NOT t.{topic_deleted} AND NOT t.{topic_redirect} AND t.{topic_on_moderation} != %(in_moderation)s
+      AND t.{topic_poll} IS NULL
+    ORDER BY t.{topic_forum}, t.{topic_updated} DESC NULLS LAST
+) o ON o.forum_id = s.forum_id AND s.poll_id IS NOT NULL
+WHERE {forum}.{forum_id} = s.forum_id AND s.last_post_id IS NOT NULL
+"""
+
+
+def update_topic_chunk(bounds):
+    start, stop = bounds
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(TOPIC_CHUNK_SQL.format(**get_names()), {
+            'start': start,
+            'stop': stop,
+            'clean': Topic.MODERATION_IS_CLEAN,
+            'in_moderation': Topic.MODERATION_IS_IN_MODERATION,
+            'has_posts_in_moderation': Topic.MODERATION_HAS_POSTS_IN_MODERATION,
+        })
+
+        Post.objects.update_positions(start=start, stop=stop)
+
+        rebuild_participants(start, stop)
+
+        return start, cursor.rowcount
+
+
+def update_forums():
+    names = get_names()
+    params = {'in_moderation': Topic.MODERATION_IS_IN_MODERATION}
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(FORUM_COUNTERS_SQL.format(**names), params)
+        cursor.execute(FORUM_LAST_POST_SQL.format(**names), params)
+
+        return cursor.rowcount
+
+
 class Command(BaseCommand):
     help = 'Recalc post counters for forums and topics'
 
@@ -18,8 +175,30 @@ class Command(BaseCommand):
                             dest='no_topics',
                             default=False,
                             help='Do not update counters for topics'),
+        parser.add_argument('--fast',
+                            action='store_true',
+                            dest='fast',
+                            default=False,
+                            help='Recompute counters with grouped statements over chunks of topic ids'),
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            dest='chunk_size',
+                            default=10000,
+                            help='Number of topic ids per chunk in fast mode'),
+        parser.add_argument('--workers',
+                            type=int,
+                            dest='workers',
+                            default=1,
+                            help='Number of processes used to update chunks in fast mode'),
+        parser.add_argument('--checkpoint',
+                            dest='checkpoint',
+                            default=None,
+                            help='File used to save progress and resume an interrupted fast run'),
 
     def handle(self, *args, **options):
+        if options.get('fast'):
+            return self.handle_fast(**options)
+
         no_topics = options.get('no_topics')
 
         if not no_topics:
@@ -35,3 +214,60 @@ class Command(BaseCommand):
         for forum in forums_to_update:
             forum.update_counters()
             self.stdout.write('Successfully updated forum "%s"\n' % forum)
+
+    def handle_fast(self, no_topics=False, chunk_size=10000, workers=1, checkpoint=None, **options):
+        if not no_topics:
+            self.update_topics(chunk_size, workers, checkpoint)
+
+        count = update_forums()
+        self.stdout.write('Successfully updated %d forums\n' % count)
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def load_checkpoint(self, checkpoint, chunk_size):
+        if not checkpoint or not os.path.exists(checkpoint):
+            return set()
+
+        with open(checkpoint) as f:
+            state = json.load(f)
+
+        if state.get('chunk_size') != chunk_size:
+            self.stderr.write('Ignoring checkpoint "%s" made with another chunk size\n' % checkpoint)
+            return set()
+
+        return set(state['done'])
+
+    def save_checkpoint(self, checkpoint, chunk_size, done):
+        tmp = '%s.tmp' % checkpoint
+
+        with open(tmp, 'w') as f:
+            json.dump({'chunk_size': chunk_size, 'done': sorted(done)}, f)
+
+        os.replace(tmp, checkpoint)
+
+    def update_topics(self, chunk_size, workers, checkpoint):
+        bounds = Topic.objects.aggregate(start=Min('id'), stop=Max('id'))
+
+        if bounds['start'] is None:
+            return
+
+        done = self.load_checkpoint(checkpoint, chunk_size)
+
+        chunks = [(start, start + chunk_size)
+                  for start in range(bounds['start'], bounds['stop'] + 1, chunk_size)
+                  if start not in done]
+
+        total = len(chunks) + len(done)
+        topics = 0
+        started = time.time()
+
+        for start, count in map_chunks(update_topic_chunk, chunks, workers):
+            done.add(start)
+            topics += count
+
+            if checkpoint:
+                self.save_checkpoint(checkpoint, chunk_size, done)
+
+            self.stdout.write('Updated chunk %d/%d, %d topics (%.0f topics/s)\n' % (
+                len(done), total, topics, get_rate(topics, started)))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from pybb.models import Post, Topic, TopicParticipant
+
+
+PARTICIPANTS_SQL = """
+INSERT INTO {participant} (topic_id, user_id, post_count)
+SELECT {post_topic}, {post_user}, COUNT(*)
+FROM {post}
+WHERE {post_topic} >= %(start)s AND {post_topic} < %(stop)s
+  AND NOT {post_deleted} AND NOT {post_on_moderation}
+GROUP BY {post_topic}, {post_user}
+"""
+
+
+def rebuild_participants(start, stop):
+    """
+    Recreate the participants of the topics with ids in [start, stop)
+    from their visible posts, return the number of participants
+    """
+    qn = connection.ops.quote_name
+
+    sql = PARTICIPANTS_SQL.format(participant=qn(TopicParticipant._meta.db_table),
+                                  post=qn(Post._meta.db_table),
+                                  post_topic=qn(Post._meta.get_field('topic').column),
+                                  post_user=qn(Post._meta.get_field('user').column),
+                                  post_deleted=qn(Post._meta.get_field('deleted').column),
+                                  post_on_moderation=qn(Post._meta.get_field('on_moderation').column))
+
+    TopicParticipant.objects.filter(topic_id__gte=start, topic_id__lt=stop).delete()
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'start': start, 'stop': stop})
+
+        return cursor.rowcount
+
+
+class Command(BaseCommand):
+    help = 'Rebuild topic participants from visible posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            dest='chunk_size',
+                            default=10000,
+                            help='Number of topic ids rebuilt per transaction'),
+
+    def handle(self, *args, **options):
+        chunk_size = options.get('chunk_size')
+
+        bounds = Topic.objects.aggregate(start=Min('id'), stop=Max('id'))
+
+        if bounds['start'] is None:
+            return
+
+        for start in range(bounds['start'], bounds['stop'] + 1, chunk_size):
+            stop = start + chunk_size
+
+            with transaction.atomic():
+                count = rebuild_participants(start, stop)
+
+            self.stdout.write('Rebuilt %d participants of topics %d to %d\n' % (count, start, stop - 1))
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from django.utils.deprecation import MiddlewareMixin
+
+from pybb.permissions import PermissionSnapshot
+
+
+class PybbPermissionMiddleware(MiddlewareMixin):
+    """
+    Attach a permission snapshot to the authenticated user so that the
+    moderation checks of a page are answered from memory, must be placed
+    after AuthenticationMiddleware
+    """
+
+    def process_request(self, request):
+        if request.user.is_authenticated:
+            request.user.pybb_permissions = PermissionSnapshot(request.user)
@@ -13,8 +13,10 @@ Moderator = load_class(defaults.PYBB_MODERATOR_MODEL)
 Forum = load_class(defaults.PYBB_FORUM_MODEL)
 Post = load_class(defaults.PYBB_POST_MODEL)
 Topic = load_class(defaults.PYBB_TOPIC_MODEL)
+TopicParticipant = load_class(defaults.PYBB_TOPIC_PARTICIPANT_MODEL)
 TopicReadTracker = load_class(defaults.PYBB_TOPIC_READ_TRACKER_MODEL)
 ForumReadTracker = load_class(defaults.PYBB_FORUM_READ_TRACKER_MODEL)
+ForumReadMark = load_class(defaults.PYBB_FORUM_READ_MARK_MODEL)
 PollAnswer = load_class(defaults.PYBB_POLL_ANSWER_MODEL)
 PollAnswerUser = load_class(defaults.PYBB_POLL_ANSWER_USER_MODEL)
 LogModeration = load_class(defaults.PYBB_LOG_MODERATION_MODEL)
@@ -25,6 +27,5 @@ Subscription = load_class(defaults.PYBB_SUBSCRIPTION_MODEL)
 
 Forum.on_change(Forum.watch_forum)
 
-Post.on_change(Post.watch_topic)
 
 from pybb.receivers import *
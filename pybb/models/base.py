@@ -10,34 +10,37 @@ from datetime import date
 
 from bs4 import BeautifulSoup
 
-from functools import lru_cache
 
 from urllib.parse import urlparse, urlencode
 
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, connection, models
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import AnonymousUser
 from django.utils.encoding import smart_text
 from django.urls import reverse
+from django.core.cache import caches
 from django.core.files.base import ContentFile
-from django.utils.html import strip_tags
 from django.utils.translation import gettext_lazy as _
 from django.db.models import Q, signals, F
 from django.db.models.functions import Greatest
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.postgres.fields import ArrayField, JSONField
 from django.db.models import ObjectDoesNotExist
 from django.utils.functional import cached_property
 from django.conf import settings
 
 from pybb.compat import update_fields, AUTH_USER_MODEL, queryset
-from pybb.util import unescape, get_model_string, tznow
+from pybb.util import html_to_text, get_model_string, tznow
 from pybb.base import ModelBase, ManagerBase, QuerySetBase
 from pybb.models.mixins import ParentForumQuerysetMixin, ParentForumManagerMixin, ParentForumBase
+from pybb.cache import versioned_cache
+from pybb.counters import defer_forum_counters, mark_forum_dirty
+from pybb.permissions import has_perm
 from pybb.subscription import notify_topic_subscribers
 from pybb import defaults
 from pybb.fields import ContentTypeRestrictedFileField
-from pybb.tasks import generate_markup, sync_cover
-from pybb.processors import markup
+from pybb.tasks import generate_markup, generate_markup_batch, sync_cover
+from pybb.processors import get_pipeline, markup
 
 from autoslug import AutoSlugField
 
@@ -98,13 +101,18 @@ class ForumQuerySet(ParentForumQuerysetMixin, QuerySetBase):
         if user.is_staff or user.is_superuser:
             return self
 
-        if user.is_authenticated:
-            return self.filter(staff=False)
+        return self.filter(pk__in=get_visible_forum_ids(user, hidden=hidden))
+
+    def annotate_unread(self, user):
+        """
+        Annotate the forums with ``unread`` for ``user`` computed in SQL
+        """
+        if not user.is_authenticated:
+            return self
 
-        if hidden:
-            return self.filter(hidden=False, staff=False)
+        from pybb.trackers import get_read_tracker
 
-        return self.filter(staff=False)
+        return get_read_tracker().annotate_forums_queryset(self, user)
 
 
 @queryset
@@ -129,7 +137,7 @@ class ForumManager(ParentForumManagerMixin, ManagerBase):
         return self.get_queryset().filter_by_user(*args, **kwargs)
 
 
-@lru_cache()
+@versioned_cache('moderators')
 def get_moderator_ids_by_forum():
     from pybb.models import Moderator
 
@@ -140,6 +148,159 @@ def get_moderator_ids_by_forum():
     return result
 
 
+class ForumTree(object):
+    """
+    The whole forum tree kept as plain rows, cheap to share through the cache,
+    building fresh forum instances on demand so that callers never share them.
+
+    Counters of the forums may lag, only the structure is kept up to date.
+    """
+
+    def __init__(self, field_names, rows):
+        self.field_names = field_names
+        self.rows = {}
+        self.children = defaultdict(list)
+
+        pk_index = field_names.index('id')
+        parent_index = field_names.index('forum_id')
+
+        for row in rows:
+            self.rows[row[pk_index]] = row
+            self.children[row[parent_index]].append(row[pk_index])
+
+    def __contains__(self, pk):
+        return pk in self.rows
+
+    def get(self, pk):
+        from pybb.models import Forum
+
+        row = self.rows.get(pk)
+
+        if row is None:
+            return None
+
+        return Forum.from_db(DEFAULT_DB_ALIAS, self.field_names, list(row))
+
+    def get_forums(self, forum_ids):
+        return dict((pk, self.get(pk)) for pk in forum_ids if pk in self.rows)
+
+    def get_children(self, pk=None):
+        return [self.get(child) for child in self.children.get(pk, [])]
+
+    def get_value(self, pk, name):
+        return self.rows[pk][self.field_names.index(name)]
+
+    def get_forum_ids(self, pk):
+        """
+        Return ``pk`` followed by its ancestors, nearest first, following the
+        parent links of the tree, None when the chain is not in the tree
+        """
+        forum_ids = []
+
+        while pk is not None:
+            if pk not in self.rows or pk in forum_ids:
+                return None
+
+            forum_ids.append(pk)
+
+            pk = self.get_value(pk, 'forum_id')
+
+        return forum_ids
+
+
+@versioned_cache('forum_tree', shared=True)
+def get_forum_tree():
+    """
+    Return the forum tree, loaded with one query and shared by every process
+    until a forum is created, changed or deleted
+    """
+    from pybb.models import Forum
+
+    field_names = [field.attname for field in Forum._meta.concrete_fields]
+
+    return ForumTree(field_names, list(Forum.objects.order_by('position', 'pk').values_list(*field_names)))
+
+
+@versioned_cache('forum_visibility')
+def get_forum_visibility():
+    """
+    Return the ids of the forums which are hidden, or restricted to staff,
+    by themselves or by one of their parents, and the ids of every forum
+    accessible by each audience, computed from the forum tree
+    """
+    tree = get_forum_tree()
+
+    forum_ids = frozenset(tree.rows)
+
+    staff_ids = set()
+    hidden_ids = set()
+
+    for pk in forum_ids:
+        chain = [forum_id for forum_id in [pk] + (tree.get_value(pk, 'forum_ids') or []) if forum_id in tree]
+
+        if any(tree.get_value(forum_id, 'staff') for forum_id in chain):
+            staff_ids.add(pk)
+
+        if any(tree.get_value(forum_id, 'hidden') for forum_id in chain):
+            hidden_ids.add(pk)
+
+    authenticated = forum_ids - staff_ids
+
+    return {
+        'staff': forum_ids,
+        'authenticated': authenticated,
+        'anonymous': authenticated - hidden_ids,
+        'hidden': frozenset(hidden_ids),
+    }
+
+
+def get_visible_forum_ids(user, hidden=True):
+    """
+    Return the ids of the forums accessible by ``user``, hidden forums being
+    excluded for anonymous users unless ``hidden`` is False
+    """
+    visibility = get_forum_visibility()
+
+    if user.is_staff:
+        return visibility['staff']
+
+    if user.is_authenticated or not hidden:
+        return visibility['authenticated']
+
+    return visibility['anonymous']
+
+
+def apply_counter_deltas(queryset, instances=None, **deltas):
+    """
+    Atomically add ``deltas`` to the counters of ``queryset`` using F() expressions
+    and mirror them on the already loaded ``instances``
+    """
+    deltas = dict((name, value) for name, value in deltas.items() if value)
+
+    if not deltas:
+        return 0
+
+    for instance in instances or []:
+        for name, value in deltas.items():
+            setattr(instance, name, (getattr(instance, name) or 0) + value)
+
+    return queryset.update(**dict((name, F(name) + value) for name, value in deltas.items()))
+
+
+def get_loaded_parent_forums(obj):
+    """
+    Return the parent forums of ``obj`` which are already loaded in memory,
+    nearest first, without hitting the database
+    """
+    forums = []
+
+    while obj.forum_id and obj._meta.get_field('forum').is_cached(obj):
+        obj = obj.forum
+        forums.append(obj)
+
+    return forums
+
+
 class BaseForum(ParentForumBase):
     forum = models.ForeignKey('Forum', related_name='forums',
                               verbose_name=_('Parent'), null=True, blank=True, on_delete=models.PROTECT)
@@ -178,6 +339,10 @@ class BaseForum(ParentForumBase):
 
     objects = ForumManager()
 
+    # fields saved on their own by counter updates, which leave the forum tree unchanged
+    counter_fields = ('post_count', 'member_count', 'topic_count', 'forum_count',
+                      'updated', 'last_post', 'last_topic')
+
     class Meta(object):
         verbose_name = _('Forum')
         verbose_name_plural = _('Forums')
@@ -202,14 +367,18 @@ class BaseForum(ParentForumBase):
         app_label = 'pybb'
         abstract = True
 
-    def compute(self, commit=True):
+    def compute(self, commit=True, parents=True):
+        if commit and mark_forum_dirty(self):
+            return
+
         forum_count = self.forums.count()
 
-        from pybb.models import Topic, Post
+        from pybb.models import Topic, TopicParticipant
 
-        member_count_aggregate = (Post.objects
-                                  .visible(join=True)
-                                  .filter(topic__forum_ids__contains=[self.id])
+        member_count_aggregate = (TopicParticipant.objects
+                                  .filter(topic__forum_ids__contains=[self.id],
+                                          topic__deleted=False,
+                                          topic__redirect=False)
                                   .aggregate(models.Count('user_id', distinct=True)))
 
         res = Topic.objects.visible().filter(forum_id=self.pk).aggregate(post_count=models.Sum('post_count'))
@@ -233,7 +402,7 @@ class BaseForum(ParentForumBase):
         if commit:
             self.save(update_fields=['post_count', 'member_count', 'topic_count', 'forum_count'])
 
-        if self.forum_id and self.forum_id != self.pk:
+        if parents and self.forum_id and self.forum_id != self.pk:
             self.forum.compute(commit=commit)
 
     def is_moderated_by(self, user, permission=None):
@@ -244,31 +413,37 @@ class BaseForum(ParentForumBase):
                 user.pk in get_moderator_ids_by_forum()[self.pk]):
 
             if permission:
-                return user.has_perm(permission, self)
+                return has_perm(user, permission, self)
 
             return True
 
         return False
 
     def is_hidden(self):
-        return self.hidden or (self.forum_id and self.forum.is_hidden())
+        return self.pk in get_forum_visibility()['hidden']
 
     def is_accessible_by(self, user, hidden=True):
-        if self.forum_id and not self.forum.is_accessible_by(user, hidden=hidden):
-            return False
-
-        if self.staff and not user.is_staff:
-            return False
-
-        if hidden and self.is_hidden() and not user.is_authenticated:
-            return False
-
-        return True
+        return self.pk in get_visible_forum_ids(user, hidden=hidden)
 
     def __str__(self):
         return self.name
 
     def update_counters(self, commit=True):
+        """
+        Recount everything from scratch, only used to repair the counters,
+        posts keep them up to date with deltas (see BaseTopic.update_post_counters)
+        """
+        if commit and mark_forum_dirty(self, last_post=True):
+            return
+
+        self.update_last_post(commit=False)
+
+        self.compute(commit=commit)
+
+        if commit:
+            self.save(update_fields=['updated', 'last_post', 'last_topic'])
+
+    def update_last_post(self, commit=True):
         last_post = self.get_last_post()
 
         if last_post:
@@ -277,10 +452,8 @@ class BaseForum(ParentForumBase):
             self.last_post = last_post
             self.last_topic = last_post.topic
 
-        self.compute(commit=commit)
-
-        if commit:
-            self.save(update_fields=['updated', 'last_post', 'last_topic'])
+            if commit:
+                self.save(update_fields=['updated', 'last_post', 'last_topic'])
 
     def get_absolute_url(self):
         return reverse('pybb:forum_detail', kwargs={'slug': self.slug})
@@ -411,14 +584,13 @@ class TopicQuerySetMixin(object):
             return self
 
         qs = self
+        if join:
+            qs = qs.filter(forum_id__in=get_visible_forum_ids(user))
+
         if user.is_authenticated:
-            if join:
-                qs = qs.filter(forum__staff=False)
             return (qs.filter(Q(user=user) | ~Q(on_moderation=BaseTopic.MODERATION_IS_IN_MODERATION))
                     .exclude(deleted=True))
 
-        if join:
-            qs = qs.filter(forum__hidden=False, forum__staff=False)
         return (qs.exclude(on_moderation=BaseTopic.MODERATION_IS_IN_MODERATION)
                 .exclude(deleted=True))
 
@@ -426,6 +598,17 @@ class TopicQuerySetMixin(object):
         return self.filter(deleted=False,
                            redirect=False).exclude(on_moderation=BaseTopic.MODERATION_IS_IN_MODERATION)
 
+    def annotate_unread(self, user):
+        """
+        Annotate the topics with ``unread`` for ``user`` computed in SQL
+        """
+        if not user.is_authenticated:
+            return self
+
+        from pybb.trackers import get_read_tracker
+
+        return get_read_tracker().annotate_topics_queryset(self, user)
+
 
 class TopicQuerySet(ParentForumQuerysetMixin, TopicQuerySetMixin, QuerySetBase):
     pass
@@ -448,6 +631,17 @@ class SubscriptionQuerySet(QuerySetBase):
         return self.filter(topic__deleted=False,
                            topic__redirect=False).exclude(topic__on_moderation=BaseTopic.MODERATION_IS_IN_MODERATION)
 
+    def annotate_unread(self, user):
+        """
+        Annotate the subscriptions with ``unread`` for their topic and ``user``
+        """
+        if not user.is_authenticated:
+            return self
+
+        from pybb.trackers import get_read_tracker
+
+        return get_read_tracker().annotate_topics_queryset(self, user, prefix='topic__')
+
 
 @queryset
 class SubscriptionManager(ManagerBase):
@@ -518,6 +712,7 @@ class BaseTopic(ParentForumBase):
     post_count = models.IntegerField(_('Post count'), blank=True, null=False, default=0, db_index=True)
     member_count = models.IntegerField(_('Member count'), blank=True, null=False, default=0, db_index=True)
     readed_by = models.ManyToManyField(AUTH_USER_MODEL, through=get_model_string('TopicReadTracker'), related_name='readed_topics')
+    participants = models.ManyToManyField(AUTH_USER_MODEL, through=get_model_string('TopicParticipant'), related_name='participated_topics')
     on_moderation = models.IntegerField(_('On moderation'), default=MODERATION_IS_CLEAN, db_index=True)
     first_post = models.ForeignKey(get_model_string('Post'),
                                    blank=True,
@@ -552,6 +747,7 @@ class BaseTopic(ParentForumBase):
     def __str__(self):
         return self.name
 
+    @defer_forum_counters()
     def absorb(self, topic, redirection_type=None, expired=None):
         from pybb.models import TopicRedirection
 
@@ -635,56 +831,32 @@ class BaseTopic(ParentForumBase):
             return last_post
 
     def mark_as_read(self, user):
-        from pybb.models import TopicReadTracker, ForumReadTracker, Subscription, Topic
+        from pybb.models import Subscription
+        from pybb.trackers import get_read_tracker
 
         Subscription.objects.filter(topic=self, user=user).update(sent=False)
 
-        try:
-            forum_mark = ForumReadTracker.objects.get(forum=self.forum, user=user)
-        except ObjectDoesNotExist:
-            forum_mark = None
-
-        if self.updated and ((forum_mark is None) or (forum_mark.time_stamp < self.updated)):
-            # Mark topic as read
-            count = TopicReadTracker.objects.filter(topic=self, user=user).update(time_stamp=tznow())
-
-            if not count:
-                TopicReadTracker.objects.create(topic=self, user=user)
-
-            # Check, if there are any unread topics in forum
-            read = Topic.objects.filter(
-                forum=self.forum, topicreadtracker__user=user, topicreadtracker__time_stamp__gt=F('updated'))
-
-            unread = Topic.objects.filter(forum=self.forum).exclude(id__in=read)
-            if forum_mark:
-                unread = unread.filter(updated__gt=forum_mark.time_stamp)
-
-            if not unread.exists():
-                # Clear all topic marks for this forum, mark forum as read
-                TopicReadTracker.objects.filter(
-                    user=user,
-                    topic__forum=self.forum
-                ).delete()
-
-                if not forum_mark:
-                    ForumReadTracker.objects.create(forum=self.forum, user=user)
-
-                else:
-                    forum_mark.time_stamp = tznow()
-                    update_fields(forum_mark, fields=('time_stamp', ))
+        get_read_tracker().mark_topic_as_read(self, user)
 
     def mark_as_deleted(self, commit=True, update=True):
         self.deleted = True
 
+        from pybb.models import Post
+
         self.posts.visible(join=False).update(deleted=True)
+        Post.objects.update_positions([self.pk])
+
+        self.recount_posts()
 
         if commit:
-            update_fields(self, fields=('deleted', ))
+            update_fields(self, fields=('deleted', 'post_count', 'member_count'))
 
         if update:
             self.forum.update_counters(commit=commit)
 
     def mark_as_undeleted(self, commit=True, update=True):
+        from pybb.models import Post
+
         self.deleted = False
 
         post_ids = (PostDeletion.objects
@@ -693,9 +865,12 @@ class BaseTopic(ParentForumBase):
                     .values_list('post', flat=True))
 
         self.posts.exclude(pk__in=post_ids).update(deleted=False)
+        Post.objects.update_positions([self.pk])
+
+        self.recount_posts()
 
         if commit:
-            update_fields(self, fields=('deleted', ))
+            update_fields(self, fields=('deleted', 'post_count', 'member_count'))
 
         if update:
             self.forum.update_counters(commit=commit)
@@ -713,17 +888,47 @@ class BaseTopic(ParentForumBase):
         return reverse('pybb:topic_detail', kwargs=kwargs)
 
     def save(self, *args, **kwargs):
-        if self.id is None:
+        new = self.id is None
+
+        if new:
             self.created = tznow()
 
         super(BaseTopic, self).save(*args, **kwargs)
 
+        if new and self.is_visible():
+            self.update_forum_counters(topic_count=1, post_count=self.post_count)
+
+    def is_visible(self):
+        return (not self.deleted and not self.redirect and
+                self.on_moderation != self.MODERATION_IS_IN_MODERATION)
+
+    def shows_visible_posts_only(self, user):
+        """
+        Return True when ``user`` sees exactly the visible posts of the topic,
+        so that post positions match what the user sees
+        """
+        if self.is_moderated_by(user):
+            return False
+
+        return not user.is_authenticated or self.on_moderation == self.MODERATION_IS_CLEAN
+
+    def get_moderation_status(self, first_post=None):
+        if not self.posts.filter(on_moderation=True, deleted=False).exists():
+            return self.MODERATION_IS_CLEAN
+
+        if not self.post_count or (first_post and first_post.on_moderation is True):
+            return self.MODERATION_IS_IN_MODERATION
+
+        return self.MODERATION_HAS_POSTS_IN_MODERATION
+
     def update_counters(self, commit=True, update_forum=True):
-        self.post_count = self.posts.visible(join=False).count()
+        """
+        Recount everything from scratch, only used to repair the counters,
+        posts keep them up to date with deltas (see update_post_counters)
+        """
+        from pybb.models import Post
 
-        active_members = self.posts.visible(join=False).values('user_id').order_by()
-        active_members.query.group_by = ('user_id', )
-        self.member_count = len(active_members)
+        self.recount_posts()
 
         last_post = self.get_last_post()
 
@@ -736,20 +941,144 @@ class BaseTopic(ParentForumBase):
         if first_post:
             self.first_post = first_post
 
-        if self.posts.filter(on_moderation=True, deleted=False).count():
-            if not self.post_count or first_post.on_moderation is True:
-                self.on_moderation = self.MODERATION_IS_IN_MODERATION
-            else:
-                self.on_moderation = self.MODERATION_HAS_POSTS_IN_MODERATION
-        else:
-            self.on_moderation = self.MODERATION_IS_CLEAN
+        self.on_moderation = self.get_moderation_status(first_post)
 
         if commit:
             self.save(update_fields=['poll_id', 'post_count', 'member_count', 'updated', 'last_post', 'first_post', 'on_moderation'])
 
+            Post.objects.update_positions([self.pk])
+
         if update_forum:
             self.forum.update_counters(commit=commit)
 
+    def recount_posts(self):
+        """
+        Recount the visible posts and the participants of the topic
+        after a bulk change of its posts
+        """
+        from pybb.models import TopicParticipant
+
+        TopicParticipant.objects.rebuild([self])
+
+        self.post_count = self.posts.visible(join=False).count()
+        self.member_count = TopicParticipant.objects.filter(topic=self).count()
+
+    def update_post_counters(self, post, delta=0, joined=False, left=False, moved=False, moderation=False):
+        """
+        Update the counters of the topic and of its parent forums after a change
+        of ``post`` with atomic deltas instead of recounting the whole topic.
+
+        ``delta`` is the variation of visible posts, ``joined`` and ``left`` tell
+        that the post has been created in, moved in or moved out of the topic.
+        """
+        from pybb.models import Topic, TopicParticipant
+
+        was_visible = self.is_visible()
+
+        counters = {}
+        fields = {}
+
+        if delta:
+            counters['post_count'] = delta
+
+            participant_post_count = TopicParticipant.objects.add_posts(self.pk, post.user_id, delta)
+
+            if participant_post_count == (1 if delta > 0 else 0):
+                counters['member_count'] = delta
+
+        apply_counter_deltas(Topic.objects.filter(pk=self.pk), [self], **counters)
+
+        if left:
+            if self.first_post_id == post.pk:
+                fields['first_post'] = self.get_first_post(force_refresh=True)
+        elif joined and (not self.first_post_id or self.first_post_id == post.pk or
+                         (moved and post.created < self.first_post.created)):
+            # first_post may already be set in memory by get_first_post() without being saved
+            fields['first_post'] = post
+
+        if delta < 0 or left:
+            if self.last_post_id == post.pk:
+                last_post = self.get_last_post()
+
+                if last_post:
+                    fields.update(last_post=last_post,
+                                  updated=last_post.updated or last_post.created)
+        elif post.is_visible():
+            updated = post.updated or post.created
+
+            if not moved or self.updated is None or updated >= self.updated:
+                fields.update(last_post=post, updated=updated)
+
+        if moderation or (delta and self.on_moderation != self.MODERATION_IS_CLEAN):
+            first_post = fields.get('first_post', None) or self.first_post
+
+            if first_post and first_post.pk == post.pk:
+                first_post = post
+
+            fields['on_moderation'] = self.get_moderation_status(first_post)
+
+        if fields:
+            Topic.objects.filter(pk=self.pk).update(**fields)
+
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+        if was_visible != self.is_visible():
+            self.forum.update_counters()
+        elif was_visible:
+            self.update_forum_post_counters(post,
+                                            delta=delta,
+                                            member_delta=counters.get('member_count', 0),
+                                            last_post=fields.get('last_post', None),
+                                            moved=moved)
+
+    def update_forum_post_counters(self, post, delta=0, member_delta=0, last_post=None, moved=False):
+        from pybb.models import Forum, TopicParticipant
+
+        forum_ids = self.forum_ids or [self.forum_id]
+
+        member_forum_ids = []
+
+        if member_delta:
+            # a forum already counting another post of the user also counts it for its parents
+            for forum_id in forum_ids:
+                if (TopicParticipant.objects
+                        .filter(user_id=post.user_id,
+                                topic__forum_ids__contains=[forum_id],
+                                topic__deleted=False,
+                                topic__redirect=False)
+                        .exclude(topic_id=self.pk)
+                        .exists()):
+                    break
+
+                member_forum_ids.append(forum_id)
+
+        if delta:
+            self.update_forum_counters(member_forum_ids, post_count=delta, member_count=member_delta)
+            self.update_forum_counters([forum_id for forum_id in forum_ids if forum_id not in member_forum_ids],
+                                       post_count=delta)
+
+        if last_post is not None and last_post.pk == post.pk and not moved:
+            Forum.objects.filter(pk=self.forum_id).update(last_post=post, last_topic=self, updated=post.created)
+
+            for forum in get_loaded_parent_forums(self)[:1]:
+                forum.last_post, forum.last_topic, forum.updated = post, self, post.created
+        elif moved or (delta < 0 and self.forum.last_post_id == post.pk):
+            self.forum.update_last_post()
+
+    def update_forum_counters(self, forum_ids=None, **deltas):
+        from pybb.models import Forum
+
+        if forum_ids is None:
+            forum_ids = self.forum_ids or [self.forum_id]
+
+        if not forum_ids:
+            return
+
+        apply_counter_deltas(Forum.objects.filter(pk__in=forum_ids),
+                             [forum for forum in get_loaded_parent_forums(self) if forum.pk in forum_ids],
+                             **deltas)
+
     @property
     def poll_votes(self):
         return self.poll.poll_votes
@@ -822,24 +1151,52 @@ class RenderableItem(ModelBase):
     body = models.TextField(_('Message'), null=True)
     body_html = models.TextField(_('HTML version'), null=True)
     body_text = models.TextField(_('Text version'), null=True)
+    markup_version = models.CharField(_('Markup version'), max_length=40, null=True, blank=True, editable=False)
+    image_urls = ArrayField(models.TextField(), verbose_name=_('Image URLs'), null=True, blank=True, editable=False)
+
+    def render(self, commit=False, cache=False, side_effects=True, refresh=False):
+        """
+        Render body_html and body_text from the body, without ``side_effects``
+        the processors do not record anything about the item, e.g. its mentions,
+        with ``refresh`` the render cache is written but never read
+        """
+        pipeline = get_pipeline()
+
+        context = {'images': []}
 
-    def render(self, commit=False):
-        self.body_html = markup(self.body, obj=self)
+        self.body_html = markup(self.body, obj=self if side_effects else None, context=context,
+                                cache=cache, refresh=refresh)
+        self.markup_version = pipeline.version
+        self.image_urls = context['images']
 
-        # Remove tags which was generated with the markup processor
-        text = strip_tags(self.body_html)
-        # Unescape entities which was generated with the markup processor
-        self.body_text = unescape(text)
+        # Remove tags and decode entities generated by the markup processor
+        self.body_text = html_to_text(self.body_html)
 
         if commit:
-            update_fields(self, fields=('body_html', 'body_text', ))
+            update_fields(self, fields=('body_html', 'body_text', 'markup_version', 'image_urls', ))
+
+    def is_markup_stale(self):
+        return self.body_html is not None and self.markup_version != get_pipeline().version
+
+    def needs_render(self):
+        return self.body_html is None or self.body_text is None or self.is_markup_stale()
+
+    def schedule_render(self, force=False):
+        """
+        Schedule a new render of the item when it is not rendered or
+        rendered by an older pipeline
+        """
+        return schedule_render([self], force=force)
 
     def get_body_html(self, asynchronous=True, force=False):
         if self.body_html is not None and not force:
+            if self.is_markup_stale():
+                self.schedule_render()
+
             return self.body_html
 
         if asynchronous:
-            generate_markup.delay(self.pk)
+            self.schedule_render(force=force)
 
             return None
 
@@ -852,7 +1209,7 @@ class RenderableItem(ModelBase):
             return self.body_text
 
         if asynchronous:
-            generate_markup.delay(self.pk)
+            self.schedule_render(force=force)
 
             return None
 
@@ -861,6 +1218,34 @@ class RenderableItem(ModelBase):
         return self.body_text
 
 
+def schedule_render(items, force=False):
+    """
+    Enqueue a single task rendering the items which need it, e.g. the posts
+    of a page, an item is enqueued at most once per PYBB_RENDER_SCHEDULE_TIMEOUT
+    seconds while the workers catch up
+    """
+    version = get_pipeline().version
+    cache = caches[defaults.PYBB_RENDER_CACHE]
+
+    item_ids = []
+
+    for item in items:
+        if not item.pk or not (force or item.needs_render()):
+            continue
+
+        key = 'pybb:rerender:%s:%s:%s' % (item._meta.label_lower, item.pk, version)
+
+        if cache.add(key, 1, timeout=defaults.PYBB_RENDER_SCHEDULE_TIMEOUT):
+            item_ids.append(item.pk)
+
+    if len(item_ids) == 1:
+        generate_markup.delay(item_ids[0])
+    elif item_ids:
+        generate_markup_batch.delay(item_ids)
+
+    return item_ids
+
+
 class PostQuerySetMixin(object):
     def filter_by_user(self, topic, user):
         if not topic.is_moderated_by(user):
@@ -891,6 +1276,37 @@ class PostQuerySet(PostQuerySetMixin, QuerySetBase):
     pass
 
 
+# the position of a visible post is its rank among the visible posts of its
+# topic by creation date, hidden posts have none
+POST_POSITIONS_SQL = """
+UPDATE {post} SET {position} = s.position
+FROM (
+    SELECT {pk} AS id,
+           CASE WHEN NOT {deleted} AND NOT {on_moderation} THEN
+               RANK() OVER (PARTITION BY {topic}, NOT {deleted} AND NOT {on_moderation} ORDER BY {created})
+           END AS position
+    FROM {post}
+    WHERE {where}
+) s
+WHERE {post}.{pk} = s.id AND {post}.{position} IS DISTINCT FROM s.position
+RETURNING {post}.{pk}, {post}.{position}
+"""
+
+# a post becoming visible shifts the later visible posts of its topic and
+# takes the rank left free, deduced from the post count of the topic
+POST_INSERT_POSITION_SQL = """
+WITH shifted AS (
+    UPDATE {post} SET {position} = {position} + 1
+    WHERE {topic} = %(topic_id)s AND {created} > %(created)s AND {position} IS NOT NULL AND {pk} <> %(pk)s
+    RETURNING 1
+)
+UPDATE {post} SET {position} = (SELECT {post_count} FROM {topic_table} WHERE {topic_pk} = %(topic_id)s) -
+                               (SELECT COUNT(*) FROM shifted)
+WHERE {pk} = %(pk)s
+RETURNING {position}
+"""
+
+
 @queryset
 class PostManager(ManagerBase):
     def get_queryset(self):
@@ -902,6 +1318,101 @@ class PostManager(ManagerBase):
     def visible(self, join=True):
         return self.get_queryset().visible(join)
 
+    def get_column_names(self):
+        qn = connection.ops.quote_name
+
+        topic_model = self.model._meta.get_field('topic').related_model
+
+        names = dict((name, qn(self.model._meta.get_field(name).column))
+                     for name in ('position', 'deleted', 'on_moderation', 'topic', 'created'))
+
+        names.update(post=qn(self.model._meta.db_table),
+                     pk=qn(self.model._meta.pk.column),
+                     topic_table=qn(topic_model._meta.db_table),
+                     topic_pk=qn(topic_model._meta.pk.column),
+                     post_count=qn(topic_model._meta.get_field('post_count').column))
+
+        return names
+
+    def update_positions(self, topic_ids=None, start=None, stop=None):
+        """
+        Renumber with a single UPDATE the posts of the topics of ``topic_ids``,
+        or of the topic ids in [start, stop), return the new position by post
+        id of the posts which moved, only used to repair positions, posts
+        keep them up to date incrementally (see insert_position)
+        """
+        names = self.get_column_names()
+
+        if topic_ids is not None:
+            where = '{topic} = ANY(%(topic_ids)s)'
+            params = {'topic_ids': list(topic_ids)}
+        else:
+            where = '{topic} >= %(start)s AND {topic} < %(stop)s'
+            params = {'start': start, 'stop': stop}
+
+        with connection.cursor() as cursor:
+            cursor.execute(POST_POSITIONS_SQL.format(where=where.format(**names), **names), params)
+
+            return dict(cursor.fetchall())
+
+    def insert_position(self, post):
+        """
+        Number ``post`` which became visible in its topic, the post count of
+        the topic must already include it, return its new position
+        """
+        names = self.get_column_names()
+
+        with connection.cursor() as cursor:
+            cursor.execute(POST_INSERT_POSITION_SQL.format(**names),
+                           {'topic_id': post.topic_id, 'created': post.created, 'pk': post.pk})
+
+            row = cursor.fetchone()
+
+        return row[0] if row else None
+
+    def remove_position(self, post, topic_id=None):
+        """
+        Unnumber ``post`` which was visible in the topic of ``topic_id``
+        and shift the later visible posts of the topic
+        """
+        (self.filter(topic_id=topic_id or post.topic_id, created__gt=post.created, position__isnull=False)
+         .exclude(pk=post.pk)
+         .update(position=F('position') - 1))
+
+        self.filter(pk=post.pk).update(position=None)
+
+    def rerender(self, post_ids, commit=True, refresh=True):
+        """
+        Render again the posts of ``post_ids`` and save the changed ones with
+        a single bulk update, return the changed posts with their previous HTML.
+
+        The render cache is written but never read, unless ``refresh`` is
+        unset, e.g. for posts which have never been rendered.
+        """
+        posts = list(self.filter(pk__in=post_ids)
+                     .only('pk', 'body', 'body_html', 'body_text', 'markup_version', 'image_urls')
+                     .iterator())
+
+        changed = []
+        updated = []
+
+        for post in posts:
+            previous = (post.body_html, post.body_text, post.markup_version, post.image_urls)
+
+            # the cache does not know about formatter upgrades or renamed users
+            post.render(cache=True, refresh=refresh, side_effects=False)
+
+            if (post.body_html, post.body_text, post.markup_version, post.image_urls) != previous:
+                updated.append(post)
+
+                if post.body_html != previous[0]:
+                    changed.append((post, previous[0]))
+
+        if commit and updated:
+            self.bulk_update(updated, ['body_html', 'body_text', 'markup_version', 'image_urls'])
+
+        return changed
+
     def contribute_to_class(self, cls, name):
         signals.post_save.connect(self.post_save, sender=cls)
         return super(PostManager, self).contribute_to_class(cls, name)
@@ -942,12 +1453,16 @@ class BasePost(RenderableItem):
 
     deleted = models.BooleanField(_('Deleted'), default=False, db_index=True)
 
+    # rank among the visible posts of the topic, None when the post is hidden
+    position = models.PositiveIntegerField(_('Position'), null=True, blank=True, editable=False)
+
     hash = models.CharField(max_length=150, null=True, blank=True, db_index=True)
 
     objects = PostManager()
 
     class Meta(object):
         ordering = ['-created']
+        index_together = [('topic', 'created')]
         verbose_name = _('Post')
         verbose_name_plural = _('Posts')
         app_label = 'pybb'
@@ -1010,17 +1525,88 @@ class BasePost(RenderableItem):
                 self.body != self._initial_attr['body']):
             self.render()
 
+        previous = None if new else dict(self._initial_attr)
+
         super(BasePost, self).save(*args, **kwargs)
 
-        if new:
-            self.topic.updated = created_at
-            self.topic.forum.updated = created_at
+        self._initial_attr = dict(self.__dict__)
 
-        self.topic.update_counters()
+        self.update_topic_counters(previous)
 
         if new and self.pk == self.topic.first_post_id:
             sync_cover.delay(self.topic_id)
 
+    def is_visible(self):
+        return not self.on_moderation and not self.deleted
+
+    def update_topic_counters(self, previous=None):
+        """
+        Propagate the change of this post to its topic and forums,
+        ``previous`` is the state of the post before saving, None when created
+        """
+        from pybb.models import Topic
+
+        visible = self.is_visible()
+
+        if previous is None:
+            self.topic.update_post_counters(self,
+                                            delta=int(visible),
+                                            joined=True,
+                                            moderation=self.on_moderation)
+
+            if visible:
+                self.position = self.__class__.objects.insert_position(self)
+
+            return
+
+        was_on_moderation = previous.get('on_moderation', self.on_moderation)
+        was_visible = (not was_on_moderation and
+                       not previous.get('deleted', self.deleted))
+
+        moderation = self.on_moderation or was_on_moderation
+
+        old_topic_id = previous.get('topic_id', self.topic_id)
+
+        if old_topic_id != self.topic_id:
+            try:
+                old_topic = Topic.objects.get(pk=old_topic_id)
+            except ObjectDoesNotExist:
+                pass
+            else:
+                old_topic.update_post_counters(self,
+                                               delta=-int(was_visible),
+                                               left=True,
+                                               moved=True,
+                                               moderation=was_on_moderation)
+
+            self.topic.update_post_counters(self,
+                                            delta=int(visible),
+                                            joined=True,
+                                            moved=True,
+                                            moderation=self.on_moderation)
+
+            self.update_position(visible, was_visible, old_topic_id)
+        elif (visible != was_visible or moderation or
+                (visible and previous.get('updated', self.updated) != self.updated)):
+            self.topic.update_post_counters(self,
+                                            delta=int(visible) - int(was_visible),
+                                            moderation=moderation)
+
+            if visible != was_visible:
+                self.update_position(visible, was_visible)
+
+    def update_position(self, visible, was_visible, old_topic_id=None):
+        """
+        Shift the positions of the later posts of the topics the post left
+        or joined instead of renumbering them
+        """
+        if was_visible:
+            self.__class__.objects.remove_position(self, old_topic_id)
+            self.position = None
+
+        if visible:
+            self.position = self.__class__.objects.insert_position(self)
+
     def get_absolute_url(self):
         return self.get_anchor_url()
 
@@ -1028,7 +1614,10 @@ class BasePost(RenderableItem):
         if not user:
             user = AnonymousUser()
 
-        count = self.topic.posts.filter_by_user(self.topic, user).filter(created__lt=self.created).count() + 1
+        if self.position is not None and self.topic.shows_visible_posts_only(user):
+            count = self.position
+        else:
+            count = self.topic.posts.filter_by_user(self.topic, user).filter(created__lt=self.created).count() + 1
 
         page = math.ceil(count / float(defaults.PYBB_TOPIC_PAGE_SIZE))
 
@@ -1057,6 +1646,10 @@ class BasePost(RenderableItem):
             if self_id == head_post_id:
                 self.topic.mark_as_deleted()
 
+                # the topic deletion already deleted the post and recounted the topic
+                self._initial_attr.update(deleted=True, position=None)
+                self.position = None
+
         if commit:
             update_fields(self, fields=('deleted', ))
 
@@ -1090,29 +1683,18 @@ class BasePost(RenderableItem):
 
         return delta > defaults.PYBB_UPDATE_MENTION_POST_DELTA
 
-    @classmethod
-    def watch_topic(cls, old_attr={}, new_attr={},
-                    instance=None, sender=None, **kw):
-
-        from pybb.models import Topic
-
-        if (old_attr.get('topic_id', None) and
-                old_attr.get('topic_id') != new_attr.get('topic_id')):
-            instance.save(_signal=False)
-
-            try:
-                Topic.objects.get(pk=old_attr.get('topic_id')).update_counters()
-            except ObjectDoesNotExist:
-                pass
-
     @property
     def images(self):
+        if self.image_urls is not None:
+            return self.image_urls
+
+        # rendered before the image urls were recorded
         if self.body_html:
             soup = BeautifulSoup(self.body_html, 'lxml')
 
-            for img in soup.findAll('img'):
-                if img.get('src'):
-                    yield img['src']
+            return [img['src'] for img in soup.findAll('img') if img.get('src')]
+
+        return []
 
 
 class BaseAttachment(ModelBase):
@@ -1220,6 +1802,81 @@ class BaseAttachment(ModelBase):
         return self.type == self.TYPE_ARCHIVE
 
 
+class TopicParticipantManager(ManagerBase):
+    def add_posts(self, topic_id, user_id, delta):
+        """
+        Add ``delta`` visible posts of the user to the topic with a single upsert
+        and return the new number of visible posts of the user in the topic
+        """
+        if not delta:
+            try:
+                return self.get(topic_id=topic_id, user_id=user_id).post_count
+            except ObjectDoesNotExist:
+                return 0
+
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+
+        with connection.cursor() as cursor:
+            if delta > 0:
+                cursor.execute('INSERT INTO {table} (topic_id, user_id, post_count) VALUES (%s, %s, %s) '
+                               'ON CONFLICT (topic_id, user_id) '
+                               'DO UPDATE SET post_count = {table}.post_count + EXCLUDED.post_count '
+                               'RETURNING post_count'.format(table=table),
+                               [topic_id, user_id, delta])
+            else:
+                cursor.execute('UPDATE {table} SET post_count = post_count + %s '
+                               'WHERE topic_id = %s AND user_id = %s '
+                               'RETURNING post_count'.format(table=table),
+                               [delta, topic_id, user_id])
+
+            row = cursor.fetchone()
+
+        post_count = row[0] if row else 0
+
+        if post_count <= 0:
+            self.filter(topic_id=topic_id, user_id=user_id).delete()
+
+        return max(post_count, 0)
+
+    def rebuild(self, topics):
+        """
+        Recreate the participants of ``topics`` from their visible posts
+        """
+        from pybb.models import Post
+
+        topic_ids = [getattr(topic, 'pk', topic) for topic in topics]
+
+        self.filter(topic_id__in=topic_ids).delete()
+
+        rows = (Post.objects.visible(join=False)
+                .filter(topic_id__in=topic_ids)
+                .values_list('topic_id', 'user_id')
+                .annotate(post_count=models.Count('id'))
+                .order_by())
+
+        self.bulk_create([self.model(topic_id=topic_id, user_id=user_id, post_count=post_count)
+                          for topic_id, user_id, post_count in rows])
+
+
+class BaseTopicParticipant(ModelBase):
+    """
+    Number of visible posts per user and topic, maintained on post changes
+    """
+    class Meta(object):
+        verbose_name = _('Topic participant')
+        verbose_name_plural = _('Topic participants')
+        app_label = 'pybb'
+        abstract = True
+        unique_together = ('topic', 'user')
+
+    topic = models.ForeignKey(get_model_string('Topic'), on_delete=models.CASCADE)
+    user = models.ForeignKey(AUTH_USER_MODEL, related_name='topic_participations', on_delete=models.CASCADE)
+    post_count = models.IntegerField(_('Post count'), default=0)
+
+    objects = TopicParticipantManager()
+
+
 class BaseTopicReadTracker(ModelBase):
     """
     Save per user topic read tracking
@@ -1278,6 +1935,24 @@ class BaseForumReadTracker(ModelBase):
     objects = ForumReadTrackerManager()
 
 
+class BaseForumReadMark(ModelBase):
+    """
+    Save per user forum read tracking as a high-water mark and
+    a sparse map of topic id -> read timestamp for the topics read after it
+    """
+    class Meta(object):
+        verbose_name = _('Forum read mark')
+        verbose_name_plural = _('Forum read marks')
+        app_label = 'pybb'
+        abstract = True
+        unique_together = ('user', 'forum')
+
+    user = models.ForeignKey(AUTH_USER_MODEL, blank=False, null=False, on_delete=models.CASCADE)
+    forum = models.ForeignKey(get_model_string('Forum'), on_delete=models.CASCADE)
+    time_stamp = models.DateTimeField(null=True, blank=True)
+    topics = JSONField(default=dict, blank=True)
+
+
 class BasePoll(ModelBase):
     TYPE_NONE = 0
     TYPE_SINGLE = 1
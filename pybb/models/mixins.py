@@ -5,11 +5,15 @@ except ImportError:
     ifilter = filter
     imap = map
 
+from collections import defaultdict
+
 from django.contrib.postgres.fields import ArrayField
-from django.db import models, transaction
-from django.db.models import signals, Q
+from django.core.cache import caches
+from django.db import connection, models, transaction
+from django.db.models import signals, Max, Min, Q
 from django.utils.functional import cached_property
 
+from pybb import defaults
 from pybb.base import ModelBase
 
 
@@ -22,30 +26,92 @@ def get_attribute_deep(instance, path):
     return obj
 
 
+def get_parent_forums(forum_ids, forum_cache_by_id=None):
+    """
+    Return the forums of ``forum_ids`` by id, resolved from ``forum_cache_by_id``
+    then from the forum tree, only the forums missing from both are queried
+    """
+    from pybb.models import Forum
+    from pybb.models.base import get_forum_tree
+
+    forum_cache_by_id = forum_cache_by_id if forum_cache_by_id is not None else {}
+
+    forum_ids = [id_ for id_ in forum_ids if id_ not in forum_cache_by_id]
+
+    if forum_ids:
+        forum_cache_by_id.update(get_forum_tree().get_forums(forum_ids))
+
+        forum_ids = [id_ for id_ in forum_ids if id_ not in forum_cache_by_id]
+
+    if forum_ids:
+        forum_cache_by_id.update({forum.id: forum for forum in Forum.objects.filter(id__in=forum_ids)})
+
+    return forum_cache_by_id
+
+
+def fix_stale_forum_ids(objects):
+    """
+    Correct in memory the forum_ids of ``objects`` which disagree with the
+    forum tree and enqueue their repair, reads never write them
+    """
+    from pybb.models.base import get_forum_tree
+
+    tree = get_forum_tree()
+
+    stale = []
+
+    for obj in objects:
+        forum_ids = tree.get_forum_ids(obj.forum_id) if obj.forum_id else []
+
+        if forum_ids is None:
+            continue
+
+        if obj.forum_ids != forum_ids:
+            obj.forum_ids = forum_ids
+            stale.append(obj)
+
+    if stale:
+        enqueue_forum_ids_repair(stale)
+
+    return stale
+
+
+def enqueue_forum_ids_repair(objects):
+    """
+    Schedule the repair of the forum_ids of ``objects``, each object is
+    enqueued at most once per PYBB_FORUM_IDS_REPAIR_DELAY seconds
+    """
+    from pybb.tasks import repair_forum_ids
+
+    cache = caches[defaults.PYBB_CACHE]
+
+    ids_by_model = defaultdict(list)
+
+    for obj in objects:
+        label = obj._meta.label_lower
+
+        if cache.add('pybb:repair:%s:%s' % (label, obj.pk), 1, timeout=defaults.PYBB_FORUM_IDS_REPAIR_DELAY):
+            ids_by_model[label].append(obj.pk)
+
+    for label, ids in ids_by_model.items():
+        repair_forum_ids.delay(label, ids)
+
+
 def prefetch_parent_forums(objects, forum_cache_by_id=None, through=None):
     """
     Warning: this method will evaluate your queryset, use it at the very end of your filtering chain
     :return: an evaluated and populated queryset
     """
-    from pybb.models import Forum
 
     object_list = objects
     if through:
         object_list = list(ifilter(lambda x: x is not None,
                            imap(lambda obj: get_attribute_deep(obj, through), objects)))
 
-    forum_cache_by_id = forum_cache_by_id or {}
-
-    for obj in object_list:
-        if (obj.forum_ids and obj.forum_ids[0] != obj.forum_id) or (not obj.forum_ids and obj.forum_id):
-            obj.rebuild_parent_forum_ids(commit=True)
+    fix_stale_forum_ids(object_list)
 
-    parent_forum_ids = set(chain(*[obj.forum_ids for obj in object_list]))
-    parent_forum_ids = [id_ for id_ in parent_forum_ids if id_ not in forum_cache_by_id]
-
-    if parent_forum_ids:
-        parent_forums = Forum.objects.filter(id__in=parent_forum_ids).all()
-        forum_cache_by_id.update({forum.id: forum for forum in parent_forums})
+    forum_cache_by_id = get_parent_forums(set(chain(*[obj.forum_ids for obj in object_list])),
+                                          forum_cache_by_id=forum_cache_by_id)
 
     for obj in object_list:
         obj.populate_parent_forums(forum_cache_by_id)
@@ -53,6 +119,148 @@ def prefetch_parent_forums(objects, forum_cache_by_id=None, through=None):
     return objects
 
 
+SUBTREE_FORUM_IDS_SQL = """
+UPDATE {table} SET {forum_ids} = array_cat({forum_ids}[1:array_position({forum_ids}, %(forum_id)s)],
+                                         %(forum_ids)s::integer[])
+WHERE {forum_ids} @> ARRAY[%(forum_id)s]::integer[]{extra}
+"""
+
+
+def rewrite_subtree_forum_ids(model, forum, start=None, stop=None):
+    """
+    Replace the ancestors of ``forum`` in the forum_ids of every row of ``model``
+    below it with its current forum_ids, with a single UPDATE
+    restricted to the ids in [start, stop) when they are given
+    """
+    qn = connection.ops.quote_name
+
+    extra = ''
+
+    params = {
+        'forum_id': forum.pk,
+        'forum_ids': list(forum.forum_ids),
+    }
+
+    if start is not None:
+        extra = ' AND {pk} >= %(start)s AND {pk} < %(stop)s'.format(pk=qn(model._meta.pk.column))
+        params.update(start=start, stop=stop)
+
+    sql = SUBTREE_FORUM_IDS_SQL.format(table=qn(model._meta.db_table),
+                                       forum_ids=qn(model._meta.get_field('forum_ids').column),
+                                       extra=extra)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+        return cursor.rowcount
+
+
+def rewrite_subtree_forum_ids_chunked(model, forum, chunk_size):
+    """
+    Same as rewrite_subtree_forum_ids, one transaction per chunk of ``chunk_size`` ids
+    so that huge tables are never locked for long
+    """
+    bounds = model.objects.filter(forum_ids__contains=[forum.pk]).aggregate(start=Min('pk'), stop=Max('pk'))
+
+    if bounds['start'] is None:
+        return 0
+
+    count = 0
+
+    for start in range(bounds['start'], bounds['stop'] + 1, chunk_size):
+        with transaction.atomic():
+            count += rewrite_subtree_forum_ids(model, forum, start=start, stop=start + chunk_size)
+
+    return count
+
+
+def relocate_subtree_topics(forum, chunk_size, forum_ids):
+    """
+    Rewrite by chunks the forum_ids of the topics below ``forum`` after a move,
+    then recount the forums of ``forum_ids``, the old and new parents, whose
+    member counts follow the forum_ids of the topics
+    """
+    from pybb.counters import defer_forum_counters
+    from pybb.models import Forum, Topic
+
+    count = rewrite_subtree_forum_ids_chunked(Topic, forum, chunk_size)
+
+    with defer_forum_counters():
+        for parent in Forum.objects.filter(pk__in=[forum_id for forum_id in forum_ids if forum_id]):
+            parent.update_counters()
+
+    return count
+
+
+REPAIR_FORUM_FORUM_IDS_SQL = """
+WITH RECURSIVE tree (id, forum_ids) AS (
+    SELECT {pk}, ARRAY[]::integer[] FROM {forum} WHERE {parent} IS NULL
+    UNION ALL
+    SELECT f.{pk}, array_prepend(t.id, t.forum_ids) FROM {forum} f INNER JOIN tree t ON f.{parent} = t.id
+)
+UPDATE {forum} SET {forum_ids} = tree.forum_ids
+FROM tree
+WHERE {forum}.{pk} = tree.id AND {forum}.{forum_ids} IS DISTINCT FROM tree.forum_ids{extra}
+"""
+
+REPAIR_FORUM_IDS_SQL = """
+UPDATE {table} SET {forum_ids} = array_prepend(f.{forum_pk}, f.{forum_forum_ids})
+FROM {forum} f
+WHERE {table}.{parent} = f.{forum_pk}
+  AND {table}.{forum_ids} IS DISTINCT FROM array_prepend(f.{forum_pk}, f.{forum_forum_ids}){extra}
+"""
+
+
+def repair_forum_ids(model, ids=None, start=None, stop=None):
+    """
+    Rewrite with a single UPDATE the forum_ids of the rows of ``model`` which
+    disagree with the parent links, restricted to ``ids`` or to the ids in
+    [start, stop) when given. Forums must be repaired before topics
+    since the forum_ids of topics are derived from the ones of their forum,
+    repairing forums also invalidates the cached forum tree.
+    """
+    from pybb.models import Forum
+
+    qn = connection.ops.quote_name
+
+    names = {
+        'table': qn(model._meta.db_table),
+        'pk': qn(model._meta.pk.column),
+        'parent': qn(model._meta.get_field('forum').column),
+        'forum_ids': qn(model._meta.get_field('forum_ids').column),
+        'forum': qn(Forum._meta.db_table),
+        'forum_pk': qn(Forum._meta.pk.column),
+        'forum_forum_ids': qn(Forum._meta.get_field('forum_ids').column),
+    }
+
+    extra = ''
+    params = {}
+
+    if ids is not None:
+        extra = ' AND {table}.{pk} = ANY(%(ids)s)'
+        params['ids'] = list(ids)
+
+    if start is not None:
+        extra += ' AND {table}.{pk} >= %(start)s AND {table}.{pk} < %(stop)s'
+        params.update(start=start, stop=stop)
+
+    sql = REPAIR_FORUM_FORUM_IDS_SQL if model is Forum else REPAIR_FORUM_IDS_SQL
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(extra=extra.format(**names), **names), params)
+
+        count = cursor.rowcount
+
+    if model is Forum and count:
+        from pybb.receivers import clear_forum_tree_caches
+
+        # the raw UPDATE bypasses the signals which invalidate the shared forum tree
+        clear_forum_tree_caches()
+        transaction.on_commit(clear_forum_tree_caches)
+
+    return count
+
+
 class ParentForumQuerysetMixin(object):
     def children(self, forum):
         return self.filter(forum_ids__contains=[forum.id])
@@ -105,6 +313,7 @@ class ParentForumManagerMixin(object):
             instance._has_moved = False
             return
 
+        instance._old_forum_id = instance.forum_ids[0] if instance.forum_ids else None
         instance.rebuild_parent_forum_ids(commit=False)
         instance._has_moved = True
 
@@ -115,14 +324,22 @@ class ParentForumManagerMixin(object):
         if not (sender == Forum and instance._has_moved):
             return
 
-        forums = [instance]
-        while forums:
-            for forum in forums:
-                forum_ids = [forum.id] + forum.forum_ids
-                self.filter(forum=forum).all().update(forum_ids=forum_ids)
-                Topic.objects.filter(forum=forum).all().update(forum_ids=forum_ids)
+        rewrite_subtree_forum_ids(Forum, instance)
+
+        chunk_size = defaults.PYBB_FORUM_MOVE_CHUNK_SIZE
+
+        if chunk_size:
+            # topics are relocated after the move is committed, in short transactions,
+            # the parents counted before are recounted once they are all moved
+            forum_ids = [instance._old_forum_id, instance.forum_id]
 
-            forums = self.filter(forum__in=forums)
+            transaction.on_commit(lambda: relocate_subtree_topics(instance, chunk_size, forum_ids))
+        else:
+            rewrite_subtree_forum_ids(Topic, instance)
+
+            # the old parent is recounted by Forum.watch_forum
+            if instance.forum_id:
+                instance.forum.update_counters()
 
         instance._has_moved = False
 
@@ -143,7 +360,13 @@ class ParentForumBase(ModelBase):
         """
         Used in templates for breadcrumb building
         """
-        return self.forum.parents + [self.forum, ] if self.forum_id else []
+        if not self.forum_id:
+            return []
+
+        if not self._meta.get_field('forum').is_cached(self):
+            self.prefetch_parent_forums()
+
+        return self.forum.parents + [self.forum, ]
 
     def rebuild_parent_forum_ids(self, commit=False):
         from pybb.models import Forum
@@ -170,16 +393,6 @@ class ParentForumBase(ModelBase):
             child = child.forum
 
     def prefetch_parent_forums(self, forum_cache_by_id=None):
-        from pybb.models import Forum
-
-        forum_cache_by_id = forum_cache_by_id or {}
-
-        if (self.forum_ids and self.forum_ids[0] != self.forum_id) or (not self.forum_ids and self.forum_id):
-            self.rebuild_parent_forum_ids(commit=True)
-            return
-
-        forum_ids = [id_ for id_ in self.forum_ids if id_ not in forum_cache_by_id]
-        if forum_ids:
-            forum_cache_by_id.update({forum.id: forum for forum in Forum.objects.filter(id__in=forum_ids).all()})
+        fix_stale_forum_ids([self])
 
-        self.populate_parent_forums(forum_cache_by_id)
+        self.populate_parent_forums(get_parent_forums(self.forum_ids, forum_cache_by_id=forum_cache_by_id))
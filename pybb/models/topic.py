@@ -1,4 +1,4 @@
-from pybb.models.base import BaseTopic, TopicManager
+from pybb.models.base import BaseTopic, BaseTopicParticipant, TopicManager
 
 
 class Topic(BaseTopic):
@@ -6,3 +6,8 @@ class Topic(BaseTopic):
         abstract = False
 
     objects = TopicManager()
+
+
+class TopicParticipant(BaseTopicParticipant):
+    class Meta(BaseTopicParticipant.Meta):
+        abstract = False
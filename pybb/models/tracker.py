@@ -1,4 +1,4 @@
-from pybb.models.base import BaseTopicReadTracker, BaseForumReadTracker, ForumReadTrackerManager
+from pybb.models.base import BaseTopicReadTracker, BaseForumReadTracker, BaseForumReadMark, ForumReadTrackerManager
 
 
 class TopicReadTracker(BaseTopicReadTracker):
@@ -11,3 +11,8 @@ class ForumReadTracker(BaseForumReadTracker):
         abstract = False
 
     objects = ForumReadTrackerManager()
+
+
+class ForumReadMark(BaseForumReadMark):
+    class Meta(BaseForumReadMark.Meta):
+        abstract = False
@@ -0,0 +1,113 @@
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+
+class PermissionSnapshot(object):
+    """
+    Answer the permission checks of a user during a request from memory.
+
+    Every forum object permission of the user, granted to the user or to one
+    of their groups, is loaded with one query and the global permissions with
+    another one, the first time they are needed,
+    instead of one guardian query per ``user.has_perm(permission, forum)``.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+        self._forum_perms = None
+        self._global_perms = None
+        self._all_forum_perms = None
+
+    def get_forum_content_type(self):
+        from pybb.models import Forum
+
+        return ContentType.objects.get_for_model(Forum)
+
+    @property
+    def forum_perms(self):
+        if self._forum_perms is None:
+            from guardian.models import GroupObjectPermission
+            from pybb.proxies import UserObjectPermission
+
+            self._forum_perms = {}
+
+            content_type = self.get_forum_content_type()
+
+            user_perms = (UserObjectPermission.objects
+                          .filter(user=self.user, content_type=content_type)
+                          .values_list('object_pk', 'permission__codename'))
+
+            group_perms = (GroupObjectPermission.objects
+                           .filter(group__user=self.user, content_type=content_type)
+                           .values_list('object_pk', 'permission__codename'))
+
+            for object_pk, codename in user_perms.union(group_perms):
+                self._forum_perms.setdefault(str(object_pk), set()).add(codename)
+
+        return self._forum_perms
+
+    @property
+    def global_perms(self):
+        if self._global_perms is None:
+            self._global_perms = set('%s.%s' % (app_label, codename)
+                                     for app_label, codename in (Permission.objects
+                                                                 .filter(Q(user=self.user) |
+                                                                         Q(group__user=self.user))
+                                                                 .values_list('content_type__app_label', 'codename')
+                                                                 .distinct()))
+
+        return self._global_perms
+
+    def get_perms(self, forum):
+        """
+        Return the codenames of the permissions of the user on ``forum``,
+        compatible with the checker argument of guardian ``get_obj_perms``
+        """
+        if not self.user.is_active:
+            return []
+
+        if self.user.is_superuser:
+            if self._all_forum_perms is None:
+                self._all_forum_perms = list(Permission.objects
+                                             .filter(content_type=self.get_forum_content_type())
+                                             .values_list('codename', flat=True))
+
+            return self._all_forum_perms
+
+        return sorted(self.forum_perms.get(str(forum.pk), ()))
+
+    def has_perm(self, permission, forum=None):
+        if not self.user.is_active:
+            return False
+
+        if self.user.is_superuser:
+            return True
+
+        if forum is None:
+            return permission in self.global_perms
+
+        if '.' in permission:
+            permission = permission.split('.', 1)[1]
+
+        return permission in self.forum_perms.get(str(forum.pk), ())
+
+
+def get_permissions(user):
+    """
+    Return the permission snapshot attached to ``user`` for the current request, if any
+    """
+    return getattr(user, 'pybb_permissions', None)
+
+
+def has_perm(user, permission, forum=None):
+    permissions = get_permissions(user)
+
+    if permissions is None:
+        if forum is None:
+            return user.has_perm(permission)
+
+        return user.has_perm(permission, forum)
+
+    return permissions.has_perm(permission, forum)
@@ -1,13 +1,32 @@
+import hashlib
+import re
+import time
+
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.core.cache import caches
 from django.utils.html import urlize
 
+from html import unescape
+
 from pybb import defaults
+from pybb.engines import get_engine_class, get_markup_engine
 from pybb.util import load_class
 
 
 class BaseProcessor(object):
-    def __init__(self, body, obj=None):
+    def __init__(self, body, obj=None, context=None):
         self.body = body
         self.obj = obj
+        self.context = context
+
+    @classmethod
+    def get_fingerprint(cls):
+        """
+        Return the settings the output of the processor depends on
+        """
+        return ()
 
 
 class UrlizeProcessor(BaseProcessor):
@@ -15,13 +34,201 @@ class UrlizeProcessor(BaseProcessor):
         return urlize(self.body)
 
 
-def markup(body, obj=None, context=None):
-    for preprocessor in defaults.PYBB_MARKUP_PREPROCESSORS:
-        body = load_class(preprocessor)(body, obj=obj).render()
+def capture_image(context, url):
+    """
+    Record the image ``url`` in the ``images`` list of the render context, if any
+    """
+    if context is not None and 'images' in context and url not in context['images']:
+        context['images'].append(url)
+
+
+class ImageCaptureProcessor(BaseProcessor):
+    """
+    Record the sources of the images of the HTML in the render context,
+    in document order, replacing those recorded by the formatters.
+
+    Used as the last postprocessor it also catches the images written as raw
+    HTML and drops those removed by the sanitizer.
+    """
+    src_re = re.compile(r'<img\b[^>]*?\ssrc\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.IGNORECASE)
+
+    def render(self):
+        if self.context is None or 'images' not in self.context:
+            return self.body
+
+        images = []
+
+        for m in self.src_re.finditer(self.body):
+            url = unescape(m.group(1) or m.group(2) or '')
+
+            if url and url not in images:
+                images.append(url)
+
+        self.context['images'][:] = images
+
+        return self.body
+
+
+class MarkupPipeline(object):
+    """
+    Render a body through the preprocessors, the markup engine and the
+    postprocessors, compiled once into a tuple of ``(name, callable)`` stages.
+
+    ``hook`` is called with the stage name, its wall time in seconds and the
+    size of its output after every stage when it is set.
+
+    ``version`` identifies the output of the pipeline, it changes with
+    the configured processors and formatters.
+    """
+
+    def __init__(self, preprocessors=(), engine=None, postprocessors=(), hook=None, version=None):
+        stages = [(path, self.compile_processor(load_class(path))) for path in preprocessors]
+
+        if engine is not None:
+            stages.append((engine, get_markup_engine(engine).render_message))
+
+        stages += [(path, self.compile_processor(load_class(path))) for path in postprocessors]
+
+        self.stages = tuple(stages)
+        self.hook = hook
+        self.version = version
+
+    @classmethod
+    def from_settings(cls):
+        hook = defaults.PYBB_MARKUP_PIPELINE_HOOK
+
+        return cls(preprocessors=defaults.PYBB_MARKUP_PREPROCESSORS,
+                   engine=defaults.PYBB_MARKUP_ENGINE,
+                   postprocessors=defaults.PYBB_MARKUP_POSTPROCESSORS,
+                   hook=load_class(hook) if hook else None,
+                   version=hashlib.sha1(repr(get_pipeline_key()).encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def compile_processor(processor_class):
+        def render(body, obj=None, context=None):
+            # set after construction to support processors overriding __init__(body, obj=None)
+            processor = processor_class(body, obj=obj)
+            processor.context = context
+
+            return processor.render()
+
+        return render
+
+    def render(self, body, obj=None, context=None):
+        hook = self.hook
+
+        if hook is None:
+            for name, stage in self.stages:
+                body = stage(body, obj=obj, context=context)
+
+            return body
+
+        for name, stage in self.stages:
+            started = time.time()
+
+            body = stage(body, obj=obj, context=context)
+
+            hook(name, time.time() - started, len(body))
+
+        return body
+
+
+class StageTimings(object):
+    """
+    Pipeline hook accumulating the calls, wall time and output size of each stage::
+
+        timings = StageTimings()
+        get_pipeline().hook = timings
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def __call__(self, name, duration, size):
+        calls, total_duration, total_size = self.stages.get(name, (0, 0.0, 0))
+
+        self.stages[name] = (calls + 1, total_duration + duration, total_size + size)
+
+    def report(self):
+        return ['%s: %d calls, %.3fs, %d chars' % (name, calls, duration, size)
+                for name, (calls, duration, size) in self.stages.items()]
+
+
+_pipelines = {}
+
+
+@lru_cache()
+def get_pipeline_key():
+    """
+    Return the fingerprint of the configured processors, memoized
+    until a setting changes (see pybb.receivers)
+    """
+    def fingerprint(paths):
+        return tuple((path, getattr(get_engine_class(path), 'get_fingerprint', tuple)()) for path in paths)
+
+    return (fingerprint(defaults.PYBB_MARKUP_PREPROCESSORS),
+            fingerprint([defaults.PYBB_MARKUP_ENGINE]),
+            fingerprint(defaults.PYBB_MARKUP_POSTPROCESSORS))
+
+
+def get_pipeline():
+    """
+    Return the markup pipeline compiled from the settings, once per process
+    """
+    key = get_pipeline_key()
+
+    pipeline = _pipelines.get(key)
+
+    if pipeline is None:
+        pipeline = _pipelines[key] = MarkupPipeline.from_settings()
+
+    return pipeline
+
+
+def get_render_cache_key(body, version):
+    return 'pybb:render:%s:%s' % (version, hashlib.sha1(body.encode('utf-8')).hexdigest())
+
+
+# lists of the render context filled while rendering, cached along with the HTML
+CAPTURED_CONTEXT_KEYS = ('images', )
+
+
+def markup(body, obj=None, context=None, cache=False, refresh=False):
+    """
+    Render ``body`` through the pipeline, when ``cache`` is set the HTML is
+    shared by identical bodies through the PYBB_RENDER_CACHE cache, with
+    ``refresh`` it is rendered again and replaces the cached one.
+
+    Rendering from the cache skips the side effects of the formatters on
+    ``obj``, such as recording mentions and quotes, only use it when they
+    already happened or are unwanted.
+    """
+    pipeline = get_pipeline()
+
+    if not cache or not body:
+        return pipeline.render(body, obj=obj, context=context)
+
+    render_cache = caches[defaults.PYBB_RENDER_CACHE]
+
+    key = get_render_cache_key(body, pipeline.version)
+
+    cached = None if refresh else render_cache.get(key)
+
+    if cached is None:
+        render_context = dict(context or {})
+        render_context.update((name, []) for name in CAPTURED_CONTEXT_KEYS)
+
+        html = pipeline.render(body, obj=obj, context=render_context)
+
+        captured = dict((name, render_context[name]) for name in CAPTURED_CONTEXT_KEYS)
 
-    body = load_class(defaults.PYBB_MARKUP_ENGINE)(body, obj=obj).render(context)
+        render_cache.set(key, (html, captured), timeout=defaults.PYBB_RENDER_CACHE_TIMEOUT)
+    else:
+        html, captured = cached
 
-    for postprocessor in defaults.PYBB_MARKUP_POSTPROCESSORS:
-        body = load_class(postprocessor)(body, obj=obj).render()
+    if context is not None:
+        for name, values in captured.items():
+            if name in context:
+                context[name].extend(values)
 
-    return body
+    return html
@@ -1,21 +1,52 @@
+from django.core.signals import setting_changed
 from django.db.models.signals import post_save, post_delete
+from django.db import transaction
 from django.dispatch import receiver
 from pybb.models import Forum, Moderator
-from pybb.models.base import get_moderator_ids_by_forum
+from pybb.models.base import get_moderator_ids_by_forum, get_forum_tree, get_forum_visibility
+from pybb.processors import get_pipeline_key
+
+
+def clear_moderator_cache():
+    get_moderator_ids_by_forum.cache_clear()
+
+    # other processes could have reloaded the moderators before the change was committed
+    transaction.on_commit(get_moderator_ids_by_forum.cache_clear)
 
 
 @receiver(post_save, sender=Forum)
 def clear_moderator_cache_forum_post_save(sender, instance, created, **kwargs):
     if created:
-        get_moderator_ids_by_forum.cache_clear()
+        clear_moderator_cache()
 
 
 @receiver(post_delete, sender=Forum)
 def clear_moderator_cache_forum_post_delete(sender, instance, using, **kwargs):
-    get_moderator_ids_by_forum.cache_clear()
+    clear_moderator_cache()
 
 
 @receiver([post_save, post_delete], sender=Moderator)
 def clear_moderator_cache_moderator_post_save_delete(sender, instance, **kwargs):
-    get_moderator_ids_by_forum.cache_clear()
+    clear_moderator_cache()
+
+
+def clear_forum_tree_caches():
+    get_forum_tree.cache_clear()
+    get_forum_visibility.cache_clear()
+
+
+@receiver([post_save, post_delete], sender=Forum)
+def clear_forum_tree_cache(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= set(instance.counter_fields):
+        return
+
+    clear_forum_tree_caches()
+
+    # other processes could have reloaded the tree before the change was committed
+    transaction.on_commit(clear_forum_tree_caches)
+
 
+@receiver(setting_changed)
+def clear_pipeline_key(sender, setting, **kwargs):
+    if setting.startswith('PYBB_'):
+        get_pipeline_key.cache_clear()
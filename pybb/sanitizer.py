@@ -1,13 +1,19 @@
 import bleach
 
-from pybb.defaults import PYBB_ALLOWED_ATTRIBUTES, PYBB_ALLOWED_STYLES, PYBB_ALLOWED_TAGS
+from pybb import defaults
 
 from .processors import BaseProcessor
 
 
 class BleachProcessor(BaseProcessor):
+    @classmethod
+    def get_fingerprint(cls):
+        return (repr(defaults.PYBB_ALLOWED_TAGS),
+                repr(defaults.PYBB_ALLOWED_ATTRIBUTES),
+                repr(defaults.PYBB_ALLOWED_STYLES))
+
     def render(self):
         return bleach.clean(self.body,
-                            tags=PYBB_ALLOWED_TAGS,
-                            attributes=PYBB_ALLOWED_ATTRIBUTES,
-                            styles=PYBB_ALLOWED_STYLES)
+                            tags=defaults.PYBB_ALLOWED_TAGS,
+                            attributes=defaults.PYBB_ALLOWED_ATTRIBUTES,
+                            styles=defaults.PYBB_ALLOWED_STYLES)
@@ -8,11 +8,33 @@ def generate_markup(post_id):
     logger = generate_markup.get_logger()
 
     post = Post.objects.get(pk=post_id)
-    post.render(commit=True)
+    post.render(commit=True, cache=True, side_effects=False)
 
     logger.info('Text generated for %r' % post)
 
 
+@task
+def generate_markup_batch(post_ids):
+    from pybb.models import Post
+
+    logger = generate_markup_batch.get_logger()
+
+    Post.objects.rerender(post_ids, refresh=False)
+
+    logger.info('Text generated for %d posts' % len(post_ids))
+
+
+@task
+def rerender_posts(post_ids):
+    from pybb.models import Post
+
+    logger = rerender_posts.get_logger()
+
+    changed = Post.objects.rerender(post_ids)
+
+    logger.info('Rendered %d posts, %d changed' % (len(post_ids), len(changed)))
+
+
 @task
 def sync_cover(topic_id):
     from pybb.models import Topic
@@ -23,3 +45,36 @@ def sync_cover(topic_id):
     topic.sync_cover()
 
     logger.info('Syncing cover for %r' % topic)
+
+
+@task
+def flush_topic_views():
+    from pybb.counters import get_view_counter
+
+    logger = flush_topic_views.get_logger()
+
+    count = get_view_counter().flush()
+
+    logger.info('Views flushed for %d topics' % count)
+
+
+@task
+def repair_forum_ids(model_label, ids):
+    from django.apps import apps
+
+    from pybb.models import Forum
+    from pybb.models.mixins import repair_forum_ids as repair
+
+    logger = repair_forum_ids.get_logger()
+
+    model = apps.get_model(model_label)
+
+    count = 0
+
+    if model is not Forum:
+        # the forum_ids of topics are derived from the ones of their forum
+        count += repair(Forum)
+
+    count += repair(model, ids=ids)
+
+    logger.info('Repaired forum_ids of %d rows' % count)
@@ -16,7 +16,11 @@ try:
 except ImportError:
     pytils_enabled = False
 
-from pybb.models import TopicReadTracker, ForumReadTracker, PollAnswerUser
+from guardian.core import ObjectPermissionChecker
+
+from pybb.models import PollAnswerUser
+from pybb.permissions import get_permissions
+from pybb.trackers import get_read_tracker
 from pybb import defaults
 from pybb.util import tznow, timedelta, load_class
 
@@ -116,6 +120,21 @@ def pybb_forum_moderated_by(forum, user):
     return forum.is_moderated_by(user)
 
 
+@register.simple_tag
+def pybb_forum_perms(user, forum):
+    """
+    Return the permissions of the user on the forum, drop-in for guardian's
+    get_obj_perms answered from the request permission snapshot when there is one.
+    """
+
+    permissions = get_permissions(user)
+
+    if permissions is None:
+        return ObjectPermissionChecker(user).get_perms(forum)
+
+    return permissions.get_perms(forum)
+
+
 @register.filter
 def pybb_editable_by(post, user):
     """
@@ -140,42 +159,9 @@ def pybb_topic_unread(topics, user):
     """
     topic_list = list(topics)
 
-    forum_marks = {}
-
-    if user.is_authenticated:
-        for topic in topic_list:
-            topic.unread = True
-
-            if not topic.forum_id in forum_marks:
-                try:
-                    forum_mark = ForumReadTracker.objects.get(user=user, forum=topic.forum_id)
-                except:
-                    forum_mark = None
-
-                forum_marks[topic.forum_id] = forum_mark
-
-        qs = TopicReadTracker.objects.filter(
-            user=user,
-            topic__in=topic_list
-        ).select_related('topic')
-
-        if forum_marks:
-            for topic in topic_list:
-                if not topic.forum_id in forum_marks or not forum_marks[topic.forum_id]:
-                    continue
-
-                forum_mark = forum_marks[topic.forum_id]
-
-                if topic.updated and (topic.updated <= forum_mark.time_stamp):
-                    topic.unread = False
-
-        topic_marks = list(qs)
-        topic_dict = dict(((topic.id, topic) for topic in topic_list))
-
-        for mark in topic_marks:
-            if ((topic_dict[mark.topic.id].updated is None) or
-               (topic_dict[mark.topic.id].updated <= mark.time_stamp)):
-                topic_dict[mark.topic.id].unread = False
+    # querysets using annotate_unread() are already flagged
+    if user.is_authenticated and not all(hasattr(topic, 'unread') for topic in topic_list):
+        get_read_tracker().annotate_topics(topic_list, user)
 
     return topic_list
 
@@ -186,19 +172,10 @@ def pybb_forum_unread(forums, user):
     Check if forum has unread messages.
     """
     forum_list = list(forums)
-    if user.is_authenticated:
-        for forum in forum_list:
-            if forum.topic_count:
-                forum.unread = True
-        forum_marks = ForumReadTracker.objects.filter(
-            user=user,
-            forum__in=forum_list
-        ).select_related('forum')
-        forum_dict = dict(((forum.id, forum) for forum in forum_list))
-        for mark in forum_marks:
-            if ((forum_dict[mark.forum.id].updated is None) or
-               (forum_dict[mark.forum.id].updated <= mark.time_stamp)):
-                forum_dict[mark.forum.id].unread = False
+
+    if user.is_authenticated and not all(hasattr(forum, 'unread') for forum in forum_list):
+        get_read_tracker().annotate_forums(forum_list, user)
+
     return forum_list
 
 
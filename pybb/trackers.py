@@ -0,0 +1,311 @@
+from functools import lru_cache
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import BooleanField, CharField, DateTimeField, Case, Exists, F, Func, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast
+from django.utils.dateparse import parse_datetime
+
+from pybb import defaults
+from pybb.compat import update_fields
+from pybb.util import load_class, tznow
+
+
+class ModelReadTracker(object):
+    """
+    Track reads with one TopicReadTracker row per user and read topic,
+    collapsed into a ForumReadTracker once every topic of the forum is read
+    """
+
+    def mark_topic_as_read(self, topic, user):
+        from pybb.models import TopicReadTracker, ForumReadTracker, Topic
+
+        try:
+            forum_mark = ForumReadTracker.objects.get(forum=topic.forum, user=user)
+        except ObjectDoesNotExist:
+            forum_mark = None
+
+        if topic.updated and ((forum_mark is None) or (forum_mark.time_stamp < topic.updated)):
+            # Mark topic as read
+            count = TopicReadTracker.objects.filter(topic=topic, user=user).update(time_stamp=tznow())
+
+            if not count:
+                TopicReadTracker.objects.create(topic=topic, user=user)
+
+            # Check, if there are any unread topics in forum
+            read = Topic.objects.filter(
+                forum=topic.forum, topicreadtracker__user=user, topicreadtracker__time_stamp__gt=F('updated'))
+
+            unread = Topic.objects.filter(forum=topic.forum).exclude(id__in=read)
+            if forum_mark:
+                unread = unread.filter(updated__gt=forum_mark.time_stamp)
+
+            if not unread.exists():
+                # Clear all topic marks for this forum, mark forum as read
+                TopicReadTracker.objects.filter(
+                    user=user,
+                    topic__forum=topic.forum
+                ).delete()
+
+                if not forum_mark:
+                    ForumReadTracker.objects.create(forum=topic.forum, user=user)
+
+                else:
+                    forum_mark.time_stamp = tznow()
+                    update_fields(forum_mark, fields=('time_stamp', ))
+
+    def mark_forums_as_read(self, user, forums):
+        from pybb.models import TopicReadTracker, ForumReadTracker
+
+        forums = list(forums)
+
+        ForumReadTracker.objects.mark_as_read(user, forums)
+
+        TopicReadTracker.objects.filter(user=user, topic__forum__in=forums).delete()
+
+    def mark_all_as_read(self, user, forums):
+        from pybb.models import TopicReadTracker, ForumReadTracker
+
+        ForumReadTracker.objects.mark_as_read(user, list(forums))
+
+        TopicReadTracker.objects.filter(user=user).delete()
+
+    def get_last_read(self, topic, user):
+        from pybb.models import TopicReadTracker, ForumReadTracker
+
+        for model, lookup in ((TopicReadTracker, {'topic': topic}),
+                              (ForumReadTracker, {'forum': topic.forum_id})):
+            try:
+                return model.objects.get(user=user, **lookup).time_stamp
+            except model.DoesNotExist:
+                pass
+
+        return None
+
+    def annotate_topics(self, topics, user):
+        from pybb.models import TopicReadTracker, ForumReadTracker
+
+        forum_marks = dict(ForumReadTracker.objects
+                           .filter(user=user, forum__in=set(topic.forum_id for topic in topics))
+                           .values_list('forum_id', 'time_stamp'))
+
+        topic_marks = dict(TopicReadTracker.objects
+                           .filter(user=user, topic__in=topics)
+                           .values_list('topic_id', 'time_stamp'))
+
+        for topic in topics:
+            forum_mark = forum_marks.get(topic.forum_id)
+            topic_mark = topic_marks.get(topic.pk)
+
+            topic.unread = not ((forum_mark and topic.updated and topic.updated <= forum_mark) or
+                                (topic_mark and (topic.updated is None or topic.updated <= topic_mark)))
+
+    def annotate_forums(self, forums, user):
+        from pybb.models import ForumReadTracker
+
+        forum_marks = dict(ForumReadTracker.objects
+                           .filter(user=user, forum__in=forums)
+                           .values_list('forum_id', 'time_stamp'))
+
+        for forum in forums:
+            if forum.topic_count:
+                forum.unread = True
+
+            forum_mark = forum_marks.get(forum.pk)
+
+            if forum_mark and (forum.updated is None or forum.updated <= forum_mark):
+                forum.unread = False
+
+    def annotate_topics_queryset(self, queryset, user, prefix=''):
+        from pybb.models import TopicReadTracker, ForumReadTracker
+
+        updated = OuterRef(prefix + 'updated')
+        topic_marks = TopicReadTracker.objects.filter(user=user, topic=OuterRef(prefix + 'pk'))
+
+        return (queryset
+                .annotate(read_forum_mark=Exists(ForumReadTracker.objects.filter(user=user,
+                                                                                 forum=OuterRef(prefix + 'forum_id'),
+                                                                                 time_stamp__gte=updated)),
+                          read_topic_mark=Exists(topic_marks.filter(time_stamp__gte=updated)),
+                          topic_mark=Exists(topic_marks))
+                .annotate(unread=Case(When(Q(read_forum_mark=True) |
+                                           Q(read_topic_mark=True) |
+                                           Q(topic_mark=True, **{prefix + 'updated__isnull': True}),
+                                           then=Value(False)),
+                                      default=Value(True),
+                                      output_field=BooleanField())))
+
+    def annotate_forums_queryset(self, queryset, user, prefix=''):
+        from pybb.models import ForumReadTracker
+
+        forum_marks = ForumReadTracker.objects.filter(user=user, forum=OuterRef(prefix + 'pk'))
+
+        return (queryset
+                .annotate(read_forum_mark=Exists(forum_marks.filter(time_stamp__gte=OuterRef(prefix + 'updated'))),
+                          forum_mark=Exists(forum_marks))
+                .annotate(unread=Case(When(Q(read_forum_mark=True) |
+                                           Q(forum_mark=True, **{prefix + 'updated__isnull': True}),
+                                           then=Value(False)),
+                                      When(**{prefix + 'topic_count__gt': 0, 'then': Value(True)}),
+                                      default=Value(False),
+                                      output_field=BooleanField())))
+
+
+def is_read_before_mark(mark, topic):
+    return mark is not None and mark.time_stamp is not None and mark.time_stamp >= topic.updated
+
+
+class HighWaterMarkReadTracker(object):
+    """
+    Track reads with a single ForumReadMark row per user and forum holding the
+    time before which everything is read, and a sparse map of the topics read
+    after it (topic id -> ISO read time), pruned as soon as the high-water mark moves forward
+    """
+
+    def get_marks(self, user, forum_ids):
+        from pybb.models import ForumReadMark
+
+        return dict((mark.forum_id, mark)
+                    for mark in ForumReadMark.objects.filter(user=user, forum__in=forum_ids))
+
+    def mark_topic_as_read(self, topic, user):
+        from pybb.models import ForumReadMark, Topic
+
+        if not topic.updated or is_read_before_mark(self.get_marks(user, [topic.forum_id]).get(topic.forum_id), topic):
+            return
+
+        with transaction.atomic():
+            # concurrent reads of the forum wait for each other instead of
+            # failing on the unique constraint or losing entries of the map
+            mark, created = (ForumReadMark.objects
+                             .select_for_update()
+                             .get_or_create(forum_id=topic.forum_id, user=user, defaults={'topics': {}}))
+
+            if is_read_before_mark(mark, topic):
+                return
+
+            now = tznow()
+
+            others = (Topic.objects
+                      .filter(forum_id=topic.forum_id, updated__isnull=False)
+                      .exclude(pk=topic.pk))
+
+            if mark.time_stamp:
+                others = others.filter(updated__gt=mark.time_stamp)
+
+            if not created:
+                # the read times of the other topics are those already saved in the mark
+                others = self.annotate_topics_queryset(others, user).filter(unread=True)
+
+            if not others.exists():
+                mark.time_stamp, mark.topics = now, {}
+            else:
+                mark.topics = dict(mark.topics, **{str(topic.pk): now.isoformat()})
+
+            update_fields(mark, fields=('time_stamp', 'topics'))
+
+    def mark_forums_as_read(self, user, forums):
+        from pybb.models import ForumReadMark
+
+        forum_ids = [forum.pk for forum in forums]
+
+        now = tznow()
+
+        ForumReadMark.objects.filter(user=user, forum__in=forum_ids).update(time_stamp=now, topics={})
+
+        existing = set(ForumReadMark.objects.filter(user=user, forum__in=forum_ids).values_list('forum_id', flat=True))
+
+        ForumReadMark.objects.bulk_create([ForumReadMark(user=user, forum_id=forum_id, time_stamp=now, topics={})
+                                           for forum_id in forum_ids if forum_id not in existing])
+
+    def mark_all_as_read(self, user, forums):
+        self.mark_forums_as_read(user, forums)
+
+    def get_last_read(self, topic, user):
+        mark = self.get_marks(user, [topic.forum_id]).get(topic.forum_id)
+
+        if mark is None:
+            return None
+
+        read_at = mark.topics.get(str(topic.pk))
+
+        if read_at is not None:
+            return parse_datetime(read_at)
+
+        return mark.time_stamp
+
+    def annotate_topics(self, topics, user):
+        marks = self.get_marks(user, set(topic.forum_id for topic in topics))
+
+        for topic in topics:
+            mark = marks.get(topic.forum_id)
+
+            topic.unread = True
+
+            if mark is None:
+                continue
+
+            read_at = mark.topics.get(str(topic.pk))
+
+            if topic.updated is None:
+                topic.unread = read_at is None
+            elif ((mark.time_stamp and topic.updated <= mark.time_stamp) or
+                    (read_at is not None and topic.updated <= parse_datetime(read_at))):
+                topic.unread = False
+
+    def annotate_forums(self, forums, user):
+        marks = self.get_marks(user, [forum.pk for forum in forums])
+
+        for forum in forums:
+            if forum.topic_count:
+                forum.unread = True
+
+            mark = marks.get(forum.pk)
+
+            if mark and mark.time_stamp and (forum.updated is None or forum.updated <= mark.time_stamp):
+                forum.unread = False
+
+    def annotate_topics_queryset(self, queryset, user, prefix=''):
+        from pybb.models import ForumReadMark
+
+        marks = ForumReadMark.objects.filter(user=user, forum=OuterRef(prefix + 'forum_id'))
+
+        # forum_read_topics ->> 'topic id' gives the read time of the topic in the sparse map
+        read_at = Cast(Func(F('forum_read_topics'), Cast(F(prefix + 'pk'), CharField()),
+                            template='(%(expressions)s)', arg_joiner=' ->> '),
+                       DateTimeField())
+
+        updated = prefix + 'updated'
+
+        return (queryset
+                .annotate(forum_read_at=Subquery(marks.values('time_stamp')[:1]),
+                          forum_read_topics=Subquery(marks.values('topics')[:1]))
+                .annotate(topic_read_at=read_at)
+                .annotate(unread=Case(When(Q(topic_read_at__isnull=False, **{updated + '__isnull': True}),
+                                           then=Value(False)),
+                                      When(**{updated + '__isnull': True, 'then': Value(True)}),
+                                      When(Q(forum_read_at__gte=F(updated)) | Q(topic_read_at__gte=F(updated)),
+                                           then=Value(False)),
+                                      default=Value(True),
+                                      output_field=BooleanField())))
+
+    def annotate_forums_queryset(self, queryset, user, prefix=''):
+        from pybb.models import ForumReadMark
+
+        updated = prefix + 'updated'
+
+        return (queryset
+                .annotate(forum_read_at=Subquery(ForumReadMark.objects
+                                                 .filter(user=user, forum=OuterRef(prefix + 'pk'))
+                                                 .values('time_stamp')[:1]))
+                .annotate(unread=Case(When(Q(forum_read_at__isnull=False) &
+                                           (Q(**{updated + '__isnull': True}) | Q(forum_read_at__gte=F(updated))),
+                                           then=Value(False)),
+                                      When(**{prefix + 'topic_count__gt': 0, 'then': Value(True)}),
+                                      default=Value(False),
+                                      output_field=BooleanField())))
+
+
+@lru_cache()
+def get_read_tracker():
+    return load_class(defaults.PYBB_READ_TRACKER_CLASS)()
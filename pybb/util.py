@@ -4,6 +4,7 @@ import hashlib
 import six
 
 from collections import defaultdict
+from html.parser import HTMLParser
 
 from six.moves.urllib.parse import urlparse, urlunparse
 
@@ -39,6 +40,69 @@ def unescape(text):
     return text.replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"').replace('&#39;', '\'')
 
 
+class TextLimitReached(Exception):
+    pass
+
+
+class TextExtractor(HTMLParser):
+    """
+    Collect the text of an HTML document with entities decoded,
+    skipping tags, comments and the content of script and style
+    """
+    skipped_tags = ('script', 'style')
+
+    def __init__(self, max_length=None):
+        super(TextExtractor, self).__init__(convert_charrefs=True)
+
+        self.max_length = max_length
+        self.length = 0
+        self.parts = []
+        self.skipped = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skipped_tags:
+            self.skipped += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.skipped_tags and self.skipped:
+            self.skipped -= 1
+
+    def handle_data(self, data):
+        if self.skipped:
+            return
+
+        if self.max_length is not None and self.length + len(data) >= self.max_length:
+            self.parts.append(data[:self.max_length - self.length])
+            self.length = self.max_length
+
+            raise TextLimitReached
+
+        self.parts.append(data)
+        self.length += len(data)
+
+    def get_text(self):
+        return ''.join(self.parts)
+
+
+def html_to_text(html, max_length=None):
+    """
+    Return the text of ``html`` in a single pass, truncated
+    to ``max_length`` characters when it is set
+    """
+    if not html:
+        return html
+
+    extractor = TextExtractor(max_length=max_length)
+
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except TextLimitReached:
+        pass
+
+    return extractor.get_text()
+
+
 def filter_blanks(user, str):
     """
     Replace more than 3 blank lines with only 1 blank line
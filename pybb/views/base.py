@@ -25,11 +25,13 @@ from pure_pagination.paginator import Paginator, EmptyPage
 
 from pybb import defaults
 from pybb.compat import get_user_model
+from pybb.counters import defer_forum_counters, get_view_counter
+from pybb.trackers import get_read_tracker
 from pybb.models import (Forum, Topic, Post, Moderator, LogModeration, Attachment, Poll,
-                         TopicReadTracker, ForumReadTracker, PollAnswerUser, Subscription)
+                         ForumReadTracker, PollAnswerUser, Subscription)
 from pybb.models.mixins import prefetch_parent_forums
-from pybb.util import load_class, generic, queryset_to_dict, redirect_to_login
-from pybb.models.base import markup
+from pybb.util import load_class, generic, redirect_to_login
+from pybb.models.base import markup, get_forum_tree, schedule_render
 from pybb.forms import (PostForm, AdminPostForm, PostsMoveExistingTopicForm,
                         PollAnswerFormSet, AttachmentFormSet, PollForm,
                         ForumForm, ModerationForm, SearchUserForm,
@@ -57,7 +59,6 @@ class ListView(generic.ListView):
     prefetch_profiles = None
     prefetch_parent_forums = None
     allow_empty_page = False
-    forum_cache = {}
 
     def paginate_queryset(self, queryset, page_size):
         try:
@@ -72,7 +73,7 @@ class ListView(generic.ListView):
             if self.prefetch_profiles:
                 queryset = queryset.prefetch_profiles(*self.prefetch_profiles)
             if self.prefetch_parent_forums is not None:
-                queryset = prefetch_parent_forums(queryset, forum_cache_by_id=self.forum_cache, through=self.prefetch_parent_forums)
+                queryset = prefetch_parent_forums(queryset, through=self.prefetch_parent_forums)
 
             return paginator, page, queryset, is_paginated
 
@@ -85,7 +86,10 @@ class IndexView(ListView):
     def get_context_data(self, **kwargs):
         ctx = super(IndexView, self).get_context_data(**kwargs)
 
-        forums = queryset_to_dict(filter_hidden(self.request, Forum.objects.filter(forum__isnull=True)))
+        user = self.request.user
+
+        forums = dict((forum.pk, forum) for forum in get_forum_tree().get_children()
+                      if user.is_staff or user.is_superuser or forum.is_accessible_by(user))
 
         for forum in ctx['forums']:
             if forum.forum_id in forums:
@@ -106,7 +110,7 @@ class IndexView(ListView):
                                                           'last_post__user')
                                           .order_by('forum', 'position')))
 
-        return qs
+        return qs.annotate_unread(self.request.user)
 
 
 class ForumCreateView(generic.CreateView):
@@ -198,7 +202,7 @@ class ForumDetailView(BaseForumDetailView):
         qs = filter_hidden(self.request,
                            self.forum.forums.select_related('last_post__topic__forum',
                                                             'last_post__user'))
-        self.forum.forums_accessed = qs
+        self.forum.forums_accessed = qs.annotate_unread(self.request.user)
 
         for topic in ctx[self.context_object_name]:
             topic.forum = self.forum
@@ -210,7 +214,8 @@ class ForumDetailView(BaseForumDetailView):
             raise Http404
 
         qs = (self.forum.topics.order_by('-sticky', '-updated')
-              .filter_by_user(self.request.user, forum=self.forum))
+              .filter_by_user(self.request.user, forum=self.forum)
+              .annotate_unread(self.request.user))
 
         return qs
 
@@ -250,6 +255,7 @@ class TopicsLatestView(ListView):
     def get_queryset(self):
         return (self.model.objects.visible()
                 .select_related('forum')
+                .annotate_unread(self.request.user)
                 .order_by('-updated'))
 
     @method_decorator(login_required)
@@ -320,10 +326,21 @@ class UserPostsDeleteView(generic.DeleteView):
     def delete(self, request, *args, **kwargs):
         self.object = self.get_object()
 
-        self.object.posts.all().update(deleted=True)
+        topic_ids = set(self.object.posts.visible(join=False).values_list('topic_id', flat=True))
+
+        with defer_forum_counters():
+            self.object.posts.all().update(deleted=True)
+
+            deleted_topic_ids = set()
 
-        for topic in Topic.objects.filter(first_post__user=self.object):
-            topic.mark_as_deleted()
+            for topic in Topic.objects.filter(first_post__user=self.object):
+                topic.mark_as_deleted()
+
+                deleted_topic_ids.add(topic.pk)
+
+            # the bulk update bypasses the counter deltas of the posts
+            for topic in Topic.objects.filter(pk__in=topic_ids - deleted_topic_ids):
+                topic.update_counters()
 
         messages.success(self.request, _('All messages from %(user)s has been deleted') % {
             'user': self.object
@@ -389,9 +406,10 @@ class TopicDetailView(ListView):
             if page == 1:
                 return redirect(topic.get_absolute_url(), permanent=True)
 
-        topic.views += 1
+        view_counter = get_view_counter()
+        view_counter.incr(topic.pk)
 
-        Topic.objects.filter(pk=topic.pk).update(views=topic.views)
+        topic.views += view_counter.pending([topic.pk])[topic.pk]
 
         return self.render_to_response(context)
 
@@ -429,6 +447,9 @@ class TopicDetailView(ListView):
             post.topic = self.topic
             post.index = idx
 
+        # one task for every post of the page which is not rendered yet
+        schedule_render(ctx[self.context_object_name])
+
         ctx['topic'] = self.topic
         ctx['subscription_types'] = Subscription.TYPE_CHOICES
         ctx['redirect'] = self.request.GET.get('redirect', False)
@@ -904,8 +925,9 @@ class TopicBatchView(generic.FormView):
     def form_valid(self, formset):
         topics = []
 
-        for form in formset:
-            topics.append((form.topic, form.save()))
+        with defer_forum_counters():
+            for form in formset:
+                topics.append((form.topic, form.save()))
 
         return redirect(self.get_success_url(topics))
 
@@ -987,8 +1009,9 @@ class TopicsDeleteView(TopicBatchView):
     def form_valid(self, formset):
         topics = []
 
-        for form in formset:
-            topics.append(form.save())
+        with defer_forum_counters():
+            for form in formset:
+                topics.append(form.save())
 
         return redirect(self.get_success_url(topics))
 
@@ -1137,21 +1160,13 @@ class TopicTrackerRedirectView(generic.RedirectView):
     def get_redirect_url(self, **kwargs):
         topic = get_object_or_404(Topic, pk=kwargs.get('topic_id'))
 
-        tracker = None
+        last_read = get_read_tracker().get_last_read(topic, self.request.user)
 
-        try:
-            tracker = TopicReadTracker.objects.get(topic=topic, user=self.request.user)
-        except TopicReadTracker.DoesNotExist:
-            try:
-                tracker = ForumReadTracker.objects.get(forum=topic.forum, user=self.request.user)
-            except ForumReadTracker.DoesNotExist:
-                pass
-
-        if not tracker:
+        if not last_read:
             return topic.get_absolute_url()
 
         try:
-            post = topic.posts.visible().filter(created__gte=tracker.time_stamp).order_by('created')[0]
+            post = topic.posts.visible().filter(created__gte=last_read).order_by('created')[0]
         except IndexError:
             try:
                 return topic.last_post.get_absolute_url()
@@ -1505,7 +1520,12 @@ class SubscriptionListView(ListView):
     def get_context_data(self, **kwargs):
         context = super(SubscriptionListView, self).get_context_data(**kwargs)
 
-        context['topic_list'] = [subscription.topic for subscription in context[self.context_object_name]]
+        context['topic_list'] = []
+
+        for subscription in context[self.context_object_name]:
+            subscription.topic.unread = subscription.unread
+
+            context['topic_list'].append(subscription.topic)
         context['subscription_types'] = Subscription.TYPE_CHOICES
 
         return context
@@ -1514,7 +1534,8 @@ class SubscriptionListView(ListView):
         qs = (self.model.objects.order_by('-topic__updated')
               .filter(user=self.request.user)
               .select_related('topic__forum')
-              .visible())
+              .visible()
+              .annotate_unread(self.request.user))
 
         return qs
 
@@ -1561,7 +1582,7 @@ def post_preview(request, template_name='pybb/post/template.html'):
     content = request.POST.get('data')
 
     post = Post(body=content, user=request.user)
-    post.body_html = markup(content, obj=post)
+    post.body_html = markup(content, obj=post, cache=True)
     post.created = datetime.now()
 
     return render(request, template_name, {
@@ -1577,9 +1598,7 @@ class ForumMarkAsReadView(generic.View):
         return super(ForumMarkAsReadView, self).dispatch(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
-        self.model.objects.mark_as_read(request.user, filter_hidden(request, Forum))
-
-        TopicReadTracker.objects.filter(user=request.user).delete()
+        get_read_tracker().mark_all_as_read(request.user, filter_hidden(request, Forum))
 
         Subscription.objects.filter(user=request.user).update(sent=False)
 
@@ -1597,11 +1616,9 @@ class ForumMarkAsReadView(generic.View):
 
             forums = [parent_forum, ] + list(Forum.objects.children(parent_forum))
 
-            self.model.objects.mark_as_read(request.user, forums)
+            get_read_tracker().mark_forums_as_read(request.user, forums)
 
             for forum in forums:
-                TopicReadTracker.objects.filter(user=request.user, topic__forum=forum).delete()
-
                 Subscription.objects.filter(user=request.user, topic__forum=forum).update(sent=False)
 
             messages.success(request, _('Forum %s has been marked as read') % parent_forum, fail_silently=True)
@@ -0,0 +1,21 @@
+import timeit
+
+from django import test
+
+
+class BenchmarkCase(test.SimpleTestCase):
+    """
+    Time a callable on large inputs, run with ``py.test tests/benchmarks -s``
+    to print the timings
+    """
+    repeat = 3
+    number = 5
+
+    def benchmark(self, name, func, *args, **kwargs):
+        timer = timeit.Timer(lambda: func(*args, **kwargs))
+
+        best = min(timer.repeat(repeat=self.repeat, number=self.number)) / self.number
+
+        print('%s.%s: %.2fms' % (self.__class__.__name__, name, best * 1000))
+
+        return func(*args, **kwargs)
@@ -0,0 +1,27 @@
+from pybb.engines import get_markup_engine
+
+from tests.benchmarks.base import BenchmarkCase
+
+
+class MarkupEngineBenchmark(BenchmarkCase):
+    def test_bbcode(self):
+        body = ('[b]Lorem ipsum[/b] dolor sit amet, [i]consectetur[/i] adipiscing elit.\n'
+                '[quote]Sed do [url=http://www.ulule.com]eiusmod[/url] tempor[/quote]\n'
+                '[ul][li]one[/li][li]two[/li][/ul]\n') * 300
+
+        engine = get_markup_engine('pybb.engines.bbcode.BBCodeMarkupEngine')
+
+        html = self.benchmark('bbcode', engine.render_message, body)
+
+        self.assertEqual(html.count('<strong>'), 300)
+
+    def test_markdown(self):
+        body = ('**Lorem ipsum** dolor sit amet, *consectetur* adipiscing elit.\n\n'
+                '> Sed do [eiusmod](http://www.ulule.com) tempor\n\n'
+                '* one\n* two\n\n') * 300
+
+        engine = get_markup_engine('pybb.engines.markdown.MarkdownMarkupEngine')
+
+        html = self.benchmark('markdown', engine.render_message, body)
+
+        self.assertEqual(html.count('<strong>'), 300)
@@ -0,0 +1,50 @@
+from mock import patch
+
+from pybb.contrib.quotes import settings as quotes_settings
+from pybb.contrib.quotes.processors import QuoteProcessor
+
+from tests.benchmarks.base import BenchmarkCase
+
+
+def nested_quotes(depth, message='message'):
+    body = message
+
+    for level in range(depth, 0, -1):
+        body = '[quote="user%d;%d"]%s %s[/quote]' % (level, level, body, message)
+
+    return body
+
+
+class QuoteProcessorBenchmark(BenchmarkCase):
+    def render(self, body):
+        return QuoteProcessor(body).render()
+
+    @patch.object(quotes_settings, 'PYBB_QUOTES_MAX_DEPTH', 3)
+    def test_deep_nesting(self):
+        body = nested_quotes(20, 'x' * 10000)
+
+        result = self.benchmark('deep_nesting', self.render, body)
+
+        self.assertEqual(result.count('[quote='), 3)
+        self.assertEqual(result.count('[/quote]'), 3)
+
+    @patch.object(quotes_settings, 'PYBB_QUOTES_MAX_DEPTH', 2)
+    def test_long_body(self):
+        body = nested_quotes(5, 'lorem ipsum ' * 20) * 200
+
+        self.assertGreater(len(body), 200000)
+
+        result = self.benchmark('long_body', self.render, body)
+
+        self.assertEqual(result.count('[quote='), 400)
+
+    @patch.object(quotes_settings, 'PYBB_QUOTES_MAX_DEPTH', 1)
+    def test_malformed_tags(self):
+        body = '[quote' * 20000 + '[/quote]' * 20000 + 'end'
+
+        result = self.benchmark('malformed_tags', self.render, body)
+
+        self.assertEqual(result, body)
+
+        self.assertEqual(self.render('[quote="a;1"]a[quote="b;2"]b[/quote][/quote][/quote]c[quote]d'),
+                         '[quote="a;1"]a[/quote][/quote]c[quote]d')
@@ -0,0 +1,41 @@
+from django.utils.html import strip_tags
+
+from pybb.util import html_to_text, unescape
+
+from tests.benchmarks.base import BenchmarkCase
+
+
+def strip_and_unescape(html):
+    return unescape(strip_tags(html))
+
+
+class HtmlToTextBenchmark(BenchmarkCase):
+    html = ('<p>Some <strong>bold</strong> text &amp; an <a href="http://www.ulule.com/?a=1&amp;b=2">link</a></p>'
+            '<blockquote><div class="quote-author">Posted by zeus</div>'
+            '<div class="quote-message">1 &lt; 2 &quot;quoted&quot; &#39;text&#39; &eacute;t&eacute;</div></blockquote>'
+            '<img src="http://dummy.host/image.png" alt="" /><br />\n')
+
+    def test_extraction(self):
+        self.assertEqual(html_to_text(self.html),
+                         'Some bold text & an link'
+                         'Posted by zeus'
+                         '1 < 2 "quoted" \'text\' \xe9t\xe9\n')
+
+        # entities are decoded once
+        self.assertEqual(html_to_text('&amp;lt;b&amp;gt;'), '&lt;b&gt;')
+        self.assertEqual(html_to_text('<p>a<script>alert(1)</script><!-- b -->c</p>'), 'ac')
+
+        self.assertEqual(html_to_text(self.html, max_length=9), 'Some bold')
+        self.assertEqual(html_to_text(''), '')
+
+    def test_long_body(self):
+        html = self.html * 500
+
+        self.assertGreater(len(html), 100000)
+
+        expected = self.benchmark('strip_tags', strip_and_unescape, html)
+        text = self.benchmark('html_to_text', html_to_text, html)
+
+        self.assertEqual(text.replace('\xe9', '&eacute;'), expected)
+
+        self.benchmark('html_to_text_truncated', html_to_text, html, max_length=200)
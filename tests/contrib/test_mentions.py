@@ -2,11 +2,15 @@ from pybb.models.base import markup
 
 from pybb.contrib.mentions.processors import MentionProcessor
 from pybb.contrib.mentions.models import Mention
+from pybb.contrib.mentions import settings as mentions_settings
 
+from pybb.compat import get_user_model
 from pybb.models import Post
 
 from tests.base import TestCase
 
+from mock import patch
+
 
 class MentionsTest(TestCase):
     def test_processors(self):
@@ -45,3 +49,31 @@ class MentionsTest(TestCase):
         multiple_mentions.save()
 
         self.assertEqual(Mention.objects.filter(post=multiple_mentions).count(), 3)
+
+    def test_single_pass_mentions(self):
+        self.user
+        self.staff
+
+        thoasby = get_user_model().objects.create_user('thoasby', 'thoasby@example.com', 'password')
+
+        processor = MentionProcessor('@thoas and @thoasby')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(processor.render(),
+                             u'[mention=%d]thoas[/mention] and [mention=%d]thoasby[/mention]' % (self.staff.pk,
+                                                                                                 thoasby.pk))
+
+        processor = MentionProcessor('@Thoas and @thoasby, not @thoas_ghost, again @THOAS')
+
+        # the unknown username is looked up again case insensitively
+        with self.assertNumQueries(2):
+            self.assertEqual(processor.render(),
+                             u'[mention=%(staff)d]thoas[/mention] and [mention=%(by)d]thoasby[/mention], '
+                             u'not @thoas_ghost, again [mention=%(staff)d]thoas[/mention]' % {
+                                 'staff': self.staff.pk,
+                                 'by': thoasby.pk})
+
+        with patch.object(mentions_settings, 'PYBB_MENTIONS_MAX_PER_POST', 1):
+            self.assertEqual(MentionProcessor('@zeus @thoas @zeus').render(),
+                             u'[mention=%(user)d]zeus[/mention] @thoas [mention=%(user)d]zeus[/mention]' % {
+                                 'user': self.user.pk})
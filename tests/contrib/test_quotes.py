@@ -6,10 +6,13 @@ from pybb.contrib.quotes.models import Quote
 from pybb.contrib.quotes.processors import QuoteProcessor
 from pybb.contrib.quotes import settings as quotes_settings
 
+from pybb.engines import get_markup_engine
 from pybb.models import Post
 
 from tests.base import TestCase
 
+from mock import patch
+
 
 class QuotesTest(TestCase):
     def test_simple_quote(self):
@@ -88,3 +91,26 @@ class QuotesTest(TestCase):
         # negative depth deactivate the render
         quotes_settings.PYBB_QUOTES_MAX_DEPTH = -1
         self.assertEqual(qp.render(), body)
+
+    def test_prefetch_quotes_and_mentions(self):
+        post = Post.objects.create(topic=self.topic, user=self.superuser, body='second')
+
+        body = ('[quote="zeus;%(first)d"]one[/quote][quote="oleiade;%(second)d"]two[/quote]'
+                '[quote="zeus;%(first)d"]three[/quote][quote="ghost;0"]four[/quote]'
+                '[mention=%(staff)d]thoas[/mention] [mention=%(user)d]zeus[/mention] [mention=0]ghost[/mention]') % {
+            'first': self.post.pk,
+            'second': post.pk,
+            'staff': self.staff.pk,
+            'user': self.user.pk,
+        }
+
+        engine = get_markup_engine()
+
+        with patch.object(quotes_settings, 'PYBB_QUOTES_POST_URL', lambda post: '#post%d' % post.pk):
+            with self.assertNumQueries(2):
+                html = engine.render_message(body)
+
+        self.assertEqual(html.count('class="quote-message-link"'), 3)
+        self.assertIn('#post%d' % post.pk, html)
+        self.assertIn('href="/users/thoas/"', html)
+        self.assertIn('href="/users/zeus/"', html)
@@ -1,6 +1,10 @@
 from __future__ import absolute_import
 
+from mock import patch
+
 from tests.base import TestCase
+from pybb import defaults
+from pybb.engines import get_markup_engine
 from pybb.engines.bbcode import BBCodeMarkupEngine
 from pybb.engines.bbcode.formatters import FONT_FAMILIES, FONT_SIZES
 
@@ -54,3 +58,22 @@ class BBCodeMarkupEngineTest(TestCase):
             mark = markup(bbcode, obj=self.post)
 
             self.assertHTMLEqual(mark, result)
+
+    def test_engine_registry(self):
+        engine = get_markup_engine()
+
+        self.assertIs(engine, get_markup_engine())
+        self.assertIs(BBCodeMarkupEngine('[b]test[/b]').parser, engine.parser)
+
+        context = {}
+        self.assertEqual(engine.render_message('[center]test[/center]', obj=self.post, context=context),
+                         '<div style="text-align:center;">test</div>')
+        self.assertEqual(context, {})
+
+        formatters = (('mark', ('<mark>%(value)s</mark>', None)), )
+
+        with patch.object(defaults, 'PYBB_BBCODE_MARKUP_SIMPLE_FORMATTERS', formatters):
+            self.assertIsNot(get_markup_engine(), engine)
+            self.assertEqual(get_markup_engine().render_message('[mark]test[/mark]'), '<mark>test</mark>')
+
+        self.assertIs(get_markup_engine(), engine)
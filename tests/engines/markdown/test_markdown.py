@@ -0,0 +1,53 @@
+from __future__ import absolute_import
+
+import threading
+
+from tests.base import TestCase
+from pybb.engines import get_markup_engine
+from pybb.engines.markdown import MarkdownMarkupEngine, MarkdownQuoteEngine
+from pybb.models import Post
+
+
+class MarkdownMarkupEngineTest(TestCase):
+    engine_path = 'pybb.engines.markdown.MarkdownMarkupEngine'
+
+    def test_render(self):
+        self.assertEqual(MarkdownMarkupEngine('*test*').render(), '<p><em>test</em></p>')
+        self.assertEqual(MarkdownMarkupEngine('*test*').render(context={}), '<p><em>test</em></p>')
+
+        engine = get_markup_engine(self.engine_path)
+
+        self.assertIs(engine, get_markup_engine(self.engine_path))
+
+        self.assertEqual(engine.render_message('<b>raw</b> **bold**'),
+                         '<p>&lt;b&gt;raw&lt;/b&gt; <strong>bold</strong></p>')
+
+    def test_instance_reuse(self):
+        md = MarkdownMarkupEngine.get_markdown()
+
+        self.assertIs(MarkdownMarkupEngine.get_markdown(), md)
+
+        # reference links of a document do not leak into the next one
+        self.assertEqual(MarkdownMarkupEngine('[ulule][1]\n\n[1]: http://www.ulule.com').render(),
+                         '<p><a href="http://www.ulule.com">ulule</a></p>')
+        self.assertEqual(MarkdownMarkupEngine('[ulule][1]').render(), '<p>[ulule][1]</p>')
+
+        instances = []
+
+        thread = threading.Thread(target=lambda: instances.append(MarkdownMarkupEngine.get_markdown()))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(instances[0], md)
+
+    def test_quote(self):
+        post = Post(body='hello\r\n> nested\r\n\r\nworld')
+
+        body = MarkdownQuoteEngine(post, 'zeus').render()
+
+        self.assertEqual(body, '> **zeus**:\n>\n> hello\n> > nested\n>\n> world\n\n')
+
+        html = MarkdownMarkupEngine(body + 'answer').render()
+
+        self.assertTrue(html.startswith('<blockquote>'))
+        self.assertTrue(html.endswith('</blockquote>\n<p>answer</p>'))
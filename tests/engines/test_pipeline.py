@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+
+from mock import patch
+
+from django.core.signals import setting_changed
+
+from tests.base import TestCase
+from pybb import defaults
+from pybb.processors import BaseProcessor, MarkupPipeline, StageTimings, get_pipeline, markup
+from pybb.models import Post
+
+
+class MarkupPipelineTest(TestCase):
+    def change_setting(self, setting, value, enter=True):
+        setting_changed.send(sender=self.__class__, setting=setting, value=value, enter=enter)
+
+    def test_get_pipeline(self):
+        pipeline = get_pipeline()
+
+        self.assertIs(pipeline, get_pipeline())
+        self.assertEqual([name for name, stage in pipeline.stages],
+                         list(defaults.PYBB_MARKUP_PREPROCESSORS) +
+                         [defaults.PYBB_MARKUP_ENGINE] +
+                         list(defaults.PYBB_MARKUP_POSTPROCESSORS))
+
+        with patch.object(defaults, 'PYBB_MARKUP_POSTPROCESSORS', ()):
+            # the processors are only fingerprinted again when a setting changes
+            self.assertIs(get_pipeline(), pipeline)
+
+            self.change_setting('PYBB_MARKUP_POSTPROCESSORS', ())
+
+            self.assertIsNot(get_pipeline(), pipeline)
+
+            self.assertEqual(markup('[b]bold[/b] www.ulule.com'), '<strong>bold</strong> www.ulule.com')
+
+        self.change_setting('PYBB_MARKUP_POSTPROCESSORS', defaults.PYBB_MARKUP_POSTPROCESSORS, enter=False)
+
+        self.assertIs(get_pipeline(), pipeline)
+
+    def test_stage_timings(self):
+        timings = StageTimings()
+
+        pipeline = MarkupPipeline(engine=defaults.PYBB_MARKUP_ENGINE,
+                                  postprocessors=('pybb.processors.UrlizeProcessor', ),
+                                  hook=timings)
+
+        body = pipeline.render('[b]bold[/b] www.ulule.com')
+
+        self.assertEqual(body, '<strong>bold</strong> <a href="http://www.ulule.com">www.ulule.com</a>')
+
+        self.assertEqual(list(timings.stages), [defaults.PYBB_MARKUP_ENGINE, 'pybb.processors.UrlizeProcessor'])
+
+        calls, duration, size = timings.stages['pybb.processors.UrlizeProcessor']
+        self.assertEqual((calls, size), (1, len(body)))
+
+        self.assertEqual(len(timings.report()), 2)
+
+    def test_render_cache(self):
+        pipeline = get_pipeline()
+
+        body = '[b]cached[/b] %s' % self.id()
+
+        with patch.object(pipeline, 'render', side_effect=pipeline.render) as render:
+            self.assertEqual(markup(body, cache=True), '<strong>cached</strong> %s' % self.id())
+            self.assertEqual(markup(body, cache=True), '<strong>cached</strong> %s' % self.id())
+
+        self.assertEqual(render.call_count, 1)
+
+        with patch.object(defaults, 'PYBB_MARKUP_POSTPROCESSORS', ('pybb.processors.UrlizeProcessor', )):
+            self.change_setting('PYBB_MARKUP_POSTPROCESSORS', ('pybb.processors.UrlizeProcessor', ))
+
+            self.assertNotEqual(get_pipeline().version, pipeline.version)
+
+        self.change_setting('PYBB_MARKUP_POSTPROCESSORS', defaults.PYBB_MARKUP_POSTPROCESSORS, enter=False)
+
+    def test_stale_markup_version(self):
+        post = Post.objects.get(pk=self.post.pk)
+
+        self.assertEqual(post.markup_version, get_pipeline().version)
+        self.assertFalse(post.is_markup_stale())
+
+        Post.objects.filter(pk=post.pk).update(markup_version='outdated')
+
+        post = Post.objects.get(pk=post.pk)
+
+        with patch('pybb.tasks.generate_markup.delay') as delay:
+            self.assertEqual(post.get_body_html(), post.body_html)
+            self.assertEqual(post.get_body_html(), post.body_html)
+
+        delay.assert_called_once_with(post.pk)
+
+    def test_capture_images(self):
+        body = '[img]http://dummy.host/a.png?x=1[/img] <img src="http://dummy.host/b.png" /> [img]http://dummy.host/a.png?x=1[/img]'
+
+        self.post
+
+        post = Post.objects.create(topic=self.topic, user=self.user, body=body)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(post.images,
+                             ['http://dummy.host/a.png?x=1', 'http://dummy.host/b.png'])
+
+        self.assertEqual(Post.objects.get(pk=post.pk).image_urls, post.images)
+
+        # the formatter records the images when the pipeline has no capture processor
+        pipeline = MarkupPipeline(engine=defaults.PYBB_MARKUP_ENGINE)
+
+        context = {'images': []}
+        pipeline.render('[img]http://dummy.host/c.png[/img]', context=context)
+
+        self.assertEqual(context['images'], ['http://dummy.host/c.png'])
+
+        # images are cached along with the html
+        for i in range(2):
+            context = {'images': []}
+            markup(body + self.id(), context=context, cache=True)
+
+            self.assertEqual(context['images'], post.images)
+
+    def test_legacy_processor(self):
+        class LegacyProcessor(BaseProcessor):
+            def __init__(self, body, obj=None):
+                super(LegacyProcessor, self).__init__(body, obj=obj)
+
+            def render(self):
+                return self.body.upper()
+
+        with patch('pybb.processors.load_class', return_value=LegacyProcessor):
+            pipeline = MarkupPipeline(postprocessors=('tests.LegacyProcessor', ))
+
+        self.assertEqual(pipeline.render('legacy', context={'images': []}), 'LEGACY')
@@ -1,13 +1,29 @@
 import os
 import requests
 
-from pybb.models import Moderator, Post, Forum, Topic
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import caches
+from django.core.management import call_command
+
+from pybb.models import Moderator, Poll, Post, Forum, Topic, TopicParticipant
 from tests.base import TestCase
 from pybb.compat import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from pybb.counters import defer_forum_counters
+from pybb.models.mixins import (prefetch_parent_forums, relocate_subtree_topics, rewrite_subtree_forum_ids_chunked,
+                                repair_forum_ids)
+from pybb.permissions import PermissionSnapshot
+from pybb.cache import VersionedCache
+from pybb.models.base import get_moderator_ids_by_forum, get_forum_tree
+from pybb import defaults
+from pybb.processors import get_pipeline, get_render_cache_key
+from pybb.receivers import clear_forum_tree_caches
 
 from mock import patch, PropertyMock
 
-from guardian.models import UserObjectPermission
+from guardian.models import GroupObjectPermission, UserObjectPermission
 
 
 class ModelsTest(TestCase):
@@ -66,6 +82,36 @@ class ModelsTest(TestCase):
             self.assertTrue(self.post.is_accessible_by(self.staff))
             self.assertTrue(self.post.is_accessible_by(self.superuser))
 
+    def test_visible_forum_ids(self):
+        self.post
+
+        anonymous = AnonymousUser()
+
+        self.assertIn(self.topic, Topic.objects.filter_by_user(anonymous))
+
+        self.parent_forum.hidden = True
+        self.parent_forum.save()
+
+        self.assertTrue(Forum.objects.get(pk=self.forum.pk).is_hidden())
+        self.assertNotIn(self.topic, Topic.objects.filter_by_user(anonymous))
+        self.assertIn(self.topic, Topic.objects.filter_by_user(self.user))
+        self.assertIn(self.forum, Forum.objects.filter_by_user(anonymous, hidden=False))
+
+        self.parent_forum.staff = True
+        self.parent_forum.save()
+
+        user, staff = self.user, self.staff
+
+        self.assertTrue(self.forum.is_hidden())
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.forum.is_accessible_by(user))
+            self.assertTrue(self.forum.is_accessible_by(staff))
+
+        self.assertNotIn(self.topic, Topic.objects.filter_by_user(self.user))
+        self.assertNotIn(self.forum, Forum.objects.filter_by_user(self.user))
+        self.assertIn(self.topic, Topic.objects.filter_by_user(self.staff))
+
     def test_post_editable_by_users(self):
         self.assertTrue(self.post.is_editable_by(self.user))
         self.assertTrue(self.post.is_editable_by(self.staff))
@@ -86,6 +132,67 @@ class ModelsTest(TestCase):
         with patch.object(get_user_model(), 'is_authenticated', new_callable=PropertyMock, return_value=True):
             self.assertTrue(self.post.is_editable_by(self.newbie))
 
+    def test_permission_snapshot(self):
+        Moderator.objects.create(forum=self.forum, user=self.newbie)
+
+        UserObjectPermission.objects.assign_perm('can_change_post', self.newbie, obj=self.forum)
+
+        newbie = get_user_model().objects.get(pk=self.newbie.pk)
+        newbie.pybb_permissions = PermissionSnapshot(newbie)
+
+        post = Post.objects.select_related('topic__forum').get(pk=self.post.pk)
+
+        self.assertTrue(post.topic.is_moderated_by(newbie))
+
+        with self.assertNumQueries(1):
+            for i in range(5):
+                self.assertTrue(post.is_editable_by(newbie, 'can_change_post'))
+                self.assertFalse(post.topic.is_moderated_by(newbie, 'can_delete_post'))
+                self.assertFalse(self.parent_forum.is_moderated_by(newbie, 'can_change_post'))
+
+        self.assertEqual(newbie.pybb_permissions.get_perms(self.forum), ['can_change_post'])
+        self.assertEqual(newbie.pybb_permissions.get_perms(self.parent_forum), [])
+
+        # the permissions granted to the groups of the user are part of the snapshot
+        group = Group.objects.create(name='moderators')
+        group.user_set.add(newbie)
+
+        GroupObjectPermission.objects.assign_perm('can_delete_post', group, obj=self.forum)
+
+        newbie.pybb_permissions = PermissionSnapshot(newbie)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(newbie.pybb_permissions.get_perms(self.forum), ['can_change_post', 'can_delete_post'])
+            self.assertTrue(post.topic.is_moderated_by(newbie, 'can_delete_post'))
+
+    def test_moderator_cache_invalidation(self):
+        # another process memoizing the same cache
+        other = VersionedCache('moderators', get_moderator_ids_by_forum.func)
+
+        self.assertNotIn(self.newbie.pk, other()[self.forum.pk])
+
+        Moderator.objects.create(forum=self.forum, user=self.newbie)
+
+        self.assertIn(self.newbie.pk, other()[self.forum.pk])
+
+        other.start_request()
+
+        try:
+            other()
+
+            with patch.object(other, 'get_generation') as get_generation:
+                self.assertIn(self.newbie.pk, other()[self.forum.pk])
+
+            self.assertFalse(get_generation.called)
+        finally:
+            other.finish_request()
+
+        # cleared again once committed, other processes could have reloaded the old moderators meanwhile
+        with patch('pybb.receivers.transaction.on_commit') as on_commit:
+            Moderator.objects.filter(forum=self.forum, user=self.newbie).delete()
+
+        on_commit.assert_called_once_with(get_moderator_ids_by_forum.cache_clear)
+
     def test_is_posted_by(self):
         self.assertTrue(self.post.is_posted_by(self.user))
         self.assertFalse(self.post.is_posted_by(self.newbie))
@@ -159,6 +266,7 @@ class ModelsTest(TestCase):
         self.assertTrue(Topic.objects.get(pk=topic.pk).deleted)
         self.assertEquals(Topic.objects.get(pk=topic.pk).first_post, post)
         self.assertTrue(Topic.objects.get(pk=topic.pk).first_post.deleted)
+        self.assertEqual(Topic.objects.filter(pk=topic.pk).values_list('post_count', 'member_count')[0], (0, 0))
 
         self.assertEqual(Forum.objects.get(pk=forum.pk).topic_count, 0)
         self.assertEqual(Forum.objects.get(pk=forum.pk).post_count, 0)
@@ -192,6 +300,7 @@ class ModelsTest(TestCase):
         self.assertFalse(Topic.objects.get(pk=topic.pk).deleted)
         self.assertEquals(Topic.objects.get(pk=topic.pk).first_post, post)
         self.assertFalse(Topic.objects.get(pk=topic.pk).first_post.deleted)
+        self.assertEqual(Topic.objects.filter(pk=topic.pk).values_list('post_count', 'member_count')[0], (1, 1))
 
         self.assertEqual(Forum.objects.get(pk=forum.pk).post_count, 1)
         self.assertEqual(Forum.objects.get(pk=forum.pk).topic_count, 1)
@@ -254,6 +363,144 @@ class ModelsTest(TestCase):
         self.assertEquals(self.forum.member_count, 2)
         self.assertEquals(self.topic.member_count, 2)
 
+    def test_compute_move_post(self):
+        self.post
+
+        new_topic = Topic(name='foo', forum=self.parent_forum, user=self.user)
+        new_topic.save()
+
+        staff_post = Post(topic=self.topic, user=self.staff, body='my new post')
+        staff_post.save()
+
+        staff_post.topic = new_topic
+        staff_post.save()
+
+        topic = Topic.objects.get(pk=self.topic.pk)
+        self.assertEqual(topic.post_count, 1)
+        self.assertEqual(topic.member_count, 1)
+        self.assertEqual(topic.last_post, self.post)
+
+        new_topic = Topic.objects.get(pk=new_topic.pk)
+        self.assertEqual(new_topic.post_count, 1)
+        self.assertEqual(new_topic.first_post, staff_post)
+        self.assertEqual(new_topic.last_post, staff_post)
+
+        forum = Forum.objects.get(pk=self.forum.pk)
+        self.assertEqual(forum.post_count, 1)
+        self.assertEqual(forum.member_count, 1)
+
+        parent_forum = Forum.objects.get(pk=self.parent_forum.pk)
+        self.assertEqual(parent_forum.post_count, 2)
+        self.assertEqual(parent_forum.member_count, 2)
+
+        # incremental counters must match a full recount
+        for obj in (topic, new_topic, forum, parent_forum):
+            obj.update_counters()
+            obj.refresh_from_db()
+
+        self.assertEqual((topic.post_count, new_topic.post_count, forum.post_count, parent_forum.post_count),
+                         (1, 1, 1, 2))
+        self.assertEqual((forum.member_count, parent_forum.member_count), (1, 2))
+
+    def test_defer_forum_counters(self):
+        topics = [self.topic]
+
+        for i in range(2):
+            topic = Topic.objects.create(name='foo%d' % i, forum=self.forum, user=self.user)
+            Post.objects.create(topic=topic, user=self.user, body='my new post')
+            topics.append(topic)
+
+        self.assertEqual(Forum.objects.get(pk=self.parent_forum.pk).topic_count, 3)
+
+        with patch.object(Forum, 'compute', autospec=True, side_effect=Forum.compute) as compute:
+            with defer_forum_counters():
+                for topic in topics:
+                    topic.mark_as_deleted()
+
+                self.assertEqual(Forum.objects.get(pk=self.forum.pk).topic_count, 3)
+
+        computed = [call[0][0].pk for call in compute.call_args_list if call[1].get('parents') is False]
+        self.assertEqual(computed, [self.forum.pk, self.parent_forum.pk])
+
+        self.assertEqual(Forum.objects.get(pk=self.forum.pk).topic_count, 0)
+        self.assertEqual(Forum.objects.get(pk=self.parent_forum.pk).topic_count, 0)
+        self.assertEqual(Forum.objects.get(pk=self.parent_forum.pk).post_count, 0)
+
+    def test_update_counters_command_fast(self):
+        self.post
+
+        new_topic = Topic.objects.create(name='foo', forum=self.parent_forum, user=self.user)
+        first_post = Post.objects.create(topic=new_topic, user=self.user, body='my new post')
+        last_post = Post.objects.create(topic=new_topic, user=self.staff, body='my new post')
+        Post.objects.create(topic=new_topic, user=self.newbie, body='my new post', on_moderation=True)
+
+        Topic.objects.update(post_count=0, member_count=0, first_post=None, last_post=None)
+        Forum.objects.update(post_count=0, member_count=0, topic_count=0, forum_count=0, last_post=None)
+        TopicParticipant.objects.all().delete()
+
+        call_command('pybb_update_counters', fast=True, chunk_size=1, stdout=StringIO())
+
+        new_topic = Topic.objects.get(pk=new_topic.pk)
+        self.assertEqual(new_topic.post_count, 2)
+        self.assertEqual(new_topic.member_count, 2)
+        self.assertEqual(new_topic.first_post, first_post)
+        self.assertEqual(new_topic.last_post, last_post)
+        self.assertEqual(new_topic.on_moderation, Topic.MODERATION_HAS_POSTS_IN_MODERATION)
+        self.assertEqual(dict(TopicParticipant.objects.filter(topic=new_topic).values_list('user_id', 'post_count')),
+                         {self.user.pk: 1, self.staff.pk: 1})
+
+        self.assertEqual(Topic.objects.get(pk=self.topic.pk).post_count, 1)
+
+        forum = Forum.objects.get(pk=self.forum.pk)
+        self.assertEqual((forum.topic_count, forum.post_count, forum.member_count, forum.forum_count), (1, 1, 1, 0))
+        self.assertEqual(forum.last_post, self.post)
+
+        parent_forum = Forum.objects.get(pk=self.parent_forum.pk)
+        self.assertEqual((parent_forum.topic_count, parent_forum.post_count,
+                          parent_forum.member_count, parent_forum.forum_count), (2, 3, 2, 1))
+        self.assertEqual(parent_forum.last_post, last_post)
+
+    def test_update_counters_command_fast_poll(self):
+        self.post
+
+        other_topic = Topic.objects.create(name='foo', forum=self.forum, user=self.user)
+        other_post = Post.objects.create(topic=other_topic, user=self.user, body='my new post')
+
+        # a vote bumps the poll topic without any new post
+        Topic.objects.filter(pk=self.topic.pk).update(poll=Poll.objects.create(type=Poll.TYPE_SINGLE),
+                                                      updated=other_post.created + timedelta(days=1))
+
+        Forum.objects.update(last_post=None, last_topic=None)
+
+        call_command('pybb_update_counters', fast=True, chunk_size=1, stdout=StringIO())
+
+        forum = Forum.objects.get(pk=self.forum.pk)
+        self.assertEqual((forum.last_post, forum.last_topic), (other_post, other_topic))
+
+        # same choice as the slow mode
+        self.assertEqual(forum.get_last_post(), other_post)
+
+    def test_topic_participants(self):
+        self.post
+
+        staff_post = Post.objects.create(topic=self.topic, user=self.staff, body='my new post')
+        Post.objects.create(topic=self.topic, user=self.user, body='my new post')
+
+        participants = dict(TopicParticipant.objects.filter(topic=self.topic).values_list('user_id', 'post_count'))
+        self.assertEqual(participants, {self.user.pk: 2, self.staff.pk: 1})
+        self.assertEqual(set(self.topic.participants.all()), {self.user, self.staff})
+
+        staff_post.mark_as_deleted(commit=True)
+        self.assertFalse(TopicParticipant.objects.filter(topic=self.topic, user=self.staff).exists())
+        self.assertEqual(Topic.objects.get(pk=self.topic.pk).member_count, 1)
+
+        TopicParticipant.objects.all().delete()
+
+        call_command('pybb_update_participants', stdout=StringIO())
+
+        participants = dict(TopicParticipant.objects.filter(topic=self.topic).values_list('user_id', 'post_count'))
+        self.assertEqual(participants, {self.user.pk: 2})
+
     def test_move_forum(self):
         # Initial state
         topic = self.topic
@@ -299,3 +546,210 @@ class ModelsTest(TestCase):
         # move forum to one of its sub_forums
         new_parent.forum = forum
         self.assertRaises(ValueError, new_parent.save)
+
+    def test_forum_tree_cache(self):
+        topic = Topic.objects.get(pk=self.topic.pk)
+
+        get_forum_tree()
+
+        with self.assertNumQueries(0):
+            self.assertEqual([forum.name for forum in topic.parents], [self.parent_forum.name, self.forum.name])
+
+        self.parent_forum.name = 'renamed'
+        self.parent_forum.save()
+
+        topic = Topic.objects.get(pk=self.topic.pk)
+        self.assertEqual(topic.parents[0].name, 'renamed')
+
+        # counter updates leave the tree untouched
+        with patch.object(get_forum_tree, 'cache_clear') as cache_clear:
+            self.forum.compute()
+
+        self.assertFalse(cache_clear.called)
+
+        # forums are never shared between two lookups
+        self.assertIsNot(get_forum_tree().get(self.forum.pk), get_forum_tree().get(self.forum.pk))
+
+    def test_move_forum_subtree(self):
+        self.post
+
+        sub_forum = Forum.objects.create(name='sub', description='bar', forum=self.forum)
+        sub_topic = Topic.objects.create(name='sub', forum=sub_forum, user=self.user)
+
+        new_parent = Forum.objects.create(name='zfoo', description='bar')
+
+        self.forum.forum = new_parent
+        self.forum.save()
+
+        sub_forum.refresh_from_db()
+        sub_topic.refresh_from_db()
+
+        self.assertEqual(sub_forum.forum_ids, [self.forum.pk, new_parent.pk])
+        self.assertEqual(sub_topic.forum_ids, [sub_forum.pk, self.forum.pk, new_parent.pk])
+
+        def counters(forum):
+            return Forum.objects.filter(pk=forum.pk).values_list('post_count', 'member_count')[0]
+
+        self.assertEqual(counters(new_parent), (1, 1))
+        self.assertEqual(counters(self.parent_forum), (0, 0))
+
+        # relocate the topics back by chunks of one topic
+        self.forum.forum_ids = [self.parent_forum.pk]
+
+        self.assertEqual(rewrite_subtree_forum_ids_chunked(Topic, self.forum, 1), 2)
+
+        sub_topic.refresh_from_db()
+        self.assertEqual(sub_topic.forum_ids, [sub_forum.pk, self.forum.pk, self.parent_forum.pk])
+        self.assertEqual(Topic.objects.get(pk=self.topic.pk).forum_ids, [self.forum.pk, self.parent_forum.pk])
+
+        # the parents are recounted once the last chunk is applied
+        Forum.objects.filter(pk=self.forum.pk).update(forum=self.parent_forum, forum_ids=self.forum.forum_ids)
+
+        self.forum.forum_ids = [new_parent.pk]
+        rewrite_subtree_forum_ids_chunked(Topic, self.forum, 1)
+        self.forum.forum_ids = [self.parent_forum.pk]
+
+        self.assertEqual(relocate_subtree_topics(self.forum, 1, [new_parent.pk, self.parent_forum.pk]), 2)
+
+        self.assertEqual(counters(new_parent), (0, 0))
+        self.assertEqual(counters(self.parent_forum), (1, 1))
+
+    def test_repair_stale_forum_ids(self):
+        sub_forum = Forum.objects.create(name='sub', description='bar', forum=self.forum)
+        sub_topic = Topic.objects.create(name='sub', forum=sub_forum, user=self.user)
+
+        Forum.objects.filter(pk=sub_forum.pk).update(forum_ids=[sub_forum.forum_id])
+        Topic.objects.filter(pk=sub_topic.pk).update(forum_ids=[sub_forum.pk, self.forum.pk])
+
+        topics = list(Topic.objects.filter(pk=sub_topic.pk))
+
+        get_forum_tree()
+
+        with patch('pybb.tasks.repair_forum_ids.delay') as delay:
+            with self.assertNumQueries(0):
+                prefetch_parent_forums(topics)
+
+        self.assertEqual(topics[0].forum_ids, [sub_forum.pk, self.forum.pk, self.parent_forum.pk])
+        self.assertEqual([forum.pk for forum in topics[0].parents], [self.parent_forum.pk, self.forum.pk, sub_forum.pk])
+
+        delay.assert_called_once_with('pybb.topic', [sub_topic.pk])
+
+        # nothing was written by the read
+        self.assertEqual(Topic.objects.get(pk=sub_topic.pk).forum_ids, [sub_forum.pk, self.forum.pk])
+
+        call_command('pybb_repair_forum_ids', chunk_size=1, stdout=StringIO())
+
+        self.assertEqual(Forum.objects.get(pk=sub_forum.pk).forum_ids, [self.forum.pk, self.parent_forum.pk])
+        self.assertEqual(Topic.objects.get(pk=sub_topic.pk).forum_ids,
+                         [sub_forum.pk, self.forum.pk, self.parent_forum.pk])
+
+    def test_repair_forum_ids_clears_forum_tree(self):
+        sub_forum = Forum.objects.create(name='sub', description='bar', forum=self.forum)
+
+        Forum.objects.filter(pk=sub_forum.pk).update(forum_ids=[sub_forum.forum_id])
+
+        self.assertEqual(get_forum_tree().get_value(sub_forum.pk, 'forum_ids'), [self.forum.pk])
+
+        with patch('pybb.models.mixins.transaction.on_commit') as on_commit:
+            self.assertEqual(repair_forum_ids(Forum), 1)
+
+        on_commit.assert_called_once_with(clear_forum_tree_caches)
+
+        self.assertEqual(get_forum_tree().get_value(sub_forum.pk, 'forum_ids'), [self.forum.pk, self.parent_forum.pk])
+
+        with patch('pybb.models.mixins.transaction.on_commit') as on_commit:
+            self.assertEqual(repair_forum_ids(Forum), 0)
+
+        self.assertFalse(on_commit.called)
+
+    def test_rerender_command(self):
+        post = Post.objects.create(topic=self.topic, user=self.user, body='[b]bold[/b]')
+        other = Post.objects.create(topic=self.topic, user=self.user, body='plain')
+
+        Post.objects.filter(pk=post.pk).update(body_html='<p>old</p>', body_text='old')
+        Post.objects.filter(pk=other.pk).update(body_html=None, body_text=None)
+
+        out = StringIO()
+        call_command('pybb_rerender', dry_run=True, chunk_size=1, stdout=out)
+
+        self.assertIn('-<p>old</p>', out.getvalue())
+        self.assertEqual(Post.objects.get(pk=post.pk).body_html, '<p>old</p>')
+
+        call_command('pybb_rerender', only_null=True, stdout=StringIO())
+
+        self.assertEqual(Post.objects.get(pk=post.pk).body_html, '<p>old</p>')
+        self.assertIsNotNone(Post.objects.get(pk=other.pk).body_html)
+
+        out = StringIO()
+        call_command('pybb_rerender', forum=self.parent_forum.pk, chunk_size=1, stdout=out)
+
+        post.refresh_from_db()
+        self.assertIn('<strong>bold</strong>', post.body_html)
+        self.assertEqual(post.markup_version, get_pipeline().version)
+        self.assertIn('posts/s', out.getvalue())
+
+        self.assertEqual(Post.objects.rerender([post.pk, other.pk]), [])
+
+        # a forced rerender never serves the cached HTML
+        render_cache = caches[defaults.PYBB_RENDER_CACHE]
+        key = get_render_cache_key(post.body, get_pipeline().version)
+
+        render_cache.set(key, ('<p>stale</p>', {'images': []}), None)
+
+        self.assertEqual(Post.objects.rerender([post.pk]), [])
+        self.assertEqual(render_cache.get(key)[0], post.body_html)
+
+    def test_post_positions(self):
+        posts = [self.post] + [Post.objects.create(topic=self.topic, user=self.user, body='post %d' % i,
+                                                   created=self.post.created + timedelta(minutes=i + 1))
+                               for i in range(3)]
+
+        def positions():
+            return list(Post.objects.filter(topic=self.topic).order_by('created').values_list('position', flat=True))
+
+        self.assertEqual(positions(), [1, 2, 3, 4])
+        self.assertEqual(posts[3].position, 4)
+
+        posts[1].mark_as_deleted()
+        self.assertEqual(positions(), [1, None, 2, 3])
+
+        posts[2].on_moderation = True
+        posts[2].save()
+        self.assertEqual(positions(), [1, None, None, 2])
+
+        posts[1].mark_as_undeleted()
+        self.assertEqual(positions(), [1, 2, None, 3])
+
+        post = Post.objects.get(pk=posts[3].pk)
+        self.assertEqual(post.position, 3)
+
+        post.topic = self.topic
+
+        with patch.object(defaults, 'PYBB_TOPIC_PAGE_SIZE', 2):
+            with self.assertNumQueries(0):
+                self.assertEqual(post.get_page_index(), 2)
+
+            # moderators also see the hidden posts
+            self.assertEqual(post.get_page_index(self.superuser), 2)
+            self.assertEqual(post.get_anchor_url(self.superuser),
+                             '%s#post%d' % (self.topic.get_absolute_url(2), post.pk))
+
+        other = Topic.objects.create(name='other', forum=self.forum, user=self.user)
+
+        post.topic = other
+        post.save()
+
+        self.assertEqual(post.position, 1)
+        self.assertEqual(positions(), [1, 2, None])
+
+        # a post created before the last ones shifts them without renumbering the topic
+        post = Post.objects.create(topic=self.topic, user=self.user, body='backdated',
+                                   created=self.post.created + timedelta(seconds=30))
+
+        self.assertEqual(post.position, 2)
+        self.assertEqual(positions(), [1, 2, 3, None])
+
+        Post.objects.filter(topic=self.topic).update(position=None)
+        self.topic.update_counters()
+
+        self.assertEqual(positions(), [1, 2, 3, None])
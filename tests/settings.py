@@ -51,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'pybb.contrib.ban.middleware.PybbBanMiddleware',
+    'pybb.middleware.PybbPermissionMiddleware',
 ]
 
 ROOT_URLCONF = 'tests.urls'
@@ -149,6 +150,9 @@ PYBB_DUPLICATE_TOPIC_SLUG_ALLOWED = False
 
 PYBB_BAN_CHECK_TIMEOUT = 0
 
+# the views of the test process must not be flushed at exit, once the test database is gone
+PYBB_VIEW_COUNTER_FLUSH_THRESHOLD = 1
+
 PYBB_BODY_CLEANERS = [
     'pybb.util.rstrip_str',
     'pybb.util.filter_blanks',
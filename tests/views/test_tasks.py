@@ -1,7 +1,118 @@
+from mock import patch
+
 from tests.base import TestCase
-from pybb.tasks import generate_markup
+from pybb.counters import CacheViewCounter, LocalViewCounter, get_view_counter
+from pybb import defaults
+from pybb.models import Post, Topic
+from pybb.models.base import schedule_render
+from pybb.tasks import generate_markup, generate_markup_batch, flush_topic_views
+
+from django.core.cache import caches
 
 
 class TasksTest(TestCase):
     def test_generate_markup(self):
         generate_markup(self.post.pk)
+
+    def test_generate_markup_batch(self):
+        caches[defaults.PYBB_RENDER_CACHE].clear()
+
+        posts = [self.post] + [Post.objects.create(topic=self.topic, user=self.user, body='[b]post %d[/b]' % i)
+                               for i in range(3)]
+
+        post_ids = [post.pk for post in posts[1:]]
+
+        Post.objects.filter(pk__in=post_ids).update(body_html=None, body_text=None)
+
+        posts = list(Post.objects.filter(topic=self.topic).order_by('pk'))
+
+        with patch('pybb.tasks.generate_markup_batch.delay') as delay:
+            self.assertEqual(schedule_render(posts), post_ids)
+
+            # the page is viewed again before the worker caught up
+            self.assertEqual(schedule_render(posts), [])
+
+            self.assertIsNone(posts[1].get_body_html())
+
+        delay.assert_called_once_with(post_ids)
+
+        with self.assertNumQueries(2):
+            generate_markup_batch(post_ids)
+
+        self.assertEqual(sorted(Post.objects.filter(pk__in=post_ids).values_list('body_text', flat=True)),
+                         ['post 0', 'post 1', 'post 2'])
+
+    def test_flush_topic_views(self):
+        counter = CacheViewCounter()
+        counter.cache.clear()
+
+        # the default cache of the tests lives in the memory of the process
+        self.assertFalse(counter.is_available())
+
+        with patch('pybb.counters.get_view_counter', return_value=counter):
+            for i in range(3):
+                counter.incr(self.topic.pk)
+
+            self.assertEqual(counter.pending([self.topic.pk]), {self.topic.pk: 3})
+            self.assertEqual(Topic.objects.get(pk=self.topic.pk).views, 0)
+
+            # the closed generation is left to late writers until the next flush
+            flush_topic_views()
+
+            self.assertEqual(Topic.objects.get(pk=self.topic.pk).views, 0)
+            self.assertEqual(counter.pending([self.topic.pk]), {self.topic.pk: 3})
+
+            counter.incr(self.topic.pk)
+
+            flush_topic_views()
+
+            self.assertEqual(Topic.objects.get(pk=self.topic.pk).views, 3)
+            self.assertEqual(counter.pending([self.topic.pk]), {self.topic.pk: 1})
+
+            flush_topic_views()
+
+            self.assertEqual(Topic.objects.get(pk=self.topic.pk).views, 4)
+            self.assertEqual(counter.pending([self.topic.pk]), {self.topic.pk: 0})
+
+            # an evicted flush mark only rescans the last generations
+            counter.incr(self.topic.pk)
+            counter.cache.delete(counter.get_key('flushed'))
+
+            flush_topic_views()
+            flush_topic_views()
+
+            self.assertEqual(Topic.objects.get(pk=self.topic.pk).views, 5)
+
+            # a flush running elsewhere holds the lock
+            counter.incr(self.topic.pk)
+            counter.cache.add(counter.get_key('lock'), 1)
+
+            flush_topic_views()
+            flush_topic_views()
+
+            self.assertEqual(Topic.objects.get(pk=self.topic.pk).views, 5)
+            self.assertEqual(counter.pending([self.topic.pk]), {self.topic.pk: 1})
+
+            counter.cache.delete(counter.get_key('lock'))
+
+            flush_topic_views()
+            flush_topic_views()
+
+            self.assertEqual(Topic.objects.get(pk=self.topic.pk).views, 6)
+
+    def test_local_view_counter(self):
+        get_view_counter.cache_clear()
+
+        try:
+            with patch('pybb.counters.atexit.register') as register:
+                counter = get_view_counter()
+        finally:
+            get_view_counter.cache_clear()
+
+        self.assertIsInstance(counter, LocalViewCounter)
+        register.assert_called_once_with(counter.flush)
+
+        counter.incr(self.topic.pk)
+
+        self.assertEqual(Topic.objects.get(pk=self.topic.pk).views, 1)
+        self.assertEqual(counter.pending([self.topic.pk]), {self.topic.pk: 0})
@@ -1,7 +1,10 @@
 from django.urls import reverse
 from django.test.client import Client
 
-from pybb.models import ForumReadTracker, TopicReadTracker, Topic, Post, Forum
+from mock import patch
+
+from pybb.models import ForumReadTracker, ForumReadMark, TopicReadTracker, Topic, Post, Forum, Subscription
+from pybb.trackers import HighWaterMarkReadTracker, ModelReadTracker
 from pybb.compat import get_user_model
 
 from tests.base import TestCase
@@ -188,3 +191,115 @@ class TrackersTest(TestCase):
         }))
 
         self.assertRedirects(response, post.get_absolute_url(), status_code=301)
+
+    def test_high_water_mark_read_tracking(self):
+        tracker = HighWaterMarkReadTracker()
+
+        self.post
+
+        topic_1 = self.topic
+        topic_2 = Topic.objects.create(name='topic_2', forum=self.forum, user=self.user)
+        Post.objects.create(topic=topic_2, user=self.user, body='one')
+
+        topics = list(Topic.objects.filter(pk__in=[topic_1.pk, topic_2.pk]).order_by('pk'))
+        tracker.annotate_topics(topics, self.staff)
+        self.assertEqual([topic.unread for topic in topics], [True, True])
+
+        #  reading topic_1 only remembers it in the sparse map, the mark is created and
+        #  updated under a row lock, within savepoints
+        with self.assertNumQueries(9):
+            tracker.mark_topic_as_read(topic_1, self.staff)
+
+        mark = ForumReadMark.objects.get(user=self.staff, forum=self.forum)
+        self.assertIsNone(mark.time_stamp)
+        self.assertEqual(list(mark.topics.keys()), [str(topic_1.pk)])
+
+        tracker.annotate_topics(topics, self.staff)
+        self.assertEqual([topic.unread for topic in topics], [False, True])
+
+        #  reading topic_2 moves the high-water mark forward and empties the map
+        tracker.mark_topic_as_read(Topic.objects.get(pk=topic_2.pk), self.staff)
+
+        mark = ForumReadMark.objects.get(user=self.staff, forum=self.forum)
+        self.assertIsNotNone(mark.time_stamp)
+        self.assertEqual(mark.topics, {})
+
+        forums = [Forum.objects.get(pk=self.forum.pk)]
+        tracker.annotate_forums(forums, self.staff)
+        self.assertFalse(forums[0].unread)
+
+        #  a new post makes topic_1 unread again
+        Post.objects.create(topic=topic_1, user=self.user, body='two')
+
+        topics = list(Topic.objects.filter(pk__in=[topic_1.pk, topic_2.pk]).order_by('pk'))
+        tracker.annotate_topics(topics, self.staff)
+        self.assertEqual([topic.unread for topic in topics], [True, False])
+
+        tracker.mark_forums_as_read(self.staff, [self.forum])
+        tracker.annotate_topics(topics, self.staff)
+        self.assertEqual([topic.unread for topic in topics], [False, False])
+
+    def test_high_water_mark_concurrent_reads(self):
+        tracker = HighWaterMarkReadTracker()
+
+        self.post
+
+        topic_1 = self.topic
+        topic_2 = Topic.objects.create(name='topic_2', forum=self.forum, user=self.user)
+        Post.objects.create(topic=topic_2, user=self.user, body='one')
+        topic_3 = Topic.objects.create(name='topic_3', forum=self.forum, user=self.user)
+        Post.objects.create(topic=topic_3, user=self.user, body='one')
+
+        #  another request created the mark after this one found none
+        with patch.object(tracker, 'get_marks', return_value={}):
+            tracker.mark_topic_as_read(Topic.objects.get(pk=topic_2.pk), self.staff)
+            tracker.mark_topic_as_read(topic_1, self.staff)
+
+        mark = ForumReadMark.objects.get(user=self.staff, forum=self.forum)
+        self.assertIsNone(mark.time_stamp)
+        self.assertEqual(set(mark.topics.keys()), {str(topic_1.pk), str(topic_2.pk)})
+
+    def test_annotate_unread(self):
+        self.post
+
+        topic_2 = Topic.objects.create(name='topic_2', forum=self.forum, user=self.user)
+        Post.objects.create(topic=topic_2, user=self.user, body='one')
+
+        sub_forum = Forum.objects.create(name='sub_forum', forum=self.forum)
+        Post.objects.create(topic=Topic.objects.create(name='topic_3', forum=sub_forum, user=self.user),
+                            user=self.user, body='one')
+
+        for tracker in (ModelReadTracker(), HighWaterMarkReadTracker()):
+            with patch('pybb.trackers.get_read_tracker', return_value=tracker):
+                tracker.mark_topic_as_read(self.topic, self.staff)
+
+                topics = Topic.objects.filter(forum__forum_ids__contains=[self.parent_forum.pk]).order_by('pk')
+
+                annotated = dict(topics.annotate_unread(self.staff).values_list('pk', 'unread'))
+
+                topic_list = list(topics)
+                tracker.annotate_topics(topic_list, self.staff)
+
+                self.assertEqual(annotated, dict((topic.pk, topic.unread) for topic in topic_list))
+                self.assertEqual(annotated[self.topic.pk], False)
+                self.assertEqual(annotated[topic_2.pk], True)
+
+                subscription = Subscription.objects.create(topic=self.topic, user=self.staff)
+                self.assertFalse(Subscription.objects.filter(pk=subscription.pk).annotate_unread(self.staff)[0].unread)
+
+                tracker.mark_forums_as_read(self.staff, [sub_forum])
+
+                forums = Forum.objects.filter(pk__in=[self.forum.pk, sub_forum.pk]).order_by('pk')
+
+                annotated = dict(forums.annotate_unread(self.staff).values_list('pk', 'unread'))
+
+                forum_list = list(forums)
+                tracker.annotate_forums(forum_list, self.staff)
+
+                self.assertEqual(annotated, dict((forum.pk, getattr(forum, 'unread', False)) for forum in forum_list))
+                self.assertEqual(annotated, {self.forum.pk: True, sub_forum.pk: False})
+
+                subscription.delete()
+                ForumReadMark.objects.all().delete()
+                ForumReadTracker.objects.all().delete()
+                TopicReadTracker.objects.all().delete()
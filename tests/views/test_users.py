@@ -1,5 +1,7 @@
 from django.urls import reverse
 
+from pybb.models import Forum, Post, Topic, TopicParticipant
+
 from tests.base import TestCase
 
 
@@ -50,3 +52,32 @@ class UsersTest(TestCase):
         self.assertRedirects(response, reverse('pybb:user_posts', kwargs={
             'username': self.user.username
         }))
+
+    def test_user_posts_delete_counters(self):
+        self.post
+
+        topic = Topic.objects.create(name='staff topic', forum=self.forum, user=self.staff)
+        staff_post = Post.objects.create(topic=topic, user=self.staff, body='staff post')
+        Post.objects.create(topic=topic, user=self.user, body='user reply')
+
+        self.login_as(self.staff)
+
+        response = self.client.post(reverse('pybb:user_posts_delete', kwargs={
+            'username': self.user.username
+        }))
+        self.assertEqual(response.status_code, 302)
+
+        topic = Topic.objects.get(pk=topic.pk)
+
+        self.assertEqual((topic.post_count, topic.member_count), (1, 1))
+        self.assertEqual(topic.last_post, staff_post)
+        self.assertEqual(list(TopicParticipant.objects.filter(topic=topic).values_list('user', flat=True)),
+                         [self.staff.pk])
+        self.assertEqual(Post.objects.get(pk=staff_post.pk).position, 1)
+
+        self.assertTrue(Topic.objects.get(pk=self.topic.pk).deleted)
+
+        for forum in (self.forum, self.parent_forum):
+            forum = Forum.objects.get(pk=forum.pk)
+
+            self.assertEqual((forum.topic_count, forum.post_count, forum.member_count), (1, 1, 1))